@@ -0,0 +1,292 @@
+"""
+    This file contains the export of models as Python modules, generated by libCellML from the same libCellML model as
+    the CellML export.  The generated code is rewritten so that it evaluates with NumPy arrays instead of lists of
+    floats: each array has one row per state, rate or variable and one column per parameter set, so that many
+    parameter sets are evaluated by a single call.  The result is cached per model revision, like the CellML text.
+"""
+import ast
+
+import libcellml
+from django.core.cache import cache
+
+from main.functions import convert_to_cellml_model
+
+# The generated code uses the names from Python's math module, some of which are spelled differently by NumPy
+NUMPY_HEADER = """
+from numpy import *
+asin, acos, atan, atan2 = arcsin, arccos, arctan, arctan2
+asinh, acosh, atanh = arcsinh, arccosh, arctanh
+"""
+
+PYTHON_HEADER = """# Generated by libCellML from the model '{name}', revision {revision}, and rewritten to use NumPy.
+#
+# Every array holds one row per state, rate or variable and one column per parameter set.  Create the arrays with the
+# number of parameter sets, eg: create_states_array(100), then set each column before computing the rates.
+
+"""
+
+
+def get_python_cache_key(model_id, revision):
+    return "python_export_{i}_{r}".format(i=model_id, r=revision)
+
+
+def call(name, *args):
+    return ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=list(args), keywords=[])
+
+
+class NumPyTransformer(ast.NodeTransformer):
+    """
+    Rewrites the parts of the generated code which only work on single floats into their element-wise NumPy
+    equivalents.  Arithmetic, comparisons and the functions from the math module already work on arrays.
+    """
+
+    def __init__(self):
+        self._array_function = False
+
+    def visit_ImportFrom(self, node):
+        if node.module == 'math':
+            return ast.parse(NUMPY_HEADER).body
+        return node
+
+    def visit_FunctionDef(self, node):
+        # The create_*_array functions are given the number of parameter sets as an argument
+        self._array_function = node.name.startswith('create_') and node.name.endswith('_array') \
+            and not node.args.args
+        if self._array_function:
+            node.args.args = [ast.arg(arg='size', annotation=None)]
+            node.args.defaults = [ast.Constant(value=1)]
+        self.generic_visit(node)
+        self._array_function = False
+        return node
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        # eg: [nan]*STATE_COUNT -> full((STATE_COUNT, size), nan)
+        if self._array_function and isinstance(node.op, ast.Mult) and isinstance(node.left, ast.List) \
+                and len(node.left.elts) == 1:
+            shape = ast.Tuple(elts=[node.right, ast.Name(id='size', ctx=ast.Load())], ctx=ast.Load())
+            return call('full', shape, node.left.elts[0])
+        return node
+
+    def visit_IfExp(self, node):
+        # Both branches are evaluated, and each element takes its value from one or the other
+        self.generic_visit(node)
+        return call('where', node.test, node.body, node.orelse)
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        name = 'logical_and' if isinstance(node.op, ast.And) else 'logical_or'
+        result = node.values[0]
+        for value in node.values[1:]:
+            result = call(name, result, value)
+        return result
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return call('logical_not', node.operand)
+        return node
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if isinstance(node.func, ast.Name) and node.func.id == 'bool' and len(node.args) == 1:
+            return call('not_equal', node.args[0], ast.Constant(value=0.0))
+        return node
+
+
+class PythonWriter(ast.NodeVisitor):
+    """
+    Writes a module tree back out as source, for Pythons before 3.9 which have no ast.unparse.  Only the statements
+    and expressions which libCellML's Python profile generates are written, and every compound expression is put in
+    brackets, so that the precedence of the operators never has to be worked out.
+    """
+    OPERATORS = {
+        ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/', ast.FloorDiv: '//', ast.Mod: '%', ast.Pow: '**',
+        ast.MatMult: '@', ast.LShift: '<<', ast.RShift: '>>', ast.BitOr: '|', ast.BitXor: '^', ast.BitAnd: '&',
+        ast.UAdd: '+', ast.USub: '-', ast.Invert: '~', ast.Not: 'not ', ast.And: 'and', ast.Or: 'or',
+        ast.Eq: '==', ast.NotEq: '!=', ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>=', ast.Is: 'is',
+        ast.IsNot: 'is not', ast.In: 'in', ast.NotIn: 'not in',
+    }
+
+    def write(self, tree):
+        return "\n".join(self.visit(tree)) + "\n"
+
+    def generic_visit(self, node):
+        raise ValueError("Cannot write a {} as Python".format(type(node).__name__))
+
+    def block(self, statements):
+        return ["    " + line for statement in statements for line in self.visit(statement)]
+
+    # Statements, each written as a list of lines
+    def visit_Module(self, node):
+        return [line for statement in node.body for line in self.visit(statement)]
+
+    def visit_Import(self, node):
+        return ["import " + ", ".join([self.visit(name) for name in node.names])]
+
+    def visit_ImportFrom(self, node):
+        return ["from {m} import {n}".format(m="." * (node.level or 0) + (node.module or ""),
+                                             n=", ".join([self.visit(name) for name in node.names]))]
+
+    def visit_alias(self, node):
+        return node.name if node.asname is None else "{n} as {a}".format(n=node.name, a=node.asname)
+
+    def visit_Assign(self, node):
+        return [" = ".join([self.visit(target) for target in node.targets] + [self.visit(node.value)])]
+
+    def visit_AugAssign(self, node):
+        return ["{t} {o}= {v}".format(t=self.visit(node.target), o=self.OPERATORS[type(node.op)],
+                                      v=self.visit(node.value))]
+
+    def visit_Expr(self, node):
+        return [self.visit(node.value)]
+
+    def visit_Return(self, node):
+        return ["return" if node.value is None else "return " + self.visit(node.value)]
+
+    def visit_Pass(self, node):
+        return ["pass"]
+
+    def visit_FunctionDef(self, node):
+        args = node.args
+        defaults = [None] * (len(args.args) - len(args.defaults)) + args.defaults
+        written = [arg.arg if default is None else "{a}={d}".format(a=arg.arg, d=self.visit(default))
+                   for arg, default in zip(args.args, defaults)]
+        if args.vararg is not None:
+            written.append("*" + args.vararg.arg)
+        if args.kwarg is not None:
+            written.append("**" + args.kwarg.arg)
+        return ["@" + self.visit(decorator) for decorator in node.decorator_list] + \
+            ["", "def {n}({a}):".format(n=node.name, a=", ".join(written))] + self.block(node.body)
+
+    def visit_ClassDef(self, node):
+        return ["", "class {n}({b}):".format(n=node.name, b=", ".join([self.visit(base) for base in node.bases]))] \
+            + self.block(node.body)
+
+    def visit_If(self, node):
+        lines = ["if {}:".format(self.visit(node.test))] + self.block(node.body)
+        if node.orelse:
+            lines += ["else:"] + self.block(node.orelse)
+        return lines
+
+    def visit_For(self, node):
+        lines = ["for {t} in {i}:".format(t=self.visit(node.target), i=self.visit(node.iter))] + self.block(node.body)
+        if node.orelse:
+            lines += ["else:"] + self.block(node.orelse)
+        return lines
+
+    # Expressions, each written as a string
+    def visit_Name(self, node):
+        return node.id
+
+    def visit_Constant(self, node):
+        text = repr(node.value)
+        return "({})".format(text) if text.startswith("-") else text
+
+    def visit_Attribute(self, node):
+        return "{v}.{a}".format(v=self.visit(node.value), a=node.attr)
+
+    def visit_BinOp(self, node):
+        return "({l} {o} {r})".format(l=self.visit(node.left), o=self.OPERATORS[type(node.op)],
+                                      r=self.visit(node.right))
+
+    def visit_UnaryOp(self, node):
+        return "({o}{v})".format(o=self.OPERATORS[type(node.op)], v=self.visit(node.operand))
+
+    def visit_BoolOp(self, node):
+        return "({})".format(" {} ".format(self.OPERATORS[type(node.op)]).join([self.visit(x) for x in node.values]))
+
+    def visit_Compare(self, node):
+        return "({})".format(" ".join([self.visit(node.left)] + [
+            "{o} {c}".format(o=self.OPERATORS[type(op)], c=self.visit(comparator))
+            for op, comparator in zip(node.ops, node.comparators)]))
+
+    def visit_IfExp(self, node):
+        return "({b} if {t} else {o})".format(b=self.visit(node.body), t=self.visit(node.test),
+                                              o=self.visit(node.orelse))
+
+    def visit_Call(self, node):
+        return "{f}({a})".format(f=self.visit(node.func), a=", ".join([self.visit(x) for x in node.args] + [
+            "**" + self.visit(x.value) if x.arg is None else "{k}={v}".format(k=x.arg, v=self.visit(x.value))
+            for x in node.keywords]))
+
+    def visit_Starred(self, node):
+        return "*" + self.visit(node.value)
+
+    def visit_Subscript(self, node):
+        return "{v}[{s}]".format(v=self.visit(node.value), s=self.visit(node.slice))
+
+    def visit_Index(self, node):
+        # Only found in the trees of Python 3.8
+        return self.visit(node.value)
+
+    def visit_Slice(self, node):
+        text = ":".join(["" if x is None else self.visit(x) for x in [node.lower, node.upper]])
+        return text if node.step is None else "{t}:{s}".format(t=text, s=self.visit(node.step))
+
+    def visit_List(self, node):
+        return "[{}]".format(", ".join([self.visit(x) for x in node.elts]))
+
+    def visit_Tuple(self, node):
+        return "({})".format(", ".join([self.visit(x) for x in node.elts]) + ("," if len(node.elts) == 1 else ""))
+
+    def visit_Dict(self, node):
+        return "{{{}}}".format(", ".join([
+            "**" + self.visit(v) if k is None else "{k}: {v}".format(k=self.visit(k), v=self.visit(v))
+            for k, v in zip(node.keys, node.values)]))
+
+
+def unparse_python(tree):
+    """
+    :param tree: module tree
+    :return: the module as source, written by ast.unparse where there is one
+    """
+    if hasattr(ast, 'unparse'):
+        return ast.unparse(tree) + "\n"
+    return PythonWriter().write(tree)
+
+
+def vectorize_python_code(python_code):
+    """
+    :param python_code: module generated by libCellML's Python profile
+    :return: the same module, rewritten to work on NumPy arrays of parameter sets
+    """
+    tree = NumPyTransformer().visit(ast.parse(python_code))
+    ast.fix_missing_locations(tree)
+    return unparse_python(tree)
+
+
+def generate_python_code(in_model):
+    """
+    :param in_model: CellModel instance
+    :return: Python module as a string, as generated by libCellML
+    """
+    out_model = convert_to_cellml_model(in_model)
+    # Interface types are not stored, so are worked out from the connections, and the units are linked by name
+    out_model.fixVariableInterfaces()
+    out_model.linkUnits()
+
+    analyser = libcellml.Analyser()
+    analyser.analyseModel(out_model)
+    if analyser.errorCount() > 0:
+        raise ValueError("Could not generate code for the model '{m}': {e}".format(m=in_model.name, e="; ".join(
+            [analyser.error(e).description() for e in range(0, analyser.errorCount())])))
+
+    return libcellml.Generator().implementationCode(
+        analyser.analyserModel(), libcellml.GeneratorProfile(libcellml.GeneratorProfile.Profile.PYTHON))
+
+
+def get_python_code(in_model):
+    """
+    Generates the vectorized Python module for a model, or returns the module generated before if nothing in the
+    model has changed since.
+    :param in_model: CellModel instance, with a current revision
+    :return: Python module as a string
+    """
+    key = get_python_cache_key(in_model.id, in_model.revision)
+    python_code = cache.get(key)
+    if python_code is None:
+        python_code = PYTHON_HEADER.format(name=in_model.name, revision=in_model.revision) + \
+            vectorize_python_code(generate_python_code(in_model))
+        cache.set(key, python_code, timeout=None)
+    return python_code
@@ -0,0 +1,163 @@
+"""
+    This file contains the closure table of the items in a model, see ItemContainment.  It holds a row for every item
+    and every item which contains it, however deep, following the same relations as DOWNSTREAM_VALIDATION_DICT:
+    model -> encapsulated components and units, component -> child components, variables, maths and resets.
+
+    The rows are written again, with a few queries, whenever they are needed and the revision of the model has changed
+    since they were written.  The errors of everything inside an item can then be read with one query, instead of
+    walking down the tree with a query for each item.
+"""
+from django.db import transaction
+from django.db.models import CharField, F, Value
+
+from main.models import ItemContainment, CellModel, Component, Variable, Math, Reset, CompoundUnit
+
+# The types of item which can be inside a component, by the name of their relation to it
+COMPONENT_CONTENTS = [
+    ('variable', Variable),
+    ('math', Math),
+    ('reset', Reset),
+]
+
+# The types of item which can be inside another, and hold errors
+CONTAINED_TYPES = [
+    ('component', Component),
+    ('compoundunit', CompoundUnit),
+] + COMPONENT_CONTENTS
+
+
+def build_containment(model):
+    """
+    :param model: CellModel instance
+    :return: list of unsaved ItemContainment instances for the model and everything in it
+    """
+    # The components of the model, and any others encapsulated by them
+    parents = {}
+    for component_id, parent_id, parent_model_id in Component.objects.filter(model=model).values_list(
+            'id', 'parent_component_id', 'parent_model_id'):
+        parents[component_id] = (parent_id, parent_model_id)
+    for component_id, parent_id, parent_model_id in Component.objects.filter(parent_model=model).exclude(
+            id__in=list(parents)).values_list('id', 'parent_component_id', 'parent_model_id'):
+        parents[component_id] = (parent_id, parent_model_id)
+    frontier = set(parents)
+    while frontier:
+        found = list(Component.objects.filter(parent_component_id__in=frontier).exclude(
+            id__in=list(parents)).values_list('id', 'parent_component_id', 'parent_model_id'))
+        for component_id, parent_id, parent_model_id in found:
+            parents[component_id] = (parent_id, parent_model_id)
+        frontier = set([row[0] for row in found])
+
+    children = {}
+    for component_id, (parent_id, parent_model_id) in parents.items():
+        if parent_id in parents:
+            children.setdefault(('component', parent_id), []).append(('component', component_id))
+        if parent_model_id == model.id:
+            children.setdefault(('cellmodel', model.id), []).append(('component', component_id))
+    for item_type, item_class in COMPONENT_CONTENTS:
+        for item_id, component_id in item_class.objects.filter(component_id__in=list(parents)).values_list(
+                'id', 'component_id'):
+            children.setdefault(('component', component_id), []).append((item_type, item_id))
+    for cu_id in CompoundUnit.objects.filter(models=model).values_list('id', flat=True):
+        children.setdefault(('cellmodel', model.id), []).append(('compoundunit', cu_id))
+
+    # Each container is linked to everything below it, at the depth it is first reached
+    revision = CellModel.objects.filter(id=model.id).values_list('revision', flat=True).first() or 0
+    rows = [ItemContainment(model_id=model.id, ancestor_type='cellmodel', ancestor_id=model.id,
+                            descendant_type='cellmodel', descendant_id=model.id, depth=0, revision=revision)]
+    for ancestor in [('cellmodel', model.id)] + [('component', x) for x in sorted(parents)]:
+        depths = {}
+        level = children.get(ancestor, [])
+        depth = 1
+        while level:
+            level = set([x for x in level if x not in depths and x != ancestor])
+            for item in level:
+                depths[item] = depth
+            level = [child for item in level for child in children.get(item, [])]
+            depth += 1
+        rows.extend([ItemContainment(model_id=model.id, ancestor_type=ancestor[0], ancestor_id=ancestor[1],
+                                     descendant_type=item_type, descendant_id=item_id, depth=depth,
+                                     revision=revision)
+                     for (item_type, item_id), depth in depths.items()])
+    return rows
+
+
+def update_containment(model):
+    """
+    Writes the closure table of the model again, unless it was written at the model's current revision.
+    :param model: CellModel instance
+    """
+    # The model's own row holds the revision at which the rows were written
+    if ItemContainment.objects.filter(model_id=model.id, ancestor_type='cellmodel', ancestor_id=model.id, depth=0,
+                                      revision=F('model__revision')).exists():
+        return
+    rows = build_containment(model)
+    with transaction.atomic():
+        ItemContainment.objects.filter(model_id=model.id).delete()
+        # Another process may have written the same rows in the meantime
+        ItemContainment.objects.bulk_create(rows, ignore_conflicts=True)
+
+
+def get_subtree_errors(item_type, item_id, model_id):
+    """
+    Reads the errors of everything inside an item with one query.  The closure table must be up to date.
+    :param item_type: 'cellmodel' or 'component'
+    :param item_id: id of the item
+    :param model_id: id of the model whose closure table holds the item
+    :return: list of (item type, item id, item name, spec, hints) tuples, ordered by item type and id
+    """
+    inside = ItemContainment.objects.filter(model_id=model_id, ancestor_type=item_type, ancestor_id=item_id,
+                                            depth__gt=0)
+    queries = []
+    for descendant_type, item_class in CONTAINED_TYPES:
+        through = item_class.errors.through
+        queries.append(through.objects.filter(**{
+            descendant_type + '_id__in': inside.filter(descendant_type=descendant_type).values('descendant_id')
+        }).annotate(
+            item_type=Value(descendant_type, output_field=CharField()),
+            item_id=F(descendant_type + '_id'),
+            item_name=F(descendant_type + '__name'),
+            spec=F('itemerror__spec'),
+            hints=F('itemerror__hints'),
+            error_id=F('itemerror_id'),
+        ).values_list('item_type', 'item_id', 'item_name', 'spec', 'hints', 'error_id'))
+    rows = queries[0].union(*queries[1:], all=True).order_by('item_type', 'item_id', 'error_id')
+    return [row[:5] for row in rows]
+
+
+def get_error_tree_rows(item):
+    """
+    :param item: any item which can hold errors
+    :return: list of (item type, item id, item name, spec, hints) tuples for the errors of everything inside the item,
+    or None if the item is not in a model's closure table
+    """
+    item_type = type(item).__name__.lower()
+    if item_type == 'cellmodel':
+        model = item
+    elif item_type == 'component' and item.model_id is not None:
+        model = CellModel(id=item.model_id)
+    elif item_type == 'component':
+        return None
+    else:
+        # Nothing is inside the other types of item
+        return []
+    update_containment(model)
+    return get_subtree_errors(item_type, item.id, model.id)
+
+
+def get_subtree_items(item):
+    """
+    :param item: CellModel or Component instance
+    :return: list of (item type, item id) tuples for the item and everything inside it, containers before what they
+    contain, or None if the item is not in a model's closure table
+    """
+    item_type = type(item).__name__.lower()
+    if item_type == 'cellmodel':
+        model_id = item.id
+    elif item_type == 'component' and item.model_id is not None:
+        model_id = item.model_id
+    else:
+        return None
+    update_containment(CellModel(id=model_id))
+    return [(item_type, item.id)] + list(ItemContainment.objects.filter(
+        model_id=model_id, ancestor_type=item_type, ancestor_id=item.id, depth__gt=0).order_by(
+        'depth', 'descendant_type', 'descendant_id').values_list('descendant_type', 'descendant_id'))
@@ -0,0 +1,124 @@
+"""
+    This file contains the grouping of equivalent variables into classes, used to export the connections of a model,
+    and the search for cycles of equivalences, used to validate it.  Both work in a single pass over the stored
+    equivalences, so the cost grows linearly with the number of links rather than with the square of the number of
+    variables.
+"""
+
+
+class EquivalenceClasses(object):
+    def __init__(self):
+        self._parent = {}
+        self._size = {}
+
+    def __iter__(self):
+        # Every item which has been added to a class
+        return iter(self._parent)
+
+    def find(self, item):
+        """
+        :param item: any hashable, eg: a Variable id
+        :return: the representative of the class containing item
+        """
+        if item not in self._parent:
+            self._parent[item] = item
+            self._size[item] = 1
+            return item
+
+        root = item
+        while self._parent[root] != root:
+            root = self._parent[root]
+        # Point everything on the path straight at the root, so the next search is shorter
+        while self._parent[item] != root:
+            self._parent[item], item = root, self._parent[item]
+        return root
+
+    def union(self, item_1, item_2):
+        """
+        Merges the classes of the two items.
+        :return: False if they were already in the same class, True otherwise
+        """
+        root_1 = self.find(item_1)
+        root_2 = self.find(item_2)
+        if root_1 == root_2:
+            return False
+        if self._size[root_1] < self._size[root_2]:
+            root_1, root_2 = root_2, root_1
+        self._parent[root_2] = root_1
+        self._size[root_1] += self._size[root_2]
+        return True
+
+
+def find_connections(pairs, variables):
+    """
+    Chooses the equivalences to export for a model.  Each class of equivalent variables is written with the stored
+    links which join it together, leaving out any link between two variables which the links already chosen make
+    equivalent anyway, so that the exported model has the same classes as the stored one.
+    :param pairs: iterable of (variable id, variable id) tuples, one for each stored equivalence in either or both
+    directions
+    :param variables: dictionary of {variable id: (component id, variable name)} for the variables in the model,
+    links to any other variable are left out
+    :return: list of (component_1 id, component_2 id, [(variable_1 name, variable_2 name), ...]) tuples, one for each
+    connection, where component_1 has the lower id
+    """
+    classes = EquivalenceClasses()
+    connections = {}
+
+    # Each link is stored in both directions, and is sorted so that the result does not depend on query order
+    for variable_1, variable_2 in sorted(set([tuple(sorted(pair)) for pair in pairs])):
+        if variable_1 not in variables or variable_2 not in variables:
+            continue
+        if not classes.union(variable_1, variable_2):
+            continue
+
+        component_1, name_1 = variables[variable_1]
+        component_2, name_2 = variables[variable_2]
+        if component_1 > component_2:
+            component_1, name_1, component_2, name_2 = component_2, name_2, component_1, name_1
+        connections.setdefault((component_1, component_2), []).append((name_1, name_2))
+
+    return [(component_1, component_2, names) for (component_1, component_2), names in connections.items()]
+
+
+def find_cycles(pairs):
+    """
+    Finds a set of independent cycles in the graph of equivalences.  A depth-first search visits each variable and
+    link once, and every link which does not join a variable to a new one closes exactly one cycle, which is reported
+    as that link and the search's path between its ends.  Any other cycle in the graph is made up of these ones.
+    :param pairs: iterable of (variable id, variable id) tuples, one for each link in either or both directions
+    :return: list of cycles, each a list of variable ids which starts and ends with the same variable
+    """
+    cycles = []
+    neighbours = {}
+    for variable_1, variable_2 in sorted(set([tuple(sorted(pair)) for pair in pairs])):
+        if variable_1 == variable_2:
+            cycles.append([variable_1, variable_1])
+            continue
+        neighbours.setdefault(variable_1, []).append(variable_2)
+        neighbours.setdefault(variable_2, []).append(variable_1)
+
+    parents = {}
+    depths = {}
+    for root in sorted(neighbours):
+        if root in parents:
+            continue
+        parents[root] = None
+        depths[root] = 0
+        stack = [(root, iter(neighbours[root]))]
+        while stack:
+            variable, remaining = stack[-1]
+            for neighbour in remaining:
+                if neighbour not in parents:
+                    parents[neighbour] = variable
+                    depths[neighbour] = depths[variable] + 1
+                    stack.append((neighbour, iter(neighbours[neighbour])))
+                    break
+                # Every other link leads back to a variable above this one, and is only counted from the lower end
+                if neighbour != parents[variable] and depths[neighbour] < depths[variable]:
+                    cycle = [variable]
+                    while cycle[-1] != neighbour:
+                        cycle.append(parents[cycle[-1]])
+                    cycles.append(cycle + [variable])
+            else:
+                stack.pop()
+    return cycles
@@ -0,0 +1,155 @@
+"""
+    This file contains the functions needed to export many models to a zip archive in one operation.  The models are
+    read from the database in chunks by the calling process, printed as CellML by libCellML, and each document is
+    written to the archive as soon as it is printed, so that only one chunk of models is held in memory at a time.
+
+    Only export_cellml_models, used by the export_models command, prints in a pool of worker processes.  The archive
+    streamed by the web view is printed in the process serving the request, so that a request never forks workers or
+    closes the database connections of the server.
+
+    The models are read by prefetch_for_export, and a pickled model instance carries its prefetched items with it, so
+    the workers can convert them without a database connection of their own.  Models whose current revision has been
+    printed before are taken from the cache instead of being printed again.
+"""
+import re
+import time
+import zipfile
+from multiprocessing import Pool
+
+import libcellml
+from django.core.cache import cache
+from django.db import connections
+
+from main.functions import convert_to_cellml_model, get_cellml_cache_key, prefetch_for_export
+from main.models import CellModel
+
+# Number of models read from the database, and held in memory, at once
+EXPORT_CHUNK_SIZE = 50
+
+EXPORT_ERRORS_FILE = 'export_errors.txt'
+
+
+def get_export_file_name(model_id, model_name):
+    # The id keeps the names unique when several models share a name
+    return "{i}_{n}.cellml".format(i=model_id, n=re.sub(r'[^\w.-]+', '_', model_name or 'model'))
+
+
+def print_cellml_model(in_model):
+    """
+    Prints one model in a worker process.
+    :param in_model: CellModel instance read by prefetch_for_export
+    :return: dictionary of model id, revision, CellML text, errors and time taken
+    """
+    start = time.time()
+    result = {
+        'model_id': in_model.id,
+        'revision': in_model.revision,
+        'text': None,
+        'errors': [],
+    }
+    try:
+        printer = libcellml.Printer()
+        result['text'] = printer.printModel(convert_to_cellml_model(in_model, prefetched=True))
+    except Exception as e:
+        result['errors'] = ["{}: {}".format(type(e).__name__, e.args)]
+    result['print_time'] = time.time() - start
+    return result
+
+
+def write_cellml_models(models, archive, map_function=map, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Writes every model in a queryset to an open zip archive, one file per model.
+    :param models: CellModel queryset
+    :param archive: zipfile.ZipFile instance opened for writing
+    :param map_function: (optional) function mapping print_cellml_model over a list of models, lazily and in order,
+    such as the imap of a pool.  Defaults to printing in this process
+    :param chunk_size: (optional) number of models read from the database at once
+    :return: generator of report dictionaries, each yielded once its file has been written to the archive
+    """
+    listed = list(models.order_by('id').values_list('id', 'name', 'revision'))
+    names = {model_id: name for model_id, name, revision in listed}
+    failed = []
+
+    for first in range(0, len(listed), chunk_size):
+        chunk = listed[first:first + chunk_size]
+
+        keys = {get_cellml_cache_key(model_id, revision): model_id for model_id, name, revision in chunk}
+        cached = {keys[key]: text for key, text in cache.get_many(list(keys)).items()}
+
+        for model_id, name, revision in chunk:
+            if model_id in cached:
+                archive.writestr(get_export_file_name(model_id, name), cached[model_id])
+                yield {'model_id': model_id, 'file': get_export_file_name(model_id, name), 'status': 'cached',
+                       'errors': [], 'print_time': None}
+
+        to_print = prefetch_for_export(CellModel.objects.filter(
+            id__in=[model_id for model_id, name, revision in chunk if model_id not in cached])).order_by('id')
+
+        for result in map_function(print_cellml_model, list(to_print)):
+            entry = {
+                'model_id': result['model_id'],
+                'file': get_export_file_name(result['model_id'], names[result['model_id']]),
+                'status': 'printed',
+                'errors': result['errors'],
+                'print_time': result['print_time'],
+            }
+            if result['errors']:
+                entry['status'] = 'print_error'
+                failed.append(entry)
+            else:
+                archive.writestr(entry['file'], result['text'])
+                cache.set(get_cellml_cache_key(result['model_id'], result['revision']), result['text'],
+                          timeout=None)
+            yield entry
+
+    if failed:
+        archive.writestr(EXPORT_ERRORS_FILE, "\n".join(
+            ["{f}: {e}".format(f=entry['file'], e="; ".join(entry['errors'])) for entry in failed]))
+
+
+def export_cellml_models(models, path, processes=None):
+    """
+    Exports every model in a queryset to a zip file.
+    :param models: CellModel queryset
+    :param path: location of the zip file to write
+    :param processes: (optional) number of printing processes, defaults to the number of cores
+    :return: list of report dictionaries, one per model, in the order the files were written
+    """
+    # The workers never touch the database, but must not inherit an open connection either
+    connections.close_all()
+
+    with Pool(processes=processes) as pool:
+        with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            return list(write_cellml_models(models, archive, map_function=pool.imap))
+
+
+class ZipStream(object):
+    # A write-only file object for zipfile which keeps what was written until it is collected
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def collect(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_cellml_models(models):
+    """
+    Exports every model in a queryset as a zip archive which is returned piece by piece, for a streaming response.
+    The models are printed one at a time in this process.
+    :param models: CellModel queryset
+    :return: generator of bytes
+    """
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for entry in write_cellml_models(models, archive):
+            yield stream.collect()
+    yield stream.collect()
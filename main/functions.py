@@ -3,13 +3,18 @@ import xml.etree.ElementTree as ElementTree
 import libcellml
 from django.contrib import messages
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import ForeignKey, ManyToManyField, AutoField, ManyToOneRel, ManyToManyRel
+from django.core.cache import cache
+from django.db.models import ForeignKey, ManyToManyField, AutoField, ManyToOneRel, ManyToManyRel, Prefetch
 from django.forms import modelform_factory
 from django.shortcuts import redirect
 
+from main.containment import get_error_tree_rows
 from main.defines import DOWNSTREAM_VALIDATION_DICT, LOCAL_DICT, BREADCRUMB_DICT
+from main.equivalence import find_connections
+from main.hashing import hash_model_units, hash_component, hash_base_units
+from main.load import load_model_in_bulk
 from main.models import Variable, CellModel, Component, Reset, CompoundUnit, Unit, \
-    Math, Prefix, Person
+    Math, Prefix, Person, StorageTreeNode, mark_dirty
 
 
 def is_standard_unit(unit):
@@ -28,29 +33,39 @@ def add_child_errors(parent, tree):
     return tree
 
 
+def get_error_tree(item):
+    """
+    :param item: any item which can hold errors
+    :return: list of (item type, item id, item name, spec, hints) tuples for the errors of everything inside the item
+    """
+    rows = get_error_tree_rows(item)
+    if rows is not None:
+        return rows
+
+    # Items outside any model are not in a closure table, so their children are read one at a time
+    tree = set(add_child_errors(item, []))
+    return [(child_type, child_item.id, child_item.name, err.spec, err.hints)
+            for child_item, child_type, errors in tree for err in errors]
+
+
 def draw_error_tree(item):
-    tree = []
-    tree = add_child_errors(item, tree)
-    tree = set(tree)
+    tree = get_error_tree(item)
     tree_html = '<table class ="display table" id="table-info" ><thead><tr><th>Specification reference</th>' \
                 '<th>Message</th><th>Go to item</th></tr></thead><tbody>'
 
-    for child_item, child_type, errors in tree:
-        for err in errors:
-            tree_html += "<tr>"
-            tree_html += "<td>" + err.spec + "</td>"
-            tree_html += "<td>" + err.hints + "</td>"
-            tree_html += "<td><a href = '/display/" + child_type + "/" + str(child_item.id) + "'>"
-            tree_html += "Open <i>" + child_item.name + "</i></a></td></tr>"
+    for child_type, child_id, child_name, spec, hints in tree:
+        tree_html += "<tr>"
+        tree_html += "<td>" + spec + "</td>"
+        tree_html += "<td>" + hints + "</td>"
+        tree_html += "<td><a href = '/display/" + child_type + "/" + str(child_id) + "'>"
+        tree_html += "Open <i>" + child_name + "</i></a></td></tr>"
 
     tree_html += '</tbody></table>'
     return tree_html, len(tree)
 
 
 def draw_error_branch(item):
-    tree = []
-    tree = add_child_errors(item, tree)
-    tree = set(tree)
+    tree = get_error_tree(item)
     tree_html = ""
     for err in item.errors.all():
         tree_html += "<tr class='validity_list_False'>" + \
@@ -59,14 +74,13 @@ def draw_error_branch(item):
                      "<td>" + err.hints + "</td>" + \
                      "<td></td></tr>"
 
-    for child_item, child_type, errors in tree:
-        for err in errors:
-            tree_html += "<tr class='validity_list_False'>" + \
-                         "<td class='validity_icon_False'></td>" + \
-                         "<td>" + err.spec + "</td>" + \
-                         "<td>" + err.hints + "</td>" + \
-                         "<td><a href = '/display/" + child_type + "/" + str(child_item.id) + "'>" + \
-                         "Open <i>" + child_item.name + "</i></a></td></tr>"
+    for child_type, child_id, child_name, spec, hints in tree:
+        tree_html += "<tr class='validity_list_False'>" + \
+                     "<td class='validity_icon_False'></td>" + \
+                     "<td>" + spec + "</td>" + \
+                     "<td>" + hints + "</td>" + \
+                     "<td><a href = '/display/" + child_type + "/" + str(child_id) + "'>" + \
+                     "Open <i>" + child_name + "</i></a></td></tr>"
 
     return tree_html, len(tree)
 
@@ -131,7 +145,7 @@ def add_item_branches(item, tree):
 def draw_object_child_tree(item):
     child_list = build_object_child_list(item)
 
-    html = "<tr><td><div class='validity_list_waiting' id=" + type(item).__name__.lower() + "__" + \
+    html = "<tr><td><div class='validity_list_waiting' id='" + type(item).__name__.lower() + "__" + \
            str(item.id) + "__checklist'>" + type(item).__name__.lower() + " <i>" + item.name + "</i></div></td></tr>"
 
     for child, child_type in child_list:
@@ -178,57 +192,74 @@ def get_breadcrumbs(breadcrumbs, item, item_type):
 
 
 def build_tree_from_cellml_model(storage, model):
-    tree = "["
-    parents = {}
+    """
+    Builds the preview tree of an uploaded model in one pass and stores it as StorageTreeNode rows, with the model as
+    node 0, so that the nodes below any one node can be served on their own.
+    :param storage: TemporaryStorage instance
+    :param model: libcellml->Model instance
+    """
+    tree = []
+    root = add_tree_node(tree, None, "Model: {}".format(model.name()))
 
     # Add the components
     for c in range(model.componentCount()):
-        tree = build_tree_from_cellml_component(storage, model.component(c), tree, c, parents)
+        build_tree_from_cellml_component(tree, model.component(c), root)
 
     # Add the units
     for u in range(model.unitsCount()):
-        tree = build_tree_from_cellml_units(storage, model.units(u), tree, u, parents)
+        build_tree_from_cellml_units(tree, model.units(u), root)
 
-    tree += "]"
-    storage.tree = tree
-    storage.save()
+    StorageTreeNode.objects.filter(storage=storage).delete()
+    for tree_node in tree:
+        tree_node.storage = storage
+    StorageTreeNode.objects.bulk_create(tree)
 
 
-def build_tree_from_cellml_component(storage, component, tree, index, parents):
-    tree += "{text: 'Component: " + component.name() + "',"
-    tree += "nodes: ["
+def add_tree_node(tree, parent, text):
+    # The nodes are collected in a list, and only saved once the whole tree has been read
+    node = len(tree)
+    tree.append(StorageTreeNode(node=node, parent=parent, text=text))
+    if parent is not None:
+        tree[parent].child_count += 1
+    return node
+
+
+def get_tree_nodes(storage, node):
+    """
+    :param storage: TemporaryStorage instance whose tree has been built by build_tree_from_cellml_model
+    :param node: index of the parent node
+    :return: list of dictionaries describing the direct children of the node
+    """
+    return [{
+        'node': tree_node.node,
+        'text': tree_node.text,
+        'has_children': tree_node.child_count > 0,
+    } for tree_node in StorageTreeNode.objects.filter(storage=storage, parent=node).order_by('node')]
 
-    # parents['component'] = index
-    # record = TemporaryStorageItem(
-    #     storage=storage,
-    #     dict_string="{}".format(parents)
-    # )
-    # record.save()
+
+def build_tree_from_cellml_component(tree, component, parent):
+    node = add_tree_node(tree, parent, "Component: {}".format(component.name()))
 
     # Add the variables
     for v in range(component.variableCount()):
-        tree = build_tree_from_cellml_variable(storage, component.variable(v), tree, v, parents)
+        build_tree_from_cellml_variable(tree, component.variable(v), node)
 
     # Add the resets
     for r in range(component.resetCount()):
-        tree = build_tree_from_cellml_reset(storage, component.reset(r), tree, r, parents)
+        build_tree_from_cellml_reset(tree, component.reset(r), node)
 
-    tree += "]},"
-    return tree
+    # Add the encapsulated components
+    for c in range(component.componentCount()):
+        build_tree_from_cellml_component(tree, component.component(c), node)
 
+    return node
 
-def build_tree_from_cellml_units(storage, units, tree, index, parents):  # parents not used until encapsulation is added
-    tree += "{text:'Units: " + units.name() + "'},"
-    # parents['units'] = index
-    # record = TemporaryStorageItem(
-    #     storage=storage,
-    #     dict_string="{}".format(parents)
-    # )
-    # record.save()
-    return tree
+
+def build_tree_from_cellml_units(tree, units, parent):
+    return add_tree_node(tree, parent, "Units: {}".format(units.name()))
 
 
-def build_tree_from_cellml_variable(storage, variable, tree, index, parents):
+def build_tree_from_cellml_variable(tree, variable, parent):
     units = variable.units()
     if type(units) is str:
         units_name = units
@@ -236,106 +267,159 @@ def build_tree_from_cellml_variable(storage, variable, tree, index, parents):
         try:
             units_name = units.name()
         except Exception as e:  # TODO could be more useful ... !
-            message = "{text:'Something went wrong! {t}: {a}'},".format(t=type(e).__name__, a=e.args)
-            tree += message
-            return tree
+            return add_tree_node(tree, parent, "Something went wrong! {t}: {a}".format(t=type(e).__name__, a=e.args))
 
-    tree += "{text:'Variable: " + variable.name() + " (" + units_name + ")'},"
+    return add_tree_node(tree, parent, "Variable: {v} ({u})".format(v=variable.name(), u=units_name))
 
-    # parents['variable'] = index
-    # record = TemporaryStorageItem(
-    #     storage=storage,
-    #     dict_string="{}".format(parents)
-    # )
-    # record.save()
 
-    return tree
+def build_tree_from_cellml_reset(tree, reset, parent):
+    variable = reset.variable()
+    return add_tree_node(tree, parent, "Reset: {}".format(variable.name() if variable is not None else ""))
 
 
-def build_tree_from_cellml_reset(storage, reset, tree, index, parents):
-    variable = reset.variable()
+# -------------------- LOADING FUNCTIONS -------------------------------------
 
-    tree += "{text:'Reset: " + variable.name() + "'},"
+def load_model(in_model, owner, batched=False, progress=None, import_cache=None):
+    if batched:
+        # Items are collected per table and written with bulk inserts, and the units, initial values and reset
+        # variables are linked as they are created.  Only this mode reports its progress.
+        model = load_model_in_bulk(in_model, owner, progress)
+    else:
+        # Create the CellModel instance:
+        model = CellModel(
+            name=in_model.name(),
+            cellml_id=in_model.id(),
+            owner=owner,
+            # TODO save attribution somehow ...
+        )
+        model.save()
 
-    # parents['reset'] = index
-    # record = TemporaryStorageItem(
-    #     storage=storage,
-    #     dict_string="{}".format(parents)
-    # )
-    # record.save()
+        # Add the components
+        for c in range(in_model.componentCount()):
+            load_component(c, in_model, model, model, owner)
 
-    return tree
+        # Add the compound units
+        hashes = hash_model_units(in_model)
+        for u in range(in_model.unitsCount()):
+            load_compound_units(u, in_model, model, owner, hashes)
 
+        for u in model.compoundunits.all():
+            load_units(u, in_model, model, owner)
+            u.save()
 
-# -------------------- LOADING FUNCTIONS -------------------------------------
+        # Once everything is loaded into the database, we have to make the connections between items
+        # Note that components are loaded twice - once into the all_components field of the parent model,
+        # independently of the encapsulation structure, and again into the encapsulated_components field, which
+        # reflects the hierarchy, if present
 
-def load_model(in_model, owner):
-    # Create the CellModel instance:
-    model = CellModel(
-        name=in_model.name(),
-        cellml_id=in_model.id(),
-        owner=owner,
-        # TODO save attribution somehow ...
-    )
-    model.save()
+        for component in model.encapsulated_components.all():
+            connect_component_items(component, model, in_model, owner)
 
-    # Add the components
-    for c in range(in_model.componentCount()):
-        load_component(c, in_model, model, model, owner)
+    connect_equivalent_variables(model, in_model)
+
+    # Imported components and units are linked to the items they came from
+    if import_cache is not None:
+        link_imports(model, in_model, import_cache)
+
+    return model
 
-    # Add the compound units
+
+def link_imports(model, in_model, import_cache):
+    """
+    Resolves the <import> elements of a loaded model.  The local item keeps its own name, and points through the
+    imported_from and depends_on fields to the item in the imported model, which is loaded once by the cache.
+    :param model: the CellModel instance which has just been loaded
+    :param in_model: the libcellml->Model instance it was loaded from
+    :param import_cache: main.imports.ImportCache instance
+    """
     for u in range(in_model.unitsCount()):
-        load_compound_units(u, in_model, model, owner)
+        in_units = in_model.units(u)
+        if not in_units.isImport():
+            continue
 
-    for u in model.compoundunits.all():
-        load_units(u, in_model, model, owner)
-        u.save()
+        source_model = import_cache.resolve(in_units.importSource().url())
+        source = source_model.compoundunits.filter(name=in_units.importReference()).first()
+        if source is None:
+            raise LookupError("Could not find units '{u}' in the imported file '{f}'".format(
+                u=in_units.importReference(), f=in_units.importSource().url()))
 
-    # Once everything is loaded into the database, we have to make the connections between items
-    # Note that components are loaded twice - once into the all_components field of the parent model, independently of
-    # the encapsulation structure, and again into the encapsulated_components field, which reflects the hierarchy, if
-    # present
+        for local in model.compoundunits.filter(name=in_units.name(), is_standard=False):
+            local.imported_from = source
+            local.depends_on = source
+            local.save()
 
-    for component in model.encapsulated_components.all():
-        connect_component_items(component, model, in_model, owner)
+    link_imported_components(model, in_model, import_cache)
 
-    for component in model.encapsulated_components.all():
-        connect_equivalent_variables(component, in_model)
 
-    return model
+def link_imported_components(model, in_entity, import_cache):
+    for c in range(in_entity.componentCount()):
+        in_component = in_entity.component(c)
 
+        if in_component.isImport():
+            source_model = import_cache.resolve(in_component.importSource().url())
+            source = source_model.all_components.filter(name=in_component.importReference()).first()
+            if source is None:
+                raise LookupError("Could not find component '{c}' in the imported file '{f}'".format(
+                    c=in_component.importReference(), f=in_component.importSource().url()))
 
-def connect_equivalent_variables(component, in_entity):
-    in_component = in_entity.component(component.cellml_index)
+            components = model.all_components.filter(name=in_component.name())
+            ids = list(components.values_list('id', flat=True))
+            components.update(imported_from=source, depends_on=source)
+            # The update sends no signals
+            mark_dirty([(Component, ids)])
 
-    for v in range(0, in_component.variableCount()):
-        in_variable = in_component.variable(v)
+        link_imported_components(model, in_component, import_cache)
 
-        variable = component.variables.filter(name=in_variable.name()).first()
 
-        for ev in range(0, in_variable.equivalentVariableCount()):
+def connect_equivalent_variables(model, in_model):
+    """
+    Links the equivalent variables of a newly loaded model.  The components and variables are read once, names are
+    resolved in memory, and all the pairs are written to the through table in a single insert.
+    :param model: the CellModel instance which has just been loaded
+    :param in_model: the libcellml->Model instance it was loaded from
+    """
+    components = list(Component.objects.filter(model=model).order_by('id'))
 
-            in_equiv = in_variable.equivalentVariable(ev)
-            in_equiv_component = in_equiv.parentComponent()
-            in_equiv_grandparent = in_equiv_component.parentComponent()
-            if not in_equiv_grandparent:
-                in_equiv_grandparent = in_equiv_component.parentModel()
+    # As with .first(), the earliest item wins where names are repeated
+    component_ids = {}
+    child_components = {}
+    for component in components:
+        component_ids.setdefault(component.name, component.id)
+        child_components.setdefault(component.parent_component_id, {}).setdefault(component.cellml_index, component)
 
-            out_equiv_component = component.model.all_components.filter(name=in_equiv_component.name()).first()
+    variable_ids = {}
+    for variable_id, component_id, name in Variable.objects.filter(component__model=model).order_by('id').values_list(
+            'id', 'component_id', 'name'):
+        variable_ids.setdefault((component_id, name), variable_id)
 
-            # Look for variable in the sibling component set
-            if out_equiv_component:
-                out_equiv_variable = out_equiv_component.variables.filter(name=in_equiv.name()).first()
-            else:
-                pass
+    pairs = set()
 
-            if out_equiv_variable:
-                variable.equivalent_variables.add(out_equiv_variable)
-            else:
-                pass
+    def add_pairs(out_components, in_entity):
+        for index, component in out_components.items():
+            in_component = in_entity.component(index)
 
-    for child_component in component.child_components.all():
-        connect_equivalent_variables(child_component, in_component)
+            for v in range(0, in_component.variableCount()):
+                in_variable = in_component.variable(v)
+                variable_id = variable_ids.get((component.id, in_variable.name()))
+
+                for ev in range(0, in_variable.equivalentVariableCount()):
+                    in_equiv = in_variable.equivalentVariable(ev)
+                    equiv_component_id = component_ids.get(in_equiv.parentComponent().name())
+                    equiv_id = variable_ids.get((equiv_component_id, in_equiv.name()))
+
+                    if variable_id is not None and equiv_id is not None:
+                        # The relationship is symmetrical, so both directions are stored
+                        pairs.add((variable_id, equiv_id))
+                        pairs.add((equiv_id, variable_id))
+
+            add_pairs(child_components.get(component.id, {}), in_component)
+
+    # Components without a parent component are those directly inside the model
+    add_pairs(child_components.get(None, {}), in_model)
+
+    through = Variable.equivalent_variables.through
+    through.objects.bulk_create([through(from_variable_id=f, to_variable_id=t) for f, t in pairs],
+                                ignore_conflicts=True)
 
 
 def connect_component_items(component, model, in_entity, owner):
@@ -361,6 +445,7 @@ def connect_component_items(component, model, in_entity, owner):
                     symbol=in_units,  # not sure about this one?
                     is_standard=False,
                     owner=owner,
+                    content_hash=hash_base_units(in_units),
                 )
                 u_new.save()
                 u_new.models.add(model)
@@ -383,8 +468,13 @@ def connect_component_items(component, model, in_entity, owner):
     for reset in component.resets.all():
         # add the variable, test_variable
         in_reset = in_component.reset(reset.cellml_index)
-        reset.variable = component.variables.filter(name=in_reset.variable.name()).first()
-        reset.test_variable = component.variables.filter(name=in_reset.test_variable.name()).first()
+        variable = in_reset.variable()
+        if variable is not None:
+            reset.variable = component.variables.filter(name=variable.name()).first()
+        test_variable = in_reset.test_variable()
+        if test_variable is not None:
+            reset.test_variable = component.variables.filter(name=test_variable.name()).first()
+        reset.save()
 
     for child_component in component.child_components.all():
         connect_component_items(child_component, model, in_component, owner)
@@ -399,6 +489,7 @@ def load_component(index, in_entity, out_parent, out_model, owner):
         cellml_id=in_component.id(),
         owner=owner,
         model=out_model,
+        content_hash=hash_component(in_component),
     )
     # Parent and child components represent the encapsulation structure, model simply records the presence in the model
     if type(out_parent).__name__.lower() == 'component':
@@ -427,15 +518,8 @@ def load_component(index, in_entity, out_parent, out_model, owner):
         )
         math.save()
 
-        variables = [x.split("</ci>")[0] for x in mathml.split("<ci>")[1:]]
-
-        for var in variables:
-            if var != '':
-                try:
-                    v = out_component.variables.get(name=var)
-                    math.variables.add(v)
-                except Exception as e:
-                    pass
+        # link the variables named in the index built when the math was saved
+        math.variables.add(*out_component.variables.filter(name__in=math.identifiers))
 
     # scan mathml for variable names to link
     for c in range(0, in_component.componentCount()):
@@ -455,7 +539,7 @@ def load_component(index, in_entity, out_parent, out_model, owner):
     return
 
 
-def load_compound_units(index, in_model, model, owner):
+def load_compound_units(index, in_model, model, owner, hashes=None):
     in_units = in_model.units(index)
 
     if in_units.isBaseUnit():  # TODO check why libcellml has this as *base* unit not *standard* unit?
@@ -470,10 +554,14 @@ def load_compound_units(index, in_model, model, owner):
 
         return
 
+    if hashes is None:
+        hashes = hash_model_units(in_model)
+
     out_compound_units = CompoundUnit(
         name=in_units.name(),
         cellml_index=index,
         owner=owner,
+        content_hash=hashes[in_units.name()],
     )
     out_compound_units.save()
 
@@ -619,27 +707,119 @@ def load_reset(index, in_component, out_component, owner):
 
 # -------------------------------- CONVERSION FUNCTIONS ---------------------------------
 
-def convert_to_cellml_model(in_model):
+def get_cellml_cache_key(model_id, revision):
+    return "cellml_export_{i}_{r}".format(i=model_id, r=revision)
+
+
+def get_cellml_text(in_model):
+    """
+    Prints the model as CellML, or returns the text printed before if nothing in the model has changed since.
+    :param in_model: CellModel instance, with a current revision
+    :return: CellML string
+    """
+    key = get_cellml_cache_key(in_model.id, in_model.revision)
+    cellml_text = cache.get(key)
+    if cellml_text is None:
+        printer = libcellml.Printer()
+        cellml_text = printer.printModel(convert_to_cellml_model(in_model))
+        cache.set(key, cellml_text, timeout=None)
+    return cellml_text
+
+
+def get_components_for_export():
+    # Components with the items read by convert_to_cellml_component prefetched
+    variables = Variable.objects.select_related('compoundunit', 'initial_value_variable').order_by('id')
+    variables = variables.prefetch_related(Prefetch('equivalent_variables', queryset=Variable.objects.only('id')))
+    resets = Reset.objects.select_related('variable', 'test_variable', 'test_value', 'reset_value').order_by('id')
+
+    return Component.objects.order_by('id').prefetch_related(
+        Prefetch('variables', queryset=variables),
+        Prefetch('resets', queryset=resets),
+        Prefetch('maths', queryset=Math.objects.order_by('id')),
+    )
+
+
+def get_compoundunits_for_export():
+    # Compound units with the items read by convert_to_cellml_compoundunit prefetched
+    units = Unit.objects.select_related('child_cu', 'prefix').order_by('id')
+
+    return CompoundUnit.objects.order_by('id').prefetch_related(Prefetch('product_of', queryset=units))
+
+
+def prefetch_for_export(models):
+    """
+    Adds everything read by the convert_to_cellml_* functions to a queryset of models, so that the cost of exporting
+    is a fixed number of queries however many models and items there are.
+    :param models: CellModel queryset
+    :return: the same queryset, with everything prefetched
+    """
+    return models.prefetch_related(
+        Prefetch('all_components', queryset=get_components_for_export()),
+        Prefetch('compoundunits', queryset=get_compoundunits_for_export()),
+    )
+
+
+def get_model_for_export(in_model):
+    """
+    :param in_model: CellModel instance
+    :return: the same model, read again with everything needed by the convert_to_cellml_* functions prefetched
+    """
+    return prefetch_for_export(CellModel.objects.all()).get(id=in_model.id)
+
+
+def convert_to_cellml_model(in_model, prefetched=False):
+    """
+    :param in_model: CellModel instance
+    :param prefetched: (optional) True if the model was read by prefetch_for_export, in which case no queries are made
+    :return: libcellml->Model instance
+    """
     out_model = libcellml.Model()
 
     if in_model is not None:
+        if not prefetched:
+            in_model = get_model_for_export(in_model)
+
         out_model.setName(in_model.name)
         out_model.setId(in_model.cellml_id)
 
+        out_components = {}
+        variables = {}
+        pairs = []
         for c in in_model.all_components.all():
-            component = convert_to_cellml_component(c)
-            out_model.addComponent(component)
+            out_components[c.id] = convert_to_cellml_component(c)
+            add_equivalences_for_export(c, variables, pairs)
+
+        # Encapsulated components are added to their parent component, and only the others to the model
+        for c in in_model.all_components.all():
+            parent = out_components.get(c.parent_component_id, out_model)
+            parent.addComponent(out_components[c.id])
 
         for cu in in_model.compoundunits.all():
             units = convert_to_cellml_compoundunit(cu)
             out_model.addUnits(units)
 
-        # todo convert_to_cellml_connections
-        # todo convert_to_cellml_encapsulation
+        # Each class of equivalent variables is found once, rather than by following the links from every variable
+        for component_1, component_2, names in find_connections(pairs, variables):
+            for name_1, name_2 in names:
+                libcellml.Variable.addEquivalence(out_components[component_1].variable(name_1),
+                                                  out_components[component_2].variable(name_2))
 
     return out_model
 
 
+def add_equivalences_for_export(in_component, variables, pairs):
+    """
+    Collects the equivalences of a component's variables for find_connections, from the items prefetched by
+    get_components_for_export, so no queries are made.
+    :param in_component: Component instance
+    :param variables: dictionary of {variable id: (component id, variable name)} to add to
+    :param pairs: list of (variable id, variable id) tuples to add to
+    """
+    for v in in_component.variables.all():
+        variables[v.id] = (in_component.id, v.name)
+        pairs.extend([(v.id, e.id) for e in v.equivalent_variables.all()])
+
+
 def convert_to_cellml_component(in_component):
     out_component = libcellml.Component()
 
@@ -652,21 +832,27 @@ def convert_to_cellml_component(in_component):
             out_component.addVariable(variable)
 
         for r in in_component.resets.all():
-            reset = convert_to_cellml_reset(r)
+            reset = convert_to_cellml_reset(r, out_component)
             out_component.addReset(reset)
 
+        # Needed by code generation as well as for a complete document
+        for m in in_component.maths.all():
+            if m.math_ml:
+                out_component.appendMath(m.math_ml)
+
     return out_component
 
 
-def convert_to_cellml_reset(in_reset):
+def convert_to_cellml_reset(in_reset, out_component):
+    # The reset refers to the converted variables, so they must have been added to out_component already
     out_reset = libcellml.Reset()
 
     if in_reset.cellml_id is not None:
         out_reset.setId(in_reset.cellml_id)
     if in_reset.variable is not None:
-        out_reset.setVariable(in_reset.variable.name)
+        out_reset.setVariable(out_component.variable(in_reset.variable.name))
     if in_reset.test_variable is not None:
-        out_reset.setTestVariable(in_reset.test_variable.name)
+        out_reset.setTestVariable(out_component.variable(in_reset.test_variable.name))
     if in_reset.order is not None:
         out_reset.setOrder(in_reset.order)
     if in_reset.reset_value is not None:
@@ -686,6 +872,11 @@ def convert_to_cellml_variable(in_variable):
         if in_variable.compoundunit is not None:
             out_variable.setUnits(in_variable.compoundunit.name)
 
+        if in_variable.initial_value_variable is not None:
+            out_variable.setInitialValue(in_variable.initial_value_variable.name)
+        elif in_variable.initial_value_constant is not None:
+            out_variable.setInitialValue(in_variable.initial_value_constant)
+
     return out_variable
 
 
@@ -697,7 +888,8 @@ def convert_to_cellml_compoundunit(in_compoundunit):
         out_units.setId(in_compoundunit.cellml_id)
 
         for u in in_compoundunit.product_of.all():
-            out_units.addUnit(u.child_cu.name, u.prefix.name, u.exponent, u.multiplier)
+            reference = u.child_cu.name if u.child_cu is not None else u.name
+            out_units.addUnit(reference, u.prefix.name, u.exponent, u.multiplier)
 
     return out_units
 
@@ -0,0 +1,84 @@
+"""
+    This file contains the structural hashes stored on CompoundUnit and Component.  Two items with the same hash have
+    the same definition, which is how a revised file is compared with the model it updates, see main.update.
+
+    The hashes are not used to deduplicate uploads: loading a file always creates its own units and components, even
+    when identical ones are already stored.  Any item can be edited or deleted from any model it is linked to, and
+    the edit views don't know which model they were opened from, so a row shared between models would change all of
+    them.  Only the built-in units, which can't be changed, are shared, and they are found by name.
+"""
+import hashlib
+import json
+
+
+def hash_content(*parts):
+    return hashlib.sha256(json.dumps(parts, default=str).encode('utf-8')).hexdigest()
+
+
+def hash_unit_factor(child, prefix_name, exponent, multiplier):
+    # Exponents and multipliers are compared as floats so that 1 and 1.0 give the same hash
+    return [child, prefix_name, float(exponent if exponent is not None else 1),
+            float(multiplier if multiplier is not None else 1)]
+
+
+def hash_model_units(in_model):
+    """
+    Hashes every compound unit defined in a libCellML model.  A reference to another unit in the same model is
+    replaced by that unit's hash, so that units which happen to share a name in different models are not confused.
+    References to built-in or undefined units are kept as names.
+    :param in_model: libcellml->Model instance
+    :return: dictionary of {units name: hash}, base units are not included
+    """
+    in_units_by_name = {}
+    for u in range(in_model.unitsCount()):
+        in_units = in_model.units(u)
+        if not in_units.isBaseUnit():
+            in_units_by_name.setdefault(in_units.name(), in_units)
+
+    hashes = {}
+
+    def hash_units(name, visiting):
+        if name in hashes:
+            return hashes[name]
+        if name not in in_units_by_name or name in visiting:
+            # Built-in, undefined or circular references are identified by name only
+            return name
+
+        in_units = in_units_by_name[name]
+        if in_units.isImport():
+            # Imported units have no children of their own, and are identified by where they come from
+            hashes[name] = hash_content('import', name, in_units.importSource().url(), in_units.importReference())
+            return hashes[name]
+
+        factors = []
+        for u in range(in_units.unitCount()):
+            reference, prefix_string, exponent, multiplier, local_id = in_units.unitAttributes(u)
+            child = hash_units(reference, visiting | {name})
+            factors.append(hash_unit_factor(child, prefix_string, exponent, multiplier))
+
+        hashes[name] = hash_content('compoundunit', name, factors)
+        return hashes[name]
+
+    for units_name in in_units_by_name:
+        hash_units(units_name, frozenset())
+
+    return hashes
+
+
+def hash_base_units(name):
+    # Units referenced by variables but defined nowhere have no children
+    return hash_content('compoundunit', name, [])
+
+
+def hash_component(in_component):
+    """
+    Hashes the name, variables and maths of a libCellML component.
+    :param in_component: libcellml->Component instance
+    :return: hash string
+    """
+    variables = []
+    for v in range(in_component.variableCount()):
+        in_variable = in_component.variable(v)
+        variables.append([in_variable.name(), in_variable.units(), in_variable.initialValue()])
+
+    return hash_content('component', in_component.name(), variables, in_component.math())
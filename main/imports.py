@@ -0,0 +1,111 @@
+"""
+    This file contains the cache used to resolve CellML <import> elements against a local directory or zip archive of
+    dependency files.  Each file is parsed and loaded once, and is identified by the hash of its text so that a file
+    shared by several models, or already loaded by the same person, is not loaded again.
+"""
+import hashlib
+import os
+import posixpath
+import zipfile
+from contextlib import contextmanager
+
+import libcellml
+
+from main.functions import load_model, draw_object_child_tree
+from main.models import CellModel
+
+
+def hash_file_text(cellml_text):
+    return hashlib.sha256(cellml_text.encode('utf-8')).hexdigest()
+
+
+class ImportCache(object):
+    def __init__(self, path, owner):
+        """
+        :param path: location of the zip file or directory containing the dependency files
+        :param owner: the Person who will own the imported models
+        """
+        self.path = path
+        self.owner = owner
+        self.is_archive = zipfile.is_zipfile(path)
+
+        self._models = {}  # {file hash: CellModel} of those loaded or found so far
+        self._reading = []  # stack of the files being loaded, used to resolve relative urls
+
+    @contextmanager
+    def reading(self, file_name):
+        """
+        Marks the file being loaded, so that the urls of its imports are resolved relative to it.
+        :param file_name: location of the file inside the directory or archive
+        """
+        self._reading.append(file_name)
+        try:
+            yield
+        finally:
+            self._reading.pop()
+
+    def file_text(self, file_name):
+        try:
+            if self.is_archive:
+                with zipfile.ZipFile(self.path) as archive:
+                    return archive.read(file_name).decode('utf-8')
+            with open(os.path.join(self.path, *file_name.split('/')), 'r') as f:
+                return f.read()
+        except (KeyError, OSError):
+            raise FileNotFoundError("Could not find the imported file '{f}' in '{p}'".format(f=file_name, p=self.path))
+
+    def find_model(self, file_hash):
+        """
+        :param file_hash: hash of the text of a CellML file, see hash_file_text
+        :return: the CellModel already loaded from an identical file by this owner, or None
+        """
+        if file_hash not in self._models:
+            model = CellModel.objects.filter(owner=self.owner, content_hash=file_hash).order_by('id').first()
+            if model is None:
+                return None
+            self._models[file_hash] = model
+        return self._models[file_hash]
+
+    def remember(self, file_hash, model):
+        model.content_hash = file_hash
+        model.save()
+        self._models[file_hash] = model
+
+    def forget(self):
+        # Models loaded inside a transaction which was rolled back no longer exist
+        self._models = {}
+
+    def resolve(self, url):
+        """
+        Finds the model for an import url, loading the file into the database if it has not been loaded before.
+        :param url: the url of the import source, relative to the file being loaded
+        :return: CellModel instance
+        """
+        base = posixpath.dirname(self._reading[-1]) if self._reading else ''
+        file_name = posixpath.normpath(posixpath.join(base, url))
+        # Only files inside the directory or archive can be imported
+        if posixpath.isabs(file_name) or file_name == '..' or file_name.startswith('../'):
+            raise ValueError("The import of '{u}' is outside '{p}'".format(u=url, p=self.path))
+        if file_name in self._reading:
+            raise ValueError("The import of '{f}' is circular: {r}".format(f=file_name, r=" -> ".join(self._reading)))
+
+        cellml_text = self.file_text(file_name)
+        model = self.find_model(hash_file_text(cellml_text))
+        if model is not None:
+            return model
+
+        parser = libcellml.Parser()
+        in_model = parser.parseModel(cellml_text)
+        if parser.errorCount() > 0:
+            raise ValueError("Could not parse the imported file '{f}': {e}".format(f=file_name, e="; ".join(
+                [parser.error(e).description() for e in range(0, parser.errorCount())])))
+
+        with self.reading(file_name):
+            model = load_model(in_model, self.owner, batched=True, import_cache=self)
+
+        model.uploaded_from = file_name
+        model.privacy = 'private'
+        model.child_list = draw_object_child_tree(model)
+        self.remember(hash_file_text(cellml_text), model)
+
+        return model
@@ -0,0 +1,343 @@
+"""
+    This file contains the functions needed to load a whole archive or directory of CellML files in one operation.
+    The files are parsed by libCellML in a pool of worker processes, and the parsed models are written to the database
+    through load_model by the calling process only, so there is a single writer connection.
+
+    libCellML objects cannot be sent between processes, so each worker copies the parts of the parsed model which the
+    loading functions read into the plain Parsed* classes below.  These answer the same calls as the libCellML objects.
+"""
+import os
+import time
+import zipfile
+from multiprocessing import Pool
+
+import libcellml
+from django.db import connections
+
+from main.imports import ImportCache, hash_file_text
+from main.jobs import load_uploaded_model
+
+CELLML_EXTENSIONS = ('.cellml', '.xml')
+
+
+# -------------------------------- PARSED MODEL SNAPSHOTS ----------------------------
+
+class ParsedEntity(object):
+    def __init__(self, in_entity):
+        self._name = in_entity.name()
+        self._id = in_entity.id()
+
+    def name(self):
+        return self._name
+
+    def id(self):
+        return self._id
+
+
+class ParsedImportedEntity(ParsedEntity):
+    def __init__(self, in_entity):
+        super(ParsedImportedEntity, self).__init__(in_entity)
+        self._is_import = in_entity.isImport()
+        self._import_source = ParsedImportSource(in_entity.importSource()) if self._is_import else None
+        self._import_reference = in_entity.importReference() if self._is_import else ""
+
+    def isImport(self):
+        return self._is_import
+
+    def importSource(self):
+        return self._import_source
+
+    def importReference(self):
+        return self._import_reference
+
+
+class ParsedImportSource(object):
+    def __init__(self, in_import_source):
+        self._url = in_import_source.url()
+
+    def url(self):
+        return self._url
+
+
+class ParsedComponentParent(object):
+    def add_components(self, in_entity, variables):
+        self._components = [ParsedComponent(in_entity.component(c), self, variables)
+                            for c in range(in_entity.componentCount())]
+
+    def componentCount(self):
+        return len(self._components)
+
+    def component(self, index):
+        return self._components[index]
+
+
+class ParsedModel(ParsedEntity, ParsedComponentParent):
+    def __init__(self, in_model):
+        super(ParsedModel, self).__init__(in_model)
+
+        # Variables are collected by (component name, variable name) so that the equivalences can be linked once
+        # every component has been copied
+        variables = {}
+        self.add_components(in_model, variables)
+        self._units = [ParsedUnits(in_model.units(u)) for u in range(in_model.unitsCount())]
+
+        for in_variable, variable in self._walk_variables(in_model, self):
+            for ev in range(in_variable.equivalentVariableCount()):
+                in_equiv = in_variable.equivalentVariable(ev)
+                key = (in_equiv.parentComponent().name(), in_equiv.name())
+                if key in variables:
+                    variable._equivalent_variables.append(variables[key])
+
+    def _walk_variables(self, in_parent, parent):
+        # The copied components are in the same order as in the libCellML model, so both trees are walked together
+        for c in range(in_parent.componentCount()):
+            in_component = in_parent.component(c)
+            component = parent.component(c)
+            for v in range(in_component.variableCount()):
+                yield in_component.variable(v), component.variable(v)
+            for found in self._walk_variables(in_component, component):
+                yield found
+
+    def unitsCount(self):
+        return len(self._units)
+
+    def units(self, index):
+        return self._units[index]
+
+
+class ParsedComponent(ParsedImportedEntity, ParsedComponentParent):
+    def __init__(self, in_component, parent, variables):
+        super(ParsedComponent, self).__init__(in_component)
+        self._parent = parent
+        self._variables = []
+        for v in range(in_component.variableCount()):
+            variable = ParsedVariable(in_component.variable(v), self)
+            self._variables.append(variable)
+            variables.setdefault((in_component.name(), variable.name()), variable)
+
+        self.add_components(in_component, variables)
+        self._resets = [ParsedReset(in_component.reset(r), self) for r in range(in_component.resetCount())]
+        self._math = in_component.math()
+
+    def parentComponent(self):
+        return self._parent if isinstance(self._parent, ParsedComponent) else None
+
+    def parentModel(self):
+        return self._parent if isinstance(self._parent, ParsedModel) else None
+
+    def variableCount(self):
+        return len(self._variables)
+
+    def variable(self, index):
+        return self._variables[index]
+
+    def resetCount(self):
+        return len(self._resets)
+
+    def reset(self, index):
+        return self._resets[index]
+
+    def math(self):
+        return self._math
+
+
+class ParsedVariable(ParsedEntity):
+    def __init__(self, in_variable, component):
+        super(ParsedVariable, self).__init__(in_variable)
+        self._component = component
+        units = in_variable.units()
+        self._units = units if type(units) is str else units.name()
+        self._initial_value = in_variable.initialValue()
+        self._equivalent_variables = []
+
+    def parentComponent(self):
+        return self._component
+
+    def units(self):
+        return self._units
+
+    def initialValue(self):
+        return self._initial_value
+
+    def equivalentVariableCount(self):
+        return len(self._equivalent_variables)
+
+    def equivalentVariable(self, index):
+        return self._equivalent_variables[index]
+
+
+class ParsedUnits(ParsedImportedEntity):
+    def __init__(self, in_units):
+        super(ParsedUnits, self).__init__(in_units)
+        self._is_base_unit = in_units.isBaseUnit()
+        self._unit_attributes = [in_units.unitAttributes(u) for u in range(in_units.unitCount())]
+
+    def isBaseUnit(self):
+        return self._is_base_unit
+
+    def unitCount(self):
+        return len(self._unit_attributes)
+
+    def unitAttributes(self, index):
+        return self._unit_attributes[index]
+
+
+class ParsedReset(ParsedEntity):
+    def __init__(self, in_reset, component):
+        self._name = ""
+        self._id = in_reset.id()
+        self._order = in_reset.order()
+        self._test_value = in_reset.test_value()
+        self._reset_value = in_reset.reset_value()
+
+        # Resets refer to variables inside their own component, which have already been copied
+        variable = in_reset.variable()
+        test_variable = in_reset.test_variable()
+        names = [v.name() for v in component._variables]
+        self._variable = None if variable is None or variable.name() not in names \
+            else component._variables[names.index(variable.name())]
+        self._test_variable = None if test_variable is None or test_variable.name() not in names \
+            else component._variables[names.index(test_variable.name())]
+
+    def variable(self):
+        return self._variable
+
+    def test_variable(self):
+        return self._test_variable
+
+    def order(self):
+        return self._order
+
+    def test_value(self):
+        return self._test_value
+
+    def reset_value(self):
+        return self._reset_value
+
+
+# -------------------------------- INGEST FUNCTIONS ----------------------------
+
+def read_cellml_files(path):
+    """
+    Reads the CellML files from a zip archive or a directory, including any subdirectories.  The contents are not
+    decoded here, so that a file which can't be read or decoded is reported by parse_cellml_file as that file's error
+    instead of stopping the whole ingest.
+    :param path: location of the zip file or directory
+    :return: generator of (file name, file bytes) pairs, with the exception in place of the bytes if reading failed
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for name in sorted(archive.namelist()):
+                if name.lower().endswith(CELLML_EXTENSIONS):
+                    try:
+                        yield name, archive.read(name)
+                    except (OSError, zipfile.BadZipFile, NotImplementedError) as e:
+                        # A damaged entry or an unsupported compression method
+                        yield name, e
+        return
+
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(CELLML_EXTENSIONS):
+                file_path = os.path.join(root, name)
+                # Names use '/' as in an archive, so that import urls resolve the same way in both
+                file_name = os.path.relpath(file_path, path).replace(os.sep, '/')
+                try:
+                    with open(file_path, 'rb') as f:
+                        content = f.read()
+                except OSError as e:
+                    content = e
+                yield file_name, content
+
+
+def parse_cellml_file(name_and_text):
+    """
+    Runs in a worker process: decodes and parses one file and copies the result into a ParsedModel.
+    :param name_and_text: tuple of (file name, file bytes or the exception raised reading it), as from
+    read_cellml_files
+    :return: dictionary with the file name, the ParsedModel or the read and parser errors, and the time taken
+    """
+    name, content = name_and_text
+    start = time.time()
+
+    try:
+        if isinstance(content, Exception):
+            raise content
+        cellml_text = content.decode('utf-8')
+    except (OSError, zipfile.BadZipFile, NotImplementedError, UnicodeDecodeError) as e:
+        return {
+            'file': name,
+            'hash': None,
+            'model': None,
+            'errors': ["Could not read file - {}: {}".format(type(e).__name__, e)],
+            'parse_time': time.time() - start,
+        }
+
+    parser = libcellml.Parser()
+    in_model = parser.parseModel(cellml_text)
+
+    result = {
+        'file': name,
+        'hash': hash_file_text(cellml_text),
+        'model': None,
+        'errors': [parser.error(e).description() for e in range(0, parser.errorCount())],
+    }
+    if not result['errors']:
+        try:
+            result['model'] = ParsedModel(in_model)
+        except Exception as e:
+            result['errors'] = ["{}: {}".format(type(e).__name__, e.args)]
+
+    result['parse_time'] = time.time() - start
+    return result
+
+
+def ingest_cellml_files(path, owner, processes=None):
+    """
+    Loads every CellML file in a zip archive or directory into the database.  Imports are resolved from the same
+    archive or directory, and a file which has already been loaded, as an import or by an earlier run, is not loaded
+    again.
+    :param path: location of the zip file or directory
+    :param owner: the Person who will own the new models
+    :param processes: (optional) number of parsing processes, defaults to the number of cores
+    :return: list of report dictionaries, one per file, in the order the files were read
+    """
+    report = []
+    import_cache = ImportCache(path, owner)
+
+    # The workers never touch the database, but must not inherit an open connection either
+    connections.close_all()
+
+    with Pool(processes=processes) as pool:
+        for result in pool.imap(parse_cellml_file, read_cellml_files(path)):
+            entry = {
+                'file': result['file'],
+                'status': 'parse_error' if result['errors'] else 'loaded',
+                'errors': result['errors'],
+                'parse_time': result['parse_time'],
+                'load_time': None,
+                'model_id': None,
+            }
+
+            existing = import_cache.find_model(result['hash']) if result['model'] is not None else None
+            if existing is not None:
+                entry['status'] = 'already_loaded'
+                entry['model_id'] = existing.id
+
+            elif result['model'] is not None:
+                start = time.time()
+                try:
+                    model = load_uploaded_model(result['model'], owner, result['file'], import_cache=import_cache)
+                    import_cache.remember(result['hash'], model)
+                    entry['model_id'] = model.id
+                except Exception as e:
+                    # Any imports loaded for this file were rolled back with it
+                    import_cache.forget()
+                    entry['status'] = 'load_error'
+                    entry['errors'] = ["{}: {}".format(type(e).__name__, e.args)]
+                entry['load_time'] = time.time() - start
+
+            report.append(entry)
+
+    return report
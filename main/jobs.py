@@ -0,0 +1,122 @@
+"""
+    This file contains the functions which process queued uploads outside of the HTTP request.  They are run by the
+    process_uploads management command, and any number of those workers can share the same queue.
+"""
+import datetime
+
+import libcellml
+import pytz
+from django.db import transaction
+
+from main.functions import load_model, draw_object_child_tree
+from main.models import UploadJob
+from main.update import update_model_from_file
+
+# Share of the progress bar given to each stage of the upload
+PARSED_PROGRESS = 10
+LOADED_PROGRESS = 80
+
+
+def claim_upload_job():
+    """
+    Takes the oldest queued job and marks it as running.  Rows locked by another worker are skipped so that workers
+    never process the same job twice.
+    :return: the claimed UploadJob, or None if the queue is empty
+    """
+    with transaction.atomic():
+        job = UploadJob.objects.select_for_update(skip_locked=True).filter(status="queued").order_by('created').first()
+        if job is None:
+            return None
+        job.status = "running"
+        job.started = datetime.datetime.now(pytz.utc)
+        job.save()
+
+    return job
+
+
+def fail_upload_job(job, message):
+    job.status = "failed"
+    job.message = message
+    job.finished = datetime.datetime.now(pytz.utc)
+    job.save()
+
+    # Delete the TemporaryStorage object, also deletes the uploaded file
+    if job.storage is not None:
+        job.storage.delete()
+
+    return job
+
+
+def load_uploaded_model(in_model, owner, file_name, progress=None, import_cache=None):
+    # A failed load must not leave half a model behind
+    with transaction.atomic():
+        # Load into database, with any imports resolved relative to this file
+        if import_cache is not None:
+            with import_cache.reading(file_name):
+                model = load_model(in_model, owner, batched=True, progress=progress, import_cache=import_cache)
+        else:
+            model = load_model(in_model, owner, batched=True, progress=progress)
+
+        model.uploaded_from = file_name
+        model.owner = owner
+        model.imported_from = None
+        model.privacy = 'private'
+        model.child_list = draw_object_child_tree(model)
+        model.save()
+
+    return model
+
+
+def update_uploaded_model(model, in_model, owner, file_name):
+    diff = update_model_from_file(model, in_model, owner)
+
+    model.uploaded_from = file_name
+    model.child_list = draw_object_child_tree(model)
+    model.save()
+
+    return diff
+
+
+def process_upload_job(job):
+    storage = job.storage
+    if storage is None:
+        return fail_upload_job(job, "The uploaded file for this job no longer exists.")
+
+    try:
+        f = open(storage.file.path, "r")
+        cellml_text = f.read()
+    except Exception as e:
+        return fail_upload_job(job, "Could not read the file at '{}'\n{}: {}".format(
+            storage.file.path, type(e).__name__, e.args))
+
+    # Parse the model using libcellml:
+    parser = libcellml.Parser()
+    in_model = parser.parseModel(cellml_text)
+    if parser.errorCount() > 0:
+        return fail_upload_job(job, "\n".join(
+            ["{}".format(parser.error(e).description()) for e in range(0, parser.errorCount())]))
+    job.set_progress(PARSED_PROGRESS)
+
+    def loading_progress(fraction):
+        job.set_progress(PARSED_PROGRESS + int(fraction * (LOADED_PROGRESS - PARSED_PROGRESS)))
+
+    try:
+        if job.target is not None:
+            job.report = update_uploaded_model(job.target, in_model, job.owner, job.file_name)
+            model = job.target
+        else:
+            model = load_uploaded_model(in_model, job.owner, job.file_name, loading_progress)
+    except Exception as e:
+        return fail_upload_job(job, "Could not load the model into the database\n{}: {}".format(
+            type(e).__name__, e.args))
+
+    job.model = model
+    job.status = "done"
+    job.progress = 100
+    job.finished = datetime.datetime.now(pytz.utc)
+    job.save()
+
+    # Delete the TemporaryStorage object, also deletes the uploaded file
+    storage.delete()
+
+    return job
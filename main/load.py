@@ -0,0 +1,345 @@
+"""
+    This file contains the batched version of the loading functions.  Instead of saving each item as it is read from
+    the libCellML model, the items are collected per table and written with bulk inserts.  Names are resolved through
+    in-memory maps rather than by querying the database for every unit and variable.
+"""
+from main.hashing import hash_model_units, hash_base_units, hash_component
+from main.models import Variable, CellModel, Component, Reset, CompoundUnit, Unit, Math, Prefix
+
+
+def load_model_in_bulk(in_model, owner, progress=None):
+    """
+    Loads a libCellML model into the database with a fixed number of queries per table.
+    :param in_model: libcellml->Model instance
+    :param owner: the Person who will own the new items
+    :param progress: (optional) callable taking the fraction of tables written so far, between 0 and 1
+    :return: the new CellModel instance
+    """
+    if progress is None:
+        progress = ignore_progress
+
+    # Create the CellModel instance:
+    model = CellModel(
+        name=in_model.name(),
+        cellml_id=in_model.id(),
+        owner=owner,
+        # TODO save attribution somehow ...
+    )
+    model.save()
+
+    # Everything needed to resolve names is read once up front
+    prefixes = {p.name: p for p in Prefix.objects.all()}
+    standard_units = {cu.name: cu for cu in CompoundUnit.objects.filter(is_standard=True)}
+
+    model_units, new_compound_units = load_compound_units_in_bulk(in_model, model, owner, standard_units)
+    load_units_in_bulk(in_model, owner, new_compound_units, model_units, standard_units, prefixes)
+    progress(0.2)
+
+    # Components are created one encapsulation level at a time so that the parent exists before its children
+    loaded_components = load_components_in_bulk(in_model, model, owner)
+    progress(0.4)
+
+    loaded_variables = load_variables_in_bulk(loaded_components, model, owner, model_units, standard_units)
+    progress(0.6)
+    load_maths_in_bulk(loaded_components, loaded_variables, owner)
+    progress(0.8)
+    load_resets_in_bulk(loaded_components, loaded_variables, owner)
+    progress(1.0)
+
+    return model
+
+
+def ignore_progress(fraction):
+    pass
+
+
+def load_compound_units_in_bulk(in_model, model, owner, standard_units):
+    """
+    Creates the compound units of the model with a single insert.  Only the built-in units are shared with other
+    models, see main.hashing.
+    :param in_model: libcellml->Model instance
+    :param model: the CellModel instance to which the compound units belong
+    :param owner: the Person who will own the new items
+    :param standard_units: dictionary of built-in compound units by name
+    :return: dictionary of the compound units by name, used to resolve references, and the list of those newly created
+    """
+    hashes = hash_model_units(in_model)
+
+    model_units = {}
+    base_units = []
+    new_units = []
+    for index in range(in_model.unitsCount()):
+        in_units = in_model.units(index)
+
+        if in_units.isBaseUnit():  # TODO check why libcellml has this as *base* unit not *standard* unit?
+            # then don't need to add to the database, but do need to reference from model
+            base_unit = standard_units.get(in_units.name())
+            if base_unit is not None and base_unit.name not in model_units:
+                model_units[base_unit.name] = base_unit
+                base_units.append(base_unit)
+            continue
+
+        # Without any child units yet the symbol defaults to the name, as CompoundUnit.update_symbol would set it
+        out_compound_units = CompoundUnit(
+            name=in_units.name(),
+            symbol=in_units.name(),
+            cellml_index=index,
+            owner=owner,
+            content_hash=hashes[in_units.name()],
+        )
+        new_units.append(out_compound_units)
+
+    CompoundUnit.objects.bulk_create(new_units)
+
+    # Units with a duplicated name are all linked to the model, as load_compound_units does, so that validation can
+    # report them, but references to the name resolve to the first of them
+    for cu in new_units:
+        model_units.setdefault(cu.name, cu)
+
+    link_compound_units_to_model(model, base_units + new_units)
+
+    return model_units, new_units
+
+
+def link_compound_units_to_model(model, compound_units):
+    through = CompoundUnit.models.through
+    through.objects.bulk_create([through(compoundunit_id=cu.id, cellmodel_id=model.id) for cu in compound_units])
+
+
+def load_units_in_bulk(in_model, owner, new_compound_units, model_units, standard_units, prefixes):
+    new_units = []
+    for cu in new_compound_units:
+        in_units = in_model.units(cu.cellml_index)
+
+        for u in range(in_units.unitCount()):
+            reference, prefix_string, exponent, multiplier, local_id = in_units.unitAttributes(u)
+
+            try:
+                prefix = prefixes[prefix_string]
+            except KeyError:
+                raise Prefix.DoesNotExist("Could not find prefix '{p}' for unit '{r}' in units '{u}'".format(
+                    p=prefix_string, r=reference, u=cu.name))
+
+            unit = Unit(
+                cellml_index=u,
+                prefix=prefix,
+                multiplier=multiplier,
+                exponent=exponent,
+                cellml_id=local_id,
+                name=reference,
+                parent_cu=cu,
+                owner=owner,
+            )
+
+            # Units local to this model take priority over the built-in ones
+            base = model_units.get(reference)
+            if base is None:
+                base = standard_units.get(reference)
+            unit.child_cu = base
+
+            new_units.append(unit)
+
+    Unit.objects.bulk_create(new_units)
+
+    return new_units
+
+
+def load_components_in_bulk(in_model, model, owner):
+    """
+    Creates all components in the model, one bulk insert per level of the encapsulation hierarchy.
+    :return: list of (libcellml->Component, Component) pairs for every component loaded
+    """
+    loaded = []
+    # Each entry is the libcellml parent, the index of the component inside it, and the Component to encapsulate it
+    level = [(in_model, index, None) for index in range(in_model.componentCount())]
+
+    while level:
+        in_components = []
+        out_components = []
+        for in_parent, index, out_parent in level:
+            in_component = in_parent.component(index)
+
+            out_component = Component(
+                name=in_component.name(),
+                cellml_index=index,
+                cellml_id=in_component.id(),
+                owner=owner,
+                model=model,
+                content_hash=hash_component(in_component),
+            )
+            # Parent and child components represent the encapsulation structure, model simply records the presence
+            # in the model
+            if out_parent is not None:
+                out_component.parent_component = out_parent
+            else:
+                out_component.parent_model = model
+
+            in_components.append(in_component)
+            out_components.append(out_component)
+
+        Component.objects.bulk_create(out_components)
+
+        level = []
+        for in_component, out_component in zip(in_components, out_components):
+            loaded.append((in_component, out_component))
+            for index in range(in_component.componentCount()):
+                level.append((in_component, index, out_component))
+
+    return loaded
+
+
+def load_variables_in_bulk(loaded_components, model, owner, model_units, standard_units):
+    """
+    Creates the variables of all loaded components with a single insert, linking them to their units.
+    :return: dictionary of {component id: {variable name: Variable}} used to resolve names in maths and resets
+    """
+    # Units which are referenced by variables but defined nowhere are new base units for this model
+    missing_units = {}
+    for in_component, out_component in loaded_components:
+        for v in range(in_component.variableCount()):
+            in_units = in_component.variable(v).units()
+            if in_units != '' and in_units not in standard_units and in_units not in model_units:
+                missing_units[in_units] = None
+
+    new_units = []
+    for name in missing_units:
+        new_units.append(CompoundUnit(
+            name=name,
+            symbol=name,  # not sure about this one?
+            is_standard=False,
+            owner=owner,
+            content_hash=hash_base_units(name),
+        ))
+    CompoundUnit.objects.bulk_create(new_units)
+    for cu in new_units:
+        model_units[cu.name] = cu
+    link_compound_units_to_model(model, new_units)
+
+    loaded_variables = {}
+    new_variables = []
+    initial_values = []
+    for in_component, out_component in loaded_components:
+        component_variables = {}
+        for v in range(in_component.variableCount()):
+            in_variable = in_component.variable(v)
+
+            out_variable = Variable(
+                cellml_index=v,
+                name=in_variable.name(),
+                # interface_type=in_variable.interfaceType(),  # TODO get dictionary of interfaceTypes ...
+                owner=owner,
+                component=out_component,
+            )
+
+            in_units = in_variable.units()
+            if in_units != '':
+                # Built-in units take priority over those defined in the model
+                out_variable.compoundunit = standard_units.get(in_units, model_units.get(in_units))
+
+            initial_value = in_variable.initialValue()
+            if initial_value != "":
+                try:
+                    out_variable.initial_value_constant = float(initial_value)
+                except ValueError:
+                    out_variable.initial_value_constant = None
+                    initial_values.append((out_variable, initial_value, component_variables))
+
+            component_variables.setdefault(out_variable.name, out_variable)
+            new_variables.append(out_variable)
+
+        loaded_variables[out_component.id] = component_variables
+
+    Variable.objects.bulk_create(new_variables)
+
+    # Initialising variables can only be linked once all the variables have ids
+    to_update = []
+    for out_variable, initial_value, component_variables in initial_values:
+        initialiser = component_variables.get(initial_value)
+        if initialiser is not None:
+            out_variable.initial_value_variable = initialiser
+            to_update.append(out_variable)
+
+    Variable.objects.bulk_update(to_update, ['initial_value_variable'])
+
+    return loaded_variables
+
+
+def load_maths_in_bulk(loaded_components, loaded_variables, owner):
+    new_maths = []
+    referenced = []
+    for in_component, out_component in loaded_components:
+        mathml = in_component.math()
+
+        if mathml:
+            math = Math(
+                math_ml=mathml,  # save raw mathml for printing later
+                owner=owner,
+                component=out_component,
+            )
+            # bulk_create does not call save(), so the index is built here
+            math.update_index()
+            new_maths.append(math)
+            referenced.append((math, out_component, math.identifiers))
+
+    Math.objects.bulk_create(new_maths)
+
+    through = Math.variables.through
+    links = []
+    for math, out_component, variables in referenced:
+        linked = set()
+        for var in variables:
+            variable = loaded_variables[out_component.id].get(var)
+            if variable is not None and variable.id not in linked:
+                linked.add(variable.id)
+                links.append(through(math_id=math.id, variable_id=variable.id))
+
+    through.objects.bulk_create(links)
+
+    return new_maths
+
+
+def load_resets_in_bulk(loaded_components, loaded_variables, owner):
+    new_maths = []
+    new_resets = []
+    for in_component, out_component in loaded_components:
+        for r in range(in_component.resetCount()):
+            in_reset = in_component.reset(r)
+
+            test_value = Math(
+                math_ml=in_reset.test_value(),
+                owner=owner,
+            )
+            reset_value = Math(
+                math_ml=in_reset.reset_value(),
+                owner=owner
+            )
+            test_value.update_index()
+            reset_value.update_index()
+            new_maths.extend([test_value, reset_value])
+
+            out_reset = Reset(
+                cellml_index=r,
+                order=int(in_reset.order()),
+                component=out_component,
+                owner=owner,
+            )
+
+            variable = in_reset.variable()
+            if variable is not None:
+                out_reset.variable = loaded_variables[out_component.id].get(variable.name())
+            test_variable = in_reset.test_variable()
+            if test_variable is not None:
+                out_reset.test_variable = loaded_variables[out_component.id].get(test_variable.name())
+
+            new_resets.append((out_reset, test_value, reset_value))
+
+    Math.objects.bulk_create(new_maths)
+
+    # The Math items only have ids after their insert, so they are attached here
+    for out_reset, test_value, reset_value in new_resets:
+        out_reset.test_value = test_value
+        out_reset.reset_value = reset_value
+
+    Reset.objects.bulk_create([x[0] for x in new_resets])
+
+    return [x[0] for x in new_resets]
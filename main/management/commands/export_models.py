@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from main.export import export_cellml_models
+from main.models import CellModel, Person
+
+
+class Command(BaseCommand):
+    help = "Exports many models as CellML to a zip archive, printing the models in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Zip archive to write")
+        parser.add_argument('--owner', default=None, help="Export the models owned by the person with this username")
+        parser.add_argument('--public', action='store_true', help="Export every public model")
+        parser.add_argument('--processes', type=int, default=None,
+                            help="Number of printing processes, defaults to the number of cores")
+        parser.add_argument('--report', default=None, help="Also write the per-model report to this JSON file")
+
+    def handle(self, *args, **options):
+        if options['owner'] is None and not options['public']:
+            raise CommandError("Give an --owner, --public, or both")
+
+        selection = Q(privacy='public') if options['public'] else Q()
+        if options['owner'] is not None:
+            try:
+                owner = Person.objects.get(user__username=options['owner'])
+            except Person.DoesNotExist:
+                raise CommandError("Could not find a person with username '{}'".format(options['owner']))
+            selection = selection | Q(owner=owner) if options['public'] else Q(owner=owner)
+
+        report = export_cellml_models(CellModel.objects.filter(selection), options['path'],
+                                      processes=options['processes'])
+
+        for entry in report:
+            self.stdout.write("{f}: {s} (print {p})".format(
+                f=entry['file'], s=entry['status'],
+                p="-" if entry['print_time'] is None else "{:.3f}s".format(entry['print_time'])))
+            for error in entry['errors']:
+                self.stdout.write("    {}".format(error))
+
+        exported = len([x for x in report if x['status'] != 'print_error'])
+        self.stdout.write("Exported {e} of {t} models to {p}".format(e=exported, t=len(report), p=options['path']))
+
+        if options['report']:
+            with open(options['report'], 'w') as f:
+                json.dump(report, f, indent=2)
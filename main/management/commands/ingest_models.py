@@ -0,0 +1,39 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.ingest import ingest_cellml_files
+from main.models import Person
+
+
+class Command(BaseCommand):
+    help = "Loads every CellML file in a zip archive or directory, parsing the files in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Zip archive or directory containing the CellML files")
+        parser.add_argument('--owner', required=True, help="Username of the person who will own the new models")
+        parser.add_argument('--processes', type=int, default=None,
+                            help="Number of parsing processes, defaults to the number of cores")
+        parser.add_argument('--report', default=None, help="Also write the per-file report to this JSON file")
+
+    def handle(self, *args, **options):
+        try:
+            owner = Person.objects.get(user__username=options['owner'])
+        except Person.DoesNotExist:
+            raise CommandError("Could not find a person with username '{}'".format(options['owner']))
+
+        report = ingest_cellml_files(options['path'], owner, processes=options['processes'])
+
+        for entry in report:
+            self.stdout.write("{f}: {s} (parse {p:.3f}s, load {l})".format(
+                f=entry['file'], s=entry['status'], p=entry['parse_time'],
+                l="-" if entry['load_time'] is None else "{:.3f}s".format(entry['load_time'])))
+            for error in entry['errors']:
+                self.stdout.write("    {}".format(error))
+
+        loaded = len([x for x in report if x['status'] == 'loaded'])
+        self.stdout.write("Loaded {l} of {t} files".format(l=loaded, t=len(report)))
+
+        if options['report']:
+            with open(options['report'], 'w') as f:
+                json.dump(report, f, indent=2)
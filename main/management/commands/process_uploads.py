@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.jobs import claim_upload_job, process_upload_job
+
+
+class Command(BaseCommand):
+    help = "Loads queued CellML uploads into the database.  Run as many of these workers as the server can support."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Stop when the queue is empty instead of waiting for new uploads")
+        parser.add_argument('--sleep', type=float, default=2.0,
+                            help="Seconds to wait before checking an empty queue again")
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_upload_job()
+
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['sleep'])
+                continue
+
+            job = process_upload_job(job)
+            self.stdout.write("{f}: {s}".format(f=job.file_name, s=job.status))
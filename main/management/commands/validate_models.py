@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.models import CellModel
+from main.validate_parallel import validate_cellmodel_in_parallel
+
+
+class Command(BaseCommand):
+    help = "Validates models, checking the components of each model in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument('model_ids', nargs='+', type=int, help="Ids of the models to validate")
+        parser.add_argument('--processes', type=int, default=None,
+                            help="Number of validating processes, defaults to the number of cores")
+
+    def handle(self, *args, **options):
+        models = CellModel.objects.in_bulk(options['model_ids'])
+        missing = [str(x) for x in options['model_ids'] if x not in models]
+        if missing:
+            raise CommandError("Could not find the models with ids {}".format(", ".join(missing)))
+
+        for model_id in options['model_ids']:
+            model = models[model_id]
+            is_valid = validate_cellmodel_in_parallel(model, processes=options['processes'])
+            self.stdout.write("{n} ({i}): {v}".format(n=model.name, i=model.id, v="valid" if is_valid else "invalid"))
@@ -0,0 +1,292 @@
+"""
+    This file contains the checking of units in maths.  The expression tree of each MathML block is walked from the
+    leaves up, working out the dimensions of every node from those of the variables and numbers in it, see main.units.
+    Terms which are added or subtracted, compared, or set equal to each other must have the same dimensions.
+
+    Nodes whose units cannot be worked out, eg: a variable without units, are skipped rather than reported, and so is
+    anything containing them.
+"""
+import xml.etree.ElementTree as ElementTree
+
+from main.mathml import local_tag
+from main.models import CompoundUnit, ItemError, Variable
+from main.units import BASE_UNITS, get_dimensions_in_bulk
+
+CELLML_NAMESPACE = "http://www.cellml.org/cellml/2.0#"
+
+BASE_UNITS_SYMBOLS = {'ampere': 'A', 'candela': 'cd', 'kelvin': 'K', 'kilogram': 'kg', 'metre': 'm', 'mole': 'mol',
+                      'second': 's'}
+
+DIMENSIONLESS = ([0.0] * len(BASE_UNITS), 1.0)
+
+# Operators whose arguments must all have the same dimensions, with the words used to report them
+SAME_UNITS_OPERATORS = {
+    'plus': "adds terms",
+    'minus': "subtracts terms",
+    'eq': "sets expressions equal",
+    'neq': "compares expressions",
+    'lt': "compares expressions",
+    'gt': "compares expressions",
+    'leq': "compares expressions",
+    'geq': "compares expressions",
+    'min': "takes the minimum of expressions",
+    'max': "takes the maximum of expressions",
+}
+
+# Operators whose result has the units of their first argument
+SAME_AS_ARGUMENT_OPERATORS = ['abs', 'floor', 'ceiling', 'rem']
+
+# Operators whose result is a pure number
+DIMENSIONLESS_OPERATORS = ['exp', 'ln', 'log', 'factorial',
+                           'sin', 'cos', 'tan', 'sec', 'csc', 'cot', 'sinh', 'cosh', 'tanh', 'sech', 'csch', 'coth',
+                           'arcsin', 'arccos', 'arctan', 'arcsec', 'arccsc', 'arccot',
+                           'arcsinh', 'arccosh', 'arctanh', 'arcsech', 'arccsch', 'arccoth']
+
+
+def describe_dimensions(dimensions):
+    # eg: A^-1.kg.m^2.s^-3, or 'dimensionless'
+    vector = dimensions[0]
+    parts = []
+    for name, exponent in zip(BASE_UNITS, vector):
+        if exponent == 0:
+            continue
+        exponent = int(exponent) if float(exponent).is_integer() else exponent
+        parts.append(BASE_UNITS_SYMBOLS[name] + ("" if exponent == 1 else "^{}".format(exponent)))
+    return ".".join(parts) if parts else "dimensionless"
+
+
+def same_dimensions(dimensions_1, dimensions_2):
+    return all([abs(x - y) < 1e-9 for x, y in zip(dimensions_1[0], dimensions_2[0])])
+
+
+def power_of(dimensions, exponent):
+    return [x * exponent for x in dimensions[0]], dimensions[1] ** exponent
+
+
+def constant_of(element):
+    # The value of a <cn> element, or None if it is not a plain number
+    if element is None or local_tag(element) != 'cn' or element.text is None:
+        return None
+    try:
+        return float(element.text.strip())
+    except ValueError:
+        return None
+
+
+class UnitsChecker(object):
+    """
+    Works out the units of expressions, collecting the mismatches found.
+    :param variables: dictionary of {variable name: dimensions or None} for the variables of one component
+    :param units: dictionary of {units name: dimensions or None} for the units which numbers may be given in
+    """
+    def __init__(self, variables, units):
+        self.variables = variables
+        self.units = units
+        self.mismatches = []
+
+    def check(self, math_ml):
+        """
+        :param math_ml: MathML string, which may contain several <math> elements one after the other
+        :return: list of (description of the operation, list of the dimensions of its arguments) tuples
+        """
+        self.mismatches = []
+        if not math_ml:
+            return []
+        try:
+            root = ElementTree.fromstring("<mathml_index>" + math_ml + "</mathml_index>")
+        except ElementTree.ParseError:
+            return []
+        for math in root:
+            for element in (math if local_tag(math) == 'math' else [math]):
+                self.infer(element)
+        return self.mismatches
+
+    def infer(self, element):
+        """
+        :param element: MathML element
+        :return: dimensions of the element, or None if they cannot be worked out
+        """
+        tag = local_tag(element)
+        if tag == 'ci':
+            return self.variables.get((element.text or "").strip())
+        if tag == 'cn':
+            units = element.get('{' + CELLML_NAMESPACE + '}units')
+            return self.units.get(units) if units is not None else None
+        if tag in ['pi', 'exponentiale', 'notanumber', 'infinity']:
+            return DIMENSIONLESS
+        if tag == 'apply':
+            return self.infer_apply(element)
+        if tag == 'piecewise':
+            return self.infer_piecewise(element)
+        if tag == 'semantics' and len(element):
+            return self.infer(element[0])
+        return None
+
+    def infer_apply(self, element):
+        if not len(element):
+            return None
+        operator = local_tag(element[0])
+        qualifiers = dict([(local_tag(child), child) for child in element[1:]
+                           if local_tag(child) in ['bvar', 'degree', 'logbase']])
+        arguments = [child for child in element[1:] if local_tag(child) not in ['bvar', 'degree', 'logbase']]
+        found = [self.infer(child) for child in arguments]
+
+        if operator in SAME_UNITS_OPERATORS:
+            known = [x for x in found if x is not None]
+            if any([not same_dimensions(known[0], x) for x in known[1:]]):
+                self.mismatches.append((SAME_UNITS_OPERATORS[operator], known))
+                return None
+            if operator in ['plus', 'minus', 'min', 'max']:
+                return known[0] if len(known) == len(found) and known else None
+            return None
+
+        if operator in SAME_AS_ARGUMENT_OPERATORS:
+            return found[0] if found else None
+        if operator in DIMENSIONLESS_OPERATORS:
+            return DIMENSIONLESS
+
+        if operator in ['times', 'divide']:
+            if not found or None in found:
+                return None
+            vector = list(found[0][0])
+            scale = found[0][1]
+            for other in found[1:]:
+                sign = 1 if operator == 'times' else -1
+                vector = [v + sign * x for v, x in zip(vector, other[0])]
+                scale = scale * other[1] ** sign
+            return vector, scale
+
+        if operator in ['power', 'root']:
+            if not found or found[0] is None:
+                return None
+            if operator == 'power':
+                exponent = constant_of(arguments[1]) if len(arguments) > 1 else None
+            else:
+                degree = qualifiers.get('degree')
+                degree = constant_of(degree[0]) if degree is not None and len(degree) else 2.0
+                exponent = 1.0 / degree if degree else None
+            if same_dimensions(found[0], DIMENSIONLESS):
+                return DIMENSIONLESS
+            return power_of(found[0], exponent) if exponent is not None else None
+
+        if operator == 'diff':
+            bvar = qualifiers.get('bvar')
+            if not found or found[0] is None or bvar is None:
+                return None
+            variable = [child for child in bvar if local_tag(child) == 'ci']
+            variable = self.infer(variable[0]) if variable else None
+            degree = [child for child in bvar if local_tag(child) == 'degree']
+            order = constant_of(degree[0][0]) if degree and len(degree[0]) else 1.0
+            if variable is None or order is None:
+                return None
+            by = power_of(variable, order)
+            return [x - y for x, y in zip(found[0][0], by[0])], found[0][1] / by[1]
+
+        # Logical operators, and anything not known here
+        return None
+
+    def infer_piecewise(self, element):
+        # Each piece has a value and a condition, and the otherwise part only a value
+        values = []
+        for child in element:
+            if len(child):
+                values.append(self.infer(child[0]))
+            for condition in list(child)[1:]:
+                self.infer(condition)
+        known = [x for x in values if x is not None]
+        if any([not same_dimensions(known[0], x) for x in known[1:]]):
+            self.mismatches.append(("has pieces", known))
+            return None
+        return known[0] if known and len(known) == len(values) else None
+
+
+def get_math_units_errors(math_name, component_name, mismatches):
+    """
+    :param math_name: name of the Math item
+    :param component_name: name of its component
+    :param mismatches: list of mismatches returned by UnitsChecker.check
+    :return: list of unsaved ItemError instances, one for each different mismatch
+    """
+    errors = []
+    described = set()
+    n = "'{n}' ".format(n=math_name) if math_name else ""
+    for operation, dimensions in mismatches:
+        hints = "Maths {n}in component '{c}' {o} with different units: {u}.".format(
+            n=n, c=component_name, o=operation,
+            u=", ".join(["<i>{}</i>".format(x) for x in unique_descriptions(dimensions)]))
+        if hints not in described:
+            described.add(hints)
+            errors.append(ItemError(hints=hints, spec="14", fields=["math_ml"]))
+    return errors
+
+
+def unique_descriptions(dimensions):
+    descriptions = []
+    for d in dimensions:
+        if describe_dimensions(d) not in descriptions:
+            descriptions.append(describe_dimensions(d))
+    return descriptions
+
+
+def get_units_of_models(model_ids):
+    """
+    Works out the dimensions of all units which the models' maths can use, with the built-in units, at once.
+    :param model_ids: list of CellModel ids
+    :return: tuple of ({units name: dimensions or None}, {compoundunit id: dimensions or None})
+    """
+    compoundunits = list(CompoundUnit.objects.filter(models__id__in=model_ids).distinct()) + list(
+        CompoundUnit.objects.filter(is_standard=True))
+    dimensions = get_dimensions_in_bulk(compoundunits)
+    # The model's own units take the place of built-in units with the same name
+    names = {}
+    for cu in sorted(compoundunits, key=lambda x: not x.is_standard):
+        names[cu.name] = dimensions[cu.id]
+    return names, dimensions
+
+
+def get_variables_units(variables, dimensions):
+    """
+    :param variables: list of (component id, variable name, compoundunit id) tuples
+    :param dimensions: dictionary of {compoundunit id: dimensions or None}, to which any units used by the variables
+    but not linked to their model are added
+    :return: dictionary of {component id: {variable name: dimensions or None}}
+    """
+    missing = set([cu_id for _, _, cu_id in variables if cu_id is not None]) - set(dimensions)
+    if missing:
+        dimensions.update(get_dimensions_in_bulk(list(CompoundUnit.objects.filter(id__in=missing))))
+    found = {}
+    for component_id, name, cu_id in variables:
+        found.setdefault(component_id, {})[name] = dimensions.get(cu_id)
+    return found
+
+
+def get_units_of_maths(model_id):
+    """
+    Works out the dimensions of the units and variables which the maths of a model can use, once for all of them.
+    :param model_id: CellModel id
+    :return: tuple of ({units name: dimensions or None}, {component id: {variable name: dimensions or None}})
+    """
+    names, dimensions = get_units_of_models([model_id])
+    variables = get_variables_units(Variable.objects.filter(component__model_id=model_id).values_list(
+        'component_id', 'name', 'compoundunit_id'), dimensions)
+    return names, variables
+
+
+def check_units_of_math(math, units=None):
+    """
+    :param math: Math instance
+    :param units: (optional) tuple of units and variables dimensions from get_units_of_maths for the math's model, to
+    share between all of its maths.  Otherwise those of the math's own component are read
+    :return: list of unsaved ItemError instances
+    """
+    if math.component is None:
+        return []
+    if units is None:
+        model_ids = [math.component.model_id] if math.component.model_id is not None else []
+        names, dimensions = get_units_of_models(model_ids)
+        variables = Variable.objects.filter(component=math.component).values_list('component_id', 'name',
+                                                                                   'compoundunit_id')
+        units = names, get_variables_units(variables, dimensions)
+    names, variables = units
+    checker = UnitsChecker(variables.get(math.component_id, {}), names)
+    return get_math_units_errors(math.name, math.component.name, checker.check(math.math_ml))
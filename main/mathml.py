@@ -0,0 +1,46 @@
+"""
+    This file contains the parsing of MathML blocks into the index stored on each Math item: the identifiers referenced
+    by <ci> elements and the operators applied, each listed once in order of first appearance.
+"""
+import re
+import xml.etree.ElementTree as ElementTree
+
+# Used only when the MathML is not well-formed and cannot be parsed
+CI_PATTERN = re.compile(r"<ci[^>]*>(.*?)</ci>", re.DOTALL)
+
+
+def local_tag(element):
+    # Remove the namespace, eg: {http://www.w3.org/1998/Math/MathML}apply -> apply
+    return element.tag.rsplit('}', 1)[-1]
+
+
+def parse_math_ml(math_ml):
+    """
+    :param math_ml: MathML string, which may contain several <math> elements one after the other
+    :return: tuple of (identifiers, operators) lists
+    """
+    if not math_ml:
+        return [], []
+
+    try:
+        # A component's maths can be several sibling <math> elements, so they are given a common root
+        root = ElementTree.fromstring("<mathml_index>" + math_ml + "</mathml_index>")
+    except ElementTree.ParseError:
+        identifiers = [x.strip() for x in CI_PATTERN.findall(math_ml)]
+        return unique_in_order([x for x in identifiers if x != '']), []
+
+    identifiers = []
+    operators = []
+    for element in root.iter():
+        tag = local_tag(element)
+        if tag == 'ci' and element.text is not None and element.text.strip() != '':
+            identifiers.append(element.text.strip())
+        elif tag == 'apply' and len(element) and local_tag(element[0]) != 'ci':
+            operators.append(local_tag(element[0]))
+
+    return unique_in_order(identifiers), unique_in_order(operators)
+
+
+def unique_in_order(items):
+    seen = set()
+    return [x for x in items if not (x in seen or seen.add(x))]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.8 on 2026-10-18 12:10
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_content_hash'),
+    ]
+
+    # The old trees were javascript literals rather than JSON, so they are dropped and rebuilt when next viewed
+    operations = [
+        migrations.RemoveField(
+            model_name='temporarystorage',
+            name='tree',
+        ),
+        migrations.AddField(
+            model_name='temporarystorage',
+            name='tree',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 2.2.8 on 2026-10-18 11:14
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+import re
+import xml.etree.ElementTree as ElementTree
+
+# The number of rows read and written at once
+BATCH_SIZE = 500
+
+# A copy of main.mathml.parse_math_ml as it was when this migration was written, so that later changes to the parser
+# cannot change what this migration does
+CI_PATTERN = re.compile(r"<ci[^>]*>(.*?)</ci>", re.DOTALL)
+
+
+def local_tag(element):
+    return element.tag.rsplit('}', 1)[-1]
+
+
+def unique_in_order(items):
+    seen = set()
+    return [x for x in items if not (x in seen or seen.add(x))]
+
+
+def parse_math_ml(math_ml):
+    if not math_ml:
+        return [], []
+
+    try:
+        root = ElementTree.fromstring("<mathml_index>" + math_ml + "</mathml_index>")
+    except ElementTree.ParseError:
+        identifiers = [x.strip() for x in CI_PATTERN.findall(math_ml)]
+        return unique_in_order([x for x in identifiers if x != '']), []
+
+    identifiers = []
+    operators = []
+    for element in root.iter():
+        tag = local_tag(element)
+        if tag == 'ci' and element.text is not None and element.text.strip() != '':
+            identifiers.append(element.text.strip())
+        elif tag == 'apply' and len(element) and local_tag(element[0]) != 'ci':
+            operators.append(local_tag(element[0]))
+
+    return unique_in_order(identifiers), unique_in_order(operators)
+
+
+def index_existing_maths(apps, schema_editor):
+    Math = apps.get_model('main', 'Math')
+    # Only one batch of rows is held in memory at a time
+    batch = []
+    for math in Math.objects.only('id', 'math_ml').order_by('id').iterator(chunk_size=BATCH_SIZE):
+        math.identifiers, math.operators = parse_math_ml(math.math_ml)
+        batch.append(math)
+        if len(batch) == BATCH_SIZE:
+            Math.objects.bulk_update(batch, ['identifiers', 'operators'])
+            batch = []
+    Math.objects.bulk_update(batch, ['identifiers', 'operators'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_storage_tree_json'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='math',
+            name='identifiers',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.TextField(), blank=True, default=list, size=None),
+        ),
+        migrations.AddField(
+            model_name='math',
+            name='operators',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.TextField(), blank=True, default=list, size=None),
+        ),
+        migrations.AddIndex(
+            model_name='math',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['identifiers'], name='main_math_identif_69ad0b_gin'),
+        ),
+        migrations.RunPython(index_existing_maths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.8 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_math_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cellmodel',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+    ]
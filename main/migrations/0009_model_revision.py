@@ -0,0 +1,18 @@
+# Generated by Django 2.2.8 on 2026-10-18 15:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_update_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cellmodel',
+            name='revision',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 2.2.8 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_model_revision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cellmodel',
+            name='is_dirty',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='component',
+            name='is_dirty',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='compoundunit',
+            name='is_dirty',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='encapsulation',
+            name='is_dirty',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='math',
+            name='is_dirty',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='reset',
+            name='is_dirty',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='unit',
+            name='is_dirty',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='variable',
+            name='is_dirty',
+            field=models.BooleanField(default=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.8 on 2026-10-18 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_item_is_dirty'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itemerror',
+            name='digest',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.8 on 2026-10-18 12:20
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_item_error_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compoundunit',
+            name='dimensions',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), blank=True, null=True, size=7),
+        ),
+        migrations.AddField(
+            model_name='compoundunit',
+            name='scale',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.8 on 2026-10-18 12:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_units_dimensions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemContainment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ancestor_type', models.CharField(max_length=25)),
+                ('ancestor_id', models.IntegerField()),
+                ('descendant_type', models.CharField(max_length=25)),
+                ('descendant_id', models.IntegerField()),
+                ('depth', models.IntegerField(default=0)),
+                ('revision', models.IntegerField(default=0)),
+                ('model', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='containment', to='main.CellModel')),
+            ],
+            options={
+                'unique_together': {('model', 'ancestor_type', 'ancestor_id', 'descendant_type', 'descendant_id')},
+            },
+        ),
+    ]
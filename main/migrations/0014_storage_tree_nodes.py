@@ -0,0 +1,38 @@
+# Generated by Django 2.2.8 on 2026-10-18 13:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_item_containment'),
+    ]
+
+    # The previews are built again, as rows, when the stored files are next viewed
+    operations = [
+        migrations.RemoveField(
+            model_name='temporarystorage',
+            name='tree',
+        ),
+        migrations.CreateModel(
+            name='StorageTreeNode',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('node', models.IntegerField()),
+                ('parent', models.IntegerField(blank=True, null=True)),
+                ('text', models.TextField(blank=True)),
+                ('child_count', models.IntegerField(default=0)),
+                ('storage', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tree_nodes', to='main.TemporaryStorage')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='storagetreenode',
+            index=models.Index(fields=['storage', 'parent'], name='main_storag_storage_7e2a85_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='storagetreenode',
+            unique_together={('storage', 'node')},
+        ),
+    ]
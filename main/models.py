@@ -4,20 +4,24 @@
 #
 # """
 #
+import hashlib
 import os
 
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.postgres.fields import ArrayField, JSONField
+from django.contrib.postgres.indexes import GinIndex
 from django.db.models import (IntegerField, ManyToManyField, CharField, TextField, ForeignKey,
                               NullBooleanField, URLField, FileField, CASCADE, OneToOneField, EmailField,
                               BooleanField, SET_NULL, ManyToOneRel, ManyToManyRel, DO_NOTHING, DateTimeField,
-                              FloatField)
-from django.db.models import Model as DjangoModel
+                              FloatField, F, Q)
+from django.db.models import Model as DjangoModel, Index
 # -------------------- ABSTRACT MODELS --------------------
-from django.db.models.signals import post_delete
+from django.db.models.signals import post_delete, post_save, pre_delete, m2m_changed
 from django.dispatch import receiver
 
+from main.mathml import parse_math_ml
+
 
 class NamedCellMLEntity(DjangoModel):
     PRIVACY_LEVELS = [
@@ -45,6 +49,8 @@ class NamedCellMLEntity(DjangoModel):
     # This is the list of all downstream errors from this object, it's expensive to build so will update when asked
     error_tree = JSONField(blank=True, null=True)
     child_list = JSONField(blank=True, null=True)
+    # Set when the item, or something it is linked to, changes, and cleared when it has been validated again
+    is_dirty = BooleanField(default=True)
 
     class Meta:
         abstract = True
@@ -84,6 +90,27 @@ class ItemError(DjangoModel):
         CharField(max_length=50),
         null=True, blank=True
     )
+    # Errors with the same text are stored once, and shared by all of the items which have them
+    digest = CharField(max_length=64, unique=True, null=True, blank=True)
+
+    def get_digest(self):
+        text = "\n".join([self.spec or "", self.hints, ",".join(self.fields or [])])
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ItemContainment(DjangoModel):
+    # A closure table of the items in a model, with one row for each item and each of the items which contain it,
+    # directly or not, see main.containment.  The rows are written again when the model's revision has changed
+    model = ForeignKey('CellModel', related_name='containment', on_delete=CASCADE)
+    ancestor_type = CharField(max_length=25)
+    ancestor_id = IntegerField()
+    descendant_type = CharField(max_length=25)
+    descendant_id = IntegerField()
+    depth = IntegerField(default=0)
+    revision = IntegerField(default=0)
+
+    class Meta:
+        unique_together = [('model', 'ancestor_type', 'ancestor_id', 'descendant_type', 'descendant_id')]
 
 
 class CellMLSpecification(DjangoModel):
@@ -160,6 +187,13 @@ class CompoundUnit(NamedCellMLEntity):
     models = ManyToManyField("CellModel", related_name="compoundunits", blank=True)
     is_standard = BooleanField(default=False)
     symbol = CharField(max_length=100, null=True, blank=True)
+    # Structural hash of the name and child units, set when loaded, see main.hashing
+    content_hash = CharField(max_length=64, blank=True, null=True, db_index=True)
+    # The units as powers of the SI base units and a scale factor, see main.units.  These are worked out when first
+    # needed, and cleared by clear_dimensions_on_change when these units, or any they are made from, change.  Units
+    # which cannot be worked out have an empty list of dimensions
+    dimensions = ArrayField(FloatField(), size=7, null=True, blank=True)
+    scale = FloatField(null=True, blank=True)
 
     imported_from = ForeignKey('CompoundUnit', related_name='imported_to', on_delete=DO_NOTHING, blank=True, null=True)
     depends_on = ForeignKey('CompoundUnit', related_name='used_by', on_delete=DO_NOTHING, blank=True, null=True)
@@ -168,9 +202,11 @@ class CompoundUnit(NamedCellMLEntity):
         return "{n}".format(n=self.name)
 
     def save(self, *args, **kwargs):
-        # If there is no symbol defined for this compound unit then use the product of the children
-        self.update_symbol()
-        super(CompoundUnit, self).save(args, kwargs)
+        # If there is no symbol defined for this compound unit then use the product of the children, unless only the
+        # results of validating it are being saved
+        if not is_validation_save(kwargs.get('update_fields')):
+            self.update_symbol()
+        super(CompoundUnit, self).save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
         # prevent deleting if is standard
@@ -212,26 +248,34 @@ class Math(NamedCellMLEntity):
     component = ForeignKey("Component", related_name="maths", blank=True, null=True, on_delete=DO_NOTHING)
     math_ml = TextField(blank=True, null=True)
 
+    # Parsed from math_ml whenever the item is saved, see main.mathml
+    identifiers = ArrayField(TextField(), blank=True, default=list)
+    operators = ArrayField(TextField(), blank=True, default=list)
+
     variables = ManyToManyField("Variable", related_name="maths", blank=True)
 
     imported_from = ForeignKey('Math', related_name='imported_to', on_delete=DO_NOTHING, blank=True, null=True)
     depends_on = ForeignKey('Math', related_name='used_by', on_delete=DO_NOTHING, blank=True, null=True)
 
+    class Meta:
+        indexes = [GinIndex(fields=['identifiers'])]
+
     # TODO how to make a parent fk to *either* model or reset - should be generic fk?
     def __str__(self):
-        a = ""
-        s = ""
-        for v in self.variables.all()[0:5]:
-            a += v.name + ", "
-        if self.variables.count() > 5:
-            a += " ...   "
-        if a != "":
-            a = a[:-2]
-        if self.name:
-            s = " "
+        a = ", ".join(self.identifiers[0:5])
+        if len(self.identifiers) > 5:
+            a += " ... "
+        s = " " if self.name else ""
         n = "{n}{s}f({a})".format(n=self.name, s=s, a=a)
         return n
 
+    def save(self, *args, **kwargs):
+        self.update_index()
+        super(Math, self).save(*args, **kwargs)
+
+    def update_index(self):
+        self.identifiers, self.operators = parse_math_ml(self.math_ml)
+
 
 class Component(NamedCellMLEntity):
     model = ForeignKey("CellModel", blank=True, related_name="all_components", on_delete=DO_NOTHING, null=True)
@@ -242,6 +286,9 @@ class Component(NamedCellMLEntity):
     parent_model = ForeignKey("CellModel", blank=True, related_name="encapsulated_components", on_delete=DO_NOTHING,
                               null=True)
 
+    # Structural hash of the name, variables and maths, set when loaded
+    content_hash = CharField(max_length=64, blank=True, null=True, db_index=True)
+
     imported_from = ForeignKey('Component', related_name='imported_to', on_delete=DO_NOTHING, blank=True, null=True)
     depends_on = ForeignKey('Component', related_name='used_by', on_delete=DO_NOTHING, blank=True, null=True)
 
@@ -281,20 +328,77 @@ class Reset(NamedCellMLEntity):  # TODO should this be inherited or not?
 
 class CellModel(NamedCellMLEntity):
     uploaded_from = CharField(max_length=250, blank=True, null=True)
+    # Counts the changes to the model or anything in it, and is part of the key of the cached CellML export
+    revision = IntegerField(default=0)
+    # Hash of the text of the file this model was loaded from, used to find models loaded again as imports
+    content_hash = CharField(max_length=64, blank=True, null=True, db_index=True)
     imported_from = ForeignKey('CellModel', related_name='imported_to', on_delete=DO_NOTHING, blank=True, null=True)
     depends_on = ForeignKey('CellModel', related_name='used_by', on_delete=DO_NOTHING, blank=True, null=True)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # The revision is only changed by bump_revision, so an older copy in memory must not write it back
+        if self.pk is not None and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields
+                                       if not f.primary_key and f.name != 'revision']
+        super(CellModel, self).save(*args, **kwargs)
+
 
 class TemporaryStorage(DjangoModel):
     # This is the storage and reading of the initial cellml file
     file = FileField(blank=False)
-    tree = TextField(blank=True)
     owner = ForeignKey(Person, related_name="stored_files", on_delete=CASCADE, null=True, blank=True)
 
 
+class StorageTreeNode(DjangoModel):
+    # One line of the preview of a stored file, see build_tree_from_cellml_model.  The nodes are numbered in the order
+    # they were read, with the model as node 0, so that the children of any one node can be read on their own
+    storage = ForeignKey(TemporaryStorage, related_name="tree_nodes", on_delete=CASCADE)
+    node = IntegerField()
+    parent = IntegerField(null=True, blank=True)
+    text = TextField(blank=True)
+    child_count = IntegerField(default=0)
+
+    class Meta:
+        unique_together = [('storage', 'node')]
+        indexes = [Index(fields=['storage', 'parent'])]
+
+
+class UploadJob(DjangoModel):
+    # Uploaded files are queued here and loaded into the database by the process_uploads worker
+    STATUS_CHOICES = [
+        ("queued", "Queued"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    ]
+
+    storage = ForeignKey(TemporaryStorage, related_name="upload_jobs", on_delete=SET_NULL, null=True, blank=True)
+    file_name = CharField(max_length=250, blank=True)
+    owner = ForeignKey(Person, related_name="upload_jobs", on_delete=CASCADE, null=True, blank=True)
+    status = CharField(max_length=10, choices=STATUS_CHOICES, default="queued")
+    progress = IntegerField(default=0)  # Percent complete
+    message = TextField(blank=True)
+    model = ForeignKey('CellModel', related_name="upload_jobs", on_delete=SET_NULL, null=True, blank=True)
+    # When set, the file updates this model in place instead of creating a new one, and the differences are reported
+    target = ForeignKey('CellModel', related_name="update_jobs", on_delete=SET_NULL, null=True, blank=True)
+    report = JSONField(blank=True, null=True)
+
+    created = DateTimeField(auto_now_add=True)
+    started = DateTimeField(blank=True, null=True)
+    finished = DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return "{f} ({s})".format(f=self.file_name, s=self.status)
+
+    def set_progress(self, progress):
+        # Only the progress column is written so that the polling view never sees a half-saved job
+        self.progress = progress
+        UploadJob.objects.filter(id=self.id).update(progress=progress)
+
+
 @receiver(post_delete, sender=TemporaryStorage)
 def auto_delete_file_on_delete(sender, instance, **kwargs):
     """
@@ -306,6 +410,175 @@ def auto_delete_file_on_delete(sender, instance, **kwargs):
             os.remove(instance.file.path)
 
 
+def get_revision_model_ids(instance):
+    """
+    :param instance: a CellModel, or any item which can be contained in one
+    :return: list of the ids of the models which contain the item
+    """
+    item_type = type(instance).__name__.lower()
+    if item_type == 'cellmodel':
+        return [instance.id]
+    if item_type in ['component']:
+        return [instance.model_id]
+    if item_type in ['variable', 'reset']:
+        return list(Component.objects.filter(id=instance.component_id).values_list('model_id', flat=True))
+    if item_type == 'math':
+        if instance.component_id is not None:
+            return list(Component.objects.filter(id=instance.component_id).values_list('model_id', flat=True))
+        return list(Reset.objects.filter(Q(test_value_id=instance.id) | Q(reset_value_id=instance.id)).values_list(
+            'component__model_id', flat=True))
+    if item_type == 'compoundunit':
+        return list(CellModel.objects.filter(compoundunits__id=instance.id).values_list('id', flat=True))
+    if item_type == 'unit':
+        return list(CellModel.objects.filter(compoundunits__id=instance.parent_cu_id).values_list('id', flat=True))
+    return []
+
+
+# Fields written by the validation of an item, saving only these, or is_dirty, is not a change to the item
+VALIDATION_FIELDS = ['is_valid', 'last_checked', 'error_tree', 'child_list']
+
+
+def is_validation_save(update_fields):
+    return update_fields is not None and set(update_fields) <= set(VALIDATION_FIELDS + ['is_dirty'])
+
+
+def bump_revision(model_ids):
+    # Written as an update so that the CellModel save signal is not sent again
+    model_ids = [x for x in model_ids if x is not None]
+    if model_ids:
+        CellModel.objects.filter(id__in=model_ids).update(revision=F('revision') + 1)
+
+
+@receiver(post_save, sender=CellModel)
+@receiver(post_save, sender=Component)
+@receiver(post_save, sender=Variable)
+@receiver(post_save, sender=Reset)
+@receiver(post_save, sender=Math)
+@receiver(post_save, sender=CompoundUnit)
+@receiver(post_save, sender=Unit)
+@receiver(post_delete, sender=Component)
+@receiver(post_delete, sender=Variable)
+@receiver(post_delete, sender=Reset)
+@receiver(post_delete, sender=Math)
+@receiver(post_delete, sender=CompoundUnit)
+@receiver(post_delete, sender=Unit)
+def bump_revision_on_change(sender, instance, **kwargs):
+    # Items created by bulk_create or changed by queryset updates send no signals, so those callers bump it directly
+    if kwargs.get('raw') or is_validation_save(kwargs.get('update_fields')):
+        return
+    bump_revision(get_revision_model_ids(instance))
+
+
+@receiver(m2m_changed, sender=Variable.equivalent_variables.through)
+@receiver(m2m_changed, sender=Math.variables.through)
+@receiver(m2m_changed, sender=CompoundUnit.models.through)
+def bump_revision_on_link(sender, instance, action, pk_set, **kwargs):
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    model_ids = get_revision_model_ids(instance)
+    if type(instance) == CompoundUnit and pk_set:
+        model_ids += list(pk_set)
+    elif type(instance) == CellModel:
+        model_ids = [instance.id]
+    bump_revision(model_ids)
+
+
+def get_container_items(instance):
+    """
+    :param instance: any item which can be contained in a model
+    :return: list of (class, [ids]) tuples for the items which directly contain it
+    """
+    item_type = type(instance).__name__.lower()
+    if item_type in ['variable', 'reset', 'math']:
+        return [(Component, [instance.component_id])]
+    if item_type == 'component':
+        return [(Component, [instance.parent_component_id]), (CellModel, [instance.model_id])]
+    if item_type == 'unit':
+        return [(CompoundUnit, [instance.parent_cu_id])]
+    if item_type == 'compoundunit':
+        return [(CellModel, get_revision_model_ids(instance))]
+    return []
+
+
+def mark_dirty(items):
+    # Written as updates so that no signals are sent, and the revision of the model is not changed
+    for item_class, ids in items:
+        ids = [x for x in ids if x is not None]
+        if ids:
+            item_class.objects.filter(id__in=ids).update(is_dirty=True)
+
+
+@receiver(post_save, sender=CellModel)
+@receiver(post_save, sender=Component)
+@receiver(post_save, sender=Variable)
+@receiver(post_save, sender=Reset)
+@receiver(post_save, sender=Math)
+@receiver(post_save, sender=CompoundUnit)
+@receiver(post_save, sender=Unit)
+def mark_dirty_on_save(sender, instance, created, **kwargs):
+    # The items which depend on this one through links, rather than containment, are found when validating
+    if kwargs.get('raw') or is_validation_save(kwargs.get('update_fields')):
+        return
+    items = get_container_items(instance)
+    if not created:
+        items.append((type(instance), [instance.id]))
+    mark_dirty(items)
+
+
+@receiver(post_delete, sender=Component)
+@receiver(post_delete, sender=Variable)
+@receiver(post_delete, sender=Reset)
+@receiver(post_delete, sender=Math)
+@receiver(post_delete, sender=CompoundUnit)
+@receiver(post_delete, sender=Unit)
+def mark_dirty_on_delete(sender, instance, **kwargs):
+    mark_dirty(get_container_items(instance))
+
+
+@receiver(pre_delete, sender=Variable)
+def mark_users_dirty_on_delete(sender, instance, **kwargs):
+    # The items which refer to a deleted variable are no longer valid, and are found before the links to it are gone
+    Math.objects.filter(Q(identifiers__contains=[instance.name]) | Q(variables=instance),
+                        component_id=instance.component_id).update(is_dirty=True)
+    Reset.objects.filter(Q(variable=instance) | Q(test_variable=instance)).update(is_dirty=True)
+    Variable.objects.filter(Q(initial_value_variable=instance) | Q(equivalent_variables=instance)).update(
+        is_dirty=True)
+
+
+@receiver(m2m_changed, sender=Variable.equivalent_variables.through)
+@receiver(m2m_changed, sender=Math.variables.through)
+@receiver(m2m_changed, sender=CompoundUnit.models.through)
+def mark_dirty_on_link(sender, instance, action, model, pk_set, **kwargs):
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    mark_dirty([(type(instance), [instance.id]), (model, list(pk_set or []))])
+
+
+def clear_dimensions(compoundunit_ids):
+    # Units made from changed units have changed too, however deeply they are nested
+    found = set([x for x in compoundunit_ids if x is not None])
+    new = set(found)
+    while new:
+        new = set(CompoundUnit.objects.filter(product_of__child_cu_id__in=new).values_list('id', flat=True)) - found
+        found |= new
+    if found:
+        CompoundUnit.objects.filter(id__in=found).update(dimensions=None, scale=None)
+
+
+@receiver(post_save, sender=CompoundUnit)
+@receiver(post_save, sender=Unit)
+@receiver(post_delete, sender=Unit)
+def clear_dimensions_on_change(sender, instance, **kwargs):
+    if kwargs.get('raw') or is_validation_save(kwargs.get('update_fields')):
+        return
+    if type(instance) == CompoundUnit:
+        instance.dimensions = None
+        instance.scale = None
+        clear_dimensions([instance.id])
+    else:
+        clear_dimensions([instance.parent_cu_id])
+
+
 def get_parent_fields_for_model(item_model):
     parent_fields = [x.name for x in item_model.model_class()._meta.get_fields(include_parents=False) if
                      type(x) == ManyToOneRel or type(x) == ManyToManyRel]
@@ -0,0 +1,231 @@
+"""
+    This file contains the incremental validation of models and components.  The signals in main.models mark an item
+    as dirty when it, or something inside it, is changed.  Revalidating runs the validators from main.validate only on
+    the dirty items and on those which depend on them, and every other item keeps the result of its last validation.
+"""
+import datetime
+
+import pytz
+from django.db.models import Q
+
+from main.equivalence import EquivalenceClasses
+from main.functions import draw_error_tree
+from main.math_units import get_units_of_maths
+from main.models import CellModel, Component, Variable, Reset, Math, CompoundUnit, Unit, VALIDATION_FIELDS
+from main.validate import validate_variable, validate_reset, validate_math, validate_compoundunit, \
+    validate_component_locally, validate_cellmodel_locally, validate_connections, delete_unused_errors, \
+    get_model_error_ids
+
+
+def get_component_tree(model):
+    """
+    :param model: CellModel instance
+    :return: dictionary of {component id: parent component id} for the components in the model
+    """
+    return dict(Component.objects.filter(model=model).values_list('id', 'parent_component_id'))
+
+
+def get_subtree(parents, component_id):
+    # The component and every component it encapsulates, however deeply
+    subtree = set([component_id])
+    added = True
+    while added:
+        added = False
+        for child_id, parent_id in parents.items():
+            if parent_id in subtree and child_id not in subtree:
+                subtree.add(child_id)
+                added = True
+    return subtree
+
+
+def get_dirty_items(model, component_ids):
+    """
+    :param model: CellModel instance
+    :param component_ids: set of the ids of the components to look in
+    :return: dictionary of {item type: set of ids} of the items which have changed since they were last validated
+    """
+    dirty = {
+        'component': set(Component.objects.filter(id__in=component_ids, is_dirty=True).values_list('id', flat=True)),
+        'compoundunit': set(CompoundUnit.objects.filter(models=model, is_standard=False).filter(
+            Q(is_dirty=True) | Q(product_of__is_dirty=True)).values_list('id', flat=True)),
+    }
+    for item_type, item_class in [('variable', Variable), ('reset', Reset), ('math', Math)]:
+        dirty[item_type] = set(item_class.objects.filter(component_id__in=component_ids, is_dirty=True).values_list(
+            'id', flat=True))
+    return dirty
+
+
+def add_dependent_items(model, component_ids, parents, dirty):
+    """
+    Adds the items whose validity can change with the dirty ones to the dirty sets.
+    :param model: CellModel instance
+    :param component_ids: set of the ids of the components to look in
+    :param parents: dictionary of {component id: parent component id}
+    :param dirty: dictionary of {item type: set of ids}, as from get_dirty_items
+    """
+    variables = dirty['variable']
+
+    # Users of changed units
+    variables |= set(Variable.objects.filter(component_id__in=component_ids,
+                                             compoundunit_id__in=dirty['compoundunit']).values_list('id', flat=True))
+
+    # Equivalent-variable sets which contain a changed variable
+    classes = EquivalenceClasses()
+    for variable_1, variable_2 in Variable.equivalent_variables.through.objects.filter(
+            from_variable__component_id__in=component_ids,
+            to_variable__component_id__in=component_ids).values_list('from_variable_id', 'to_variable_id'):
+        classes.union(variable_1, variable_2)
+    roots = set([classes.find(variable_id) for variable_id in variables])
+    variables |= set([variable_id for variable_id in list(classes) if classes.find(variable_id) in roots])
+
+    # Variables initialised by, and resets and maths referring to, a changed variable
+    variables |= set(Variable.objects.filter(initial_value_variable_id__in=variables).values_list('id', flat=True))
+    dirty['reset'] |= set(Reset.objects.filter(Q(variable_id__in=variables) | Q(test_variable_id__in=variables),
+                                               component_id__in=component_ids).values_list('id', flat=True))
+    changed_components = set(Variable.objects.filter(id__in=variables).values_list('component_id', flat=True))
+    dirty['math'] |= set(Math.objects.filter(component_id__in=changed_components).values_list('id', flat=True))
+
+    # Components which contain any of the changed items, and all of the components above them
+    changed_components |= dirty['component']
+    changed_components |= set(Reset.objects.filter(id__in=dirty['reset']).values_list('component_id', flat=True))
+    changed_components |= set(Math.objects.filter(id__in=dirty['math']).values_list('component_id', flat=True))
+    dirty['component'] = set()
+    for component_id in changed_components:
+        while component_id in component_ids and component_id not in dirty['component']:
+            dirty['component'].add(component_id)
+            component_id = parents.get(component_id)
+
+
+def summarise_component(component, is_valid):
+    """
+    Sets the validity of a component from its own checks and the stored validity of the items inside it.
+    :param component: Component instance, whose own errors have just been checked
+    :param is_valid: result of validate_component_locally
+    :return: True if the component and everything in it is valid
+    """
+    for items in [component.child_components, component.variables, component.resets, component.maths]:
+        is_valid = is_valid and not items.filter(is_valid=False).exists()
+
+    error_tree, error_count = draw_error_tree(component)
+    error_count += component.errors.count()
+    component.error_tree = {'tree_html': error_tree, 'error_count': error_count}
+    component.is_valid = is_valid
+    component.last_checked = datetime.datetime.now(pytz.utc)
+    component.save(update_fields=VALIDATION_FIELDS)
+    return is_valid
+
+
+def revalidate_items(model, component_ids, parents, include_model=False):
+    """
+    Revalidates the dirty items in the given components, and those which depend on them.
+    :param model: CellModel instance
+    :param component_ids: set of the ids of the components to look in
+    :param parents: dictionary of {component id: parent component id} for the components in the model
+    :param include_model: True to revalidate the compound units of the model, which are outside of the components
+    :return: dictionary of {item type: set of ids} of the items which were revalidated
+    """
+    dirty = get_dirty_items(model, component_ids)
+    add_dependent_items(model, component_ids, parents, dirty)
+    if not include_model:
+        dirty['compoundunit'] = set()
+
+    # The validators save the items they check, along with the time set here
+    now = datetime.datetime.now(pytz.utc)
+    units = get_units_of_maths(model.id) if dirty['math'] else None
+    for variable in Variable.objects.filter(id__in=dirty['variable']).select_related(
+            'component', 'compoundunit', 'initial_value_variable__component', 'initial_value_variable__compoundunit'):
+        variable.last_checked = now
+        validate_variable(variable)
+    for reset in Reset.objects.filter(id__in=dirty['reset']):
+        reset.last_checked = now
+        validate_reset(reset)
+    for math in Math.objects.filter(id__in=dirty['math']).select_related('component'):
+        # Maths are not saved by validate_math, but the validity of their component is read from them
+        math.is_valid = validate_math(math, units)
+        math.last_checked = now
+        math.save(update_fields=VALIDATION_FIELDS)
+    for compoundunit in CompoundUnit.objects.filter(id__in=dirty['compoundunit']):
+        compoundunit.last_checked = now
+        validate_compoundunit(compoundunit)
+
+    # Components are summarised after everything they contain, including the components they encapsulate
+    def depth(component_id):
+        d = 0
+        while parents.get(component_id) is not None and d < len(parents):
+            component_id = parents[component_id]
+            d += 1
+        return d
+
+    components = {c.id: c for c in Component.objects.filter(id__in=dirty['component'])}
+    for component_id in sorted(components, key=depth, reverse=True):
+        component = components[component_id]
+        summarise_component(component, validate_component_locally(component))
+
+    return dirty
+
+
+def clear_dirty_items(revalidated):
+    # Written as updates so that clearing the flags is not seen as a change to the items
+    for item_type, item_class in [('component', Component), ('variable', Variable), ('reset', Reset), ('math', Math),
+                                  ('compoundunit', CompoundUnit)]:
+        if revalidated.get(item_type):
+            item_class.objects.filter(id__in=revalidated[item_type]).update(is_dirty=False)
+    if revalidated.get('compoundunit'):
+        Unit.objects.filter(parent_cu_id__in=revalidated['compoundunit']).update(is_dirty=False)
+
+
+def revalidate_cellmodel(model):
+    """
+    Validates the parts of a model which have changed since it was last validated.
+    :param model: CellModel instance
+    :return: True if the model is valid
+    """
+    parents = get_component_tree(model)
+    error_ids = get_model_error_ids(model)
+    revalidated = revalidate_items(model, set(parents), parents, include_model=True)
+    if model.is_valid is not None and not model.is_dirty and not any(revalidated.values()):
+        return model.is_valid
+
+    # The model's own checks, and those of the connections, cover all of its components so are always run again
+    is_valid = validate_cellmodel_locally(model)
+    is_valid = validate_connections(model) and is_valid
+    delete_unused_errors(error_ids)
+    is_valid = is_valid and not model.all_components.filter(is_valid=False).exists()
+    is_valid = is_valid and not model.compoundunits.filter(is_valid=False).exists()
+
+    error_tree, error_count = draw_error_tree(model)
+    error_count += model.errors.count()
+    model.error_tree = {'tree_html': error_tree, 'error_count': error_count}
+    model.is_valid = is_valid
+    model.last_checked = datetime.datetime.now(pytz.utc)
+    model.save(update_fields=VALIDATION_FIELDS)
+
+    clear_dirty_items(revalidated)
+    model.is_dirty = False
+    CellModel.objects.filter(id=model.id).update(is_dirty=False)
+    return is_valid
+
+
+def revalidate_component(component):
+    """
+    Validates the parts of a component, and the components it encapsulates, which have changed since they were last
+    validated.
+    :param component: Component instance
+    :return: True if the component and everything in it is valid
+    """
+    parents = get_component_tree(component.model)
+    if component.id not in parents:
+        parents[component.id] = None
+    revalidated = revalidate_items(component.model, get_subtree(parents, component.id), parents)
+    clear_dirty_items(revalidated)
+
+    component.refresh_from_db()
+    if component.is_valid is None:
+        return summarise_component(component, validate_component_locally(component))
+    return component.is_valid
+
+
+VALIDATE_INCREMENTAL_DICT = {
+    'cellmodel': revalidate_cellmodel,
+    'component': revalidate_component,
+}
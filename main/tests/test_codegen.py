@@ -0,0 +1,111 @@
+import ast
+
+import libcellml
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+
+from main.codegen import NumPyTransformer, PythonWriter, NUMPY_HEADER, unparse_python, vectorize_python_code, \
+    get_python_code
+from main.functions import load_model
+from main.models import CellModel, Person
+from main.tests.test_load import CELLML as LOADED, parse_model
+
+# A model using the functions for which libCellML's Python profile generates helpers, eg: min, max and the logical
+# operators
+CELLML = '''<?xml version="1.0" encoding="UTF-8"?>
+<model xmlns="http://www.cellml.org/cellml/2.0#" xmlns:cellml="http://www.cellml.org/cellml/2.0#" name="{name}">
+  <units name="ms"><unit units="second" prefix="milli"/></units>
+  <units name="per_ms"><unit units="ms" exponent="-1"/></units>
+  <component name="c">
+    <variable name="t" units="ms"/>
+    <variable name="x" units="dimensionless" initial_value="1"/>
+    <variable name="k" units="per_ms" initial_value="2"/>
+    <variable name="y" units="dimensionless"/>
+    <variable name="z" units="dimensionless"/>
+    <math xmlns="http://www.w3.org/1998/Math/MathML">
+      <apply><eq/><apply><diff/><bvar><ci>t</ci></bvar><ci>x</ci></apply>
+        <apply><times/><apply><minus/><ci>k</ci></apply><ci>y</ci></apply></apply>
+      <apply><eq/><ci>y</ci><piecewise>
+        <piece><apply><sin/><ci>x</ci></apply>
+          <apply><and/><apply><gt/><ci>x</ci><cn cellml:units="dimensionless">0</cn></apply>
+            <apply><not/><apply><lt/><ci>x</ci><cn cellml:units="dimensionless">-1</cn></apply></apply></apply></piece>
+        <otherwise><apply><power/><ci>x</ci><cn cellml:units="dimensionless">2</cn></apply></otherwise>
+      </piecewise></apply>
+      <apply><eq/><ci>z</ci><apply><plus/><apply><min/><ci>x</ci><ci>y</ci></apply>
+        <apply><max/><ci>x</ci><cn cellml:units="dimensionless">0.5</cn></apply></apply></apply>
+    </math>
+  </component>
+</model>'''
+
+
+def generate(text=CELLML):
+    # The module libCellML generates for the file, without going through the database
+    analyser = libcellml.Analyser()
+    analyser.analyseModel(parse_model("generated", text))
+    return libcellml.Generator().implementationCode(
+        analyser.analyserModel(), libcellml.GeneratorProfile(libcellml.GeneratorProfile.Profile.PYTHON))
+
+
+def transform(source):
+    tree = NumPyTransformer().visit(ast.parse(source))
+    ast.fix_missing_locations(tree)
+    return ast.dump(ast.parse(unparse_python(tree)))
+
+
+class NumPyTransformerTestCase(SimpleTestCase):
+    def assertTransformed(self, source, expected):
+        self.assertEqual(transform(source), ast.dump(ast.parse(expected)))
+
+    def test_expressions(self):
+        self.assertTransformed("y = a if x > 0.0 else b", "y = where(x > 0.0, a, b)")
+        self.assertTransformed("y = 1.0 if bool(x) & bool(z) else 0.0",
+                               "y = where(not_equal(x, 0.0) & not_equal(z, 0.0), 1.0, 0.0)")
+        self.assertTransformed("y = not x", "y = logical_not(x)")
+        self.assertTransformed("y = a and b and c or d", "y = logical_or(logical_and(logical_and(a, b), c), d)")
+        # Arithmetic already works on arrays
+        self.assertTransformed("rates[0] = -constants[0]*states[0]**2.0", "rates[0] = -constants[0]*states[0]**2.0")
+
+    def test_functions(self):
+        self.assertTransformed("def create_states_array():\n    return [nan]*STATE_COUNT",
+                               "def create_states_array(size=1):\n    return full((STATE_COUNT, size), nan)")
+        # Only the create_*_array functions make arrays of parameter sets
+        self.assertTransformed("def f():\n    return [nan]*STATE_COUNT", "def f():\n    return [nan]*STATE_COUNT")
+        self.assertTransformed("from math import *", NUMPY_HEADER)
+
+    def test_module(self):
+        code = vectorize_python_code(generate())
+        self.assertNotIn("from math", code)
+        # The helpers work on arrays too
+        for helper in ["def min(x, y):\n    return where(x < y, x, y)",
+                       "def and_func(x, y):\n    return where(not_equal(x, 0.0) & not_equal(y, 0.0), 1.0, 0.0)"]:
+            self.assertIn(helper, code)
+        self.assertIn("def create_algebraic_variables_array(size=1):", code)
+        compile(code, "generated", "exec")
+
+
+class PythonWriterTestCase(SimpleTestCase):
+    def test_same_tree(self):
+        # The module written without ast.unparse reads back as the same tree, before and after vectorizing
+        tree = ast.parse(generate())
+        self.assertEqual(ast.dump(ast.parse(PythonWriter().write(tree))), ast.dump(tree))
+
+        vectorized = ast.parse(vectorize_python_code(generate()))
+        self.assertEqual(ast.dump(ast.parse(PythonWriter().write(vectorized))), ast.dump(vectorized))
+
+    def test_brackets(self):
+        self.assertEqual(PythonWriter().write(ast.parse("y = (a - -1.0)**-b if not c else d[0:2]")),
+                         "y = (((a - (-1.0)) ** (-b)) if (not c) else d[0:2])\n")
+
+
+class PythonExportTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='daffy', email='daffy@duck.com', password='top_secret')
+        self.person = Person.objects.create(user=self.user, first_name="Daffy", last_name="Duck")
+
+    def test_stored_model(self):
+        for text in [CELLML, LOADED]:
+            model = load_model(parse_model("stored", text), self.person, batched=True)
+            code = get_python_code(CellModel.objects.get(id=model.id))
+            compile(code, "stored", "exec")
+            # The same module as for the file the model was loaded from
+            self.assertTrue(code.endswith(vectorize_python_code(generate(text))))
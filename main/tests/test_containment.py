@@ -0,0 +1,82 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from main.containment import get_error_tree_rows
+from main.functions import add_child_errors, draw_error_tree
+from main.models import CellModel, Component, Person, CompoundUnit, Variable, Math, ItemContainment
+from main.validate import validate_cellmodel
+
+
+class ContainmentTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='daffy', email='daffy@duck.com', password='top_secret')
+        self.person = Person.objects.create(user=self.user, first_name="Daffy", last_name="Duck")
+
+        self.model = CellModel(name="model1", owner=self.person)
+        self.model.save()
+        self.cu = CompoundUnit(name="1mV", owner=self.person)
+        self.cu.save()
+        self.cu.models.add(self.model)
+        self.components = []
+        self.add_components(2)
+
+    def add_components(self, count):
+        # Each top-level component encapsulates a child, and both have a variable without units and broken maths
+        for c in range(len(self.components), len(self.components) + count):
+            component = Component(name="c{}".format(c), model=self.model, parent_model=self.model, owner=self.person)
+            component.save()
+            child = Component(name="c{}_child".format(c), model=self.model, parent_component=component,
+                              owner=self.person)
+            child.save()
+            for item in [component, child]:
+                Variable(name="v", component=item, owner=self.person).save()
+                Math(math_ml="<math><ci>x</ci></math>", component=item, owner=self.person).save()
+            self.components.append(component)
+
+    def get_old_tree(self, item):
+        # The errors found by walking down the tree one item at a time
+        return sorted([(child_type, child_item.id, child_item.name, err.spec, err.hints)
+                       for child_item, child_type, errors in set(add_child_errors(item, [])) for err in errors])
+
+    def test_same_errors(self):
+        validate_cellmodel(CellModel.objects.get(id=self.model.id))
+        for item in [self.model] + list(Component.objects.all()):
+            rows = get_error_tree_rows(item)
+            self.assertTrue(rows)
+            self.assertEqual(sorted(rows), self.get_old_tree(item))
+
+        rows = get_error_tree_rows(self.model)
+        self.assertEqual(len([row for row in rows if row[0] == 'compoundunit']), 1)
+        self.assertEqual(len([row for row in rows if row[0] == 'math']), 4)
+        self.assertEqual(get_error_tree_rows(Variable.objects.first()), [])
+
+    def test_query_count(self):
+        validate_cellmodel(CellModel.objects.get(id=self.model.id))
+        draw_error_tree(self.model)
+        with CaptureQueriesContext(connection) as small:
+            draw_error_tree(self.model)
+        self.add_components(10)
+        validate_cellmodel(CellModel.objects.get(id=self.model.id))
+        draw_error_tree(self.model)
+        with CaptureQueriesContext(connection) as large:
+            html, count = draw_error_tree(self.model)
+        self.assertEqual(len(large), len(small))
+        self.assertEqual(len(large), 2)
+        self.assertEqual(count, len(get_error_tree_rows(self.model)))
+
+    def test_rebuilt_on_change(self):
+        get_error_tree_rows(self.model)
+        self.assertEqual(ItemContainment.objects.filter(ancestor_type='component',
+                                                        ancestor_id=self.components[0].id).count(), 5)
+
+        # Moving a component under another changes the model's revision, so the rows are written again
+        child = Component.objects.get(name="c1_child")
+        child.parent_component = self.components[0]
+        child.save()
+        get_error_tree_rows(self.model)
+        self.assertEqual(ItemContainment.objects.filter(ancestor_type='component',
+                                                        ancestor_id=self.components[0].id).count(), 8)
+        self.assertEqual(ItemContainment.objects.get(ancestor_type='cellmodel', descendant_type='component',
+                                                     descendant_id=child.id).depth, 2)
@@ -0,0 +1,45 @@
+from django.test import SimpleTestCase
+
+from main.equivalence import find_cycles
+
+
+class FindCyclesTestCase(SimpleTestCase):
+    def assertCycles(self, pairs, expected):
+        # Each cycle may be found starting from any of its variables, and in either direction
+        def canonical(cycle):
+            cycle = cycle[:-1]
+            first = cycle.index(min(cycle))
+            cycle = cycle[first:] + cycle[:first]
+            return min(tuple(cycle), tuple([cycle[0]] + cycle[1:][::-1]))
+
+        cycles = find_cycles(pairs)
+        for cycle in cycles:
+            self.assertEqual(cycle[0], cycle[-1])
+            for variable_1, variable_2 in zip(cycle, cycle[1:]):
+                self.assertIn(tuple(sorted([variable_1, variable_2])), [tuple(sorted(pair)) for pair in pairs])
+        self.assertEqual(sorted([canonical(cycle) for cycle in cycles]), sorted(expected))
+
+    def test_no_cycles(self):
+        self.assertCycles([(1, 2), (2, 3), (2, 4), (5, 6)], [])
+
+    def test_both_directions(self):
+        # Links are stored in both directions, which is not a cycle
+        self.assertCycles([(1, 2), (2, 1), (2, 3), (3, 2)], [])
+
+    def test_triangle(self):
+        self.assertCycles([(1, 2), (2, 3), (3, 1), (2, 1)], [(1, 2, 3)])
+
+    def test_self(self):
+        self.assertCycles([(1, 1), (1, 2)], [(1,)])
+
+    def test_independent_cycles(self):
+        # A square with a diagonal has two independent cycles, and a separate triangle has one more
+        cycles = find_cycles([(1, 2), (2, 3), (3, 4), (4, 1), (1, 3), (5, 6), (6, 7), (7, 5)])
+        self.assertEqual(len(cycles), 3)
+
+    def test_long_ring(self):
+        # Deep enough that a recursive search would fail
+        size = 20000
+        cycles = find_cycles([(i, (i + 1) % size) for i in range(size)])
+        self.assertEqual(len(cycles), 1)
+        self.assertEqual(len(cycles[0]), size + 1)
@@ -0,0 +1,54 @@
+import io
+import zipfile
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from main.export import stream_cellml_models, get_export_file_name
+from main.functions import load_model, get_model_for_export, convert_to_cellml_model
+from main.models import CellModel, Person
+from main.tests.test_load import CELLML, parse_model
+
+# The model of test_load with the membrane component, and everything in it, repeated
+COMPONENT = CELLML[CELLML.index('  <component name="membrane">'):CELLML.index('  <component name="gate">')]
+
+
+def parse_repeated_model(count):
+    components = "".join([COMPONENT.replace('"membrane"', '"membrane_{}"'.format(c)) for c in range(count)])
+    return parse_model(text=CELLML.replace(COMPONENT, COMPONENT + components))
+
+
+class ExportQueriesTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='daffy', email='daffy@duck.com', password='top_secret')
+        self.person = Person.objects.create(user=self.user, first_name="Daffy", last_name="Duck")
+
+    def test_query_count(self):
+        # The whole model is read with a fixed number of queries, and converting it makes none
+        small = load_model(parse_repeated_model(1), self.person, batched=True)
+        with self.assertNumQueries(8):
+            convert_to_cellml_model(get_model_for_export(small), prefetched=True)
+
+        large = load_model(parse_repeated_model(10), self.person, batched=True)
+        with self.assertNumQueries(8):
+            out_model = convert_to_cellml_model(get_model_for_export(large), prefetched=True)
+        self.assertEqual(out_model.componentCount(), 12)
+
+
+class StreamExportTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='daffy', email='daffy@duck.com', password='top_secret')
+        self.person = Person.objects.create(user=self.user, first_name="Daffy", last_name="Duck")
+
+    def test_stream(self):
+        models = [load_model(parse_model("model{}".format(m)), self.person, batched=True) for m in range(3)]
+        data = b"".join(stream_cellml_models(CellModel.objects.filter(owner=self.person)))
+
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertEqual(sorted(archive.namelist()), sorted([get_export_file_name(m.id, m.name) for m in models]))
+            self.assertIn('name="model1"', archive.read(get_export_file_name(models[1].id, "model1")).decode('utf-8'))
+
+        # The models were printed in this process, which kept its connection to the database
+        self.assertIsNotNone(connection.connection)
@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from main.imports import ImportCache
+from main.models import CellModel, Person
+from main.tests.test_load import CELLML
+
+
+class ImportCacheTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='daffy', email='daffy@duck.com', password='top_secret')
+        self.person = Person.objects.create(user=self.user, first_name="Daffy", last_name="Duck")
+
+        # A secret file next to the dependency directory, which must not be reachable from an import
+        self.directory = tempfile.mkdtemp()
+        self.dependencies = os.path.join(self.directory, "dependencies")
+        os.makedirs(os.path.join(self.dependencies, "units"))
+        for file_name, name in [("secret.cellml", "secret"), ("dependencies/units/common.cellml", "common")]:
+            with open(os.path.join(self.directory, file_name), 'w') as f:
+                f.write(CELLML.format(name=name))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_resolve(self):
+        cache = ImportCache(self.dependencies, self.person)
+        model = cache.resolve("units/../units/common.cellml")
+        self.assertEqual((model.name, model.uploaded_from), ("common", "units/common.cellml"))
+
+        # The same file is only loaded once
+        with cache.reading("main/model.cellml"):
+            self.assertEqual(cache.resolve("../units/common.cellml").id, model.id)
+        self.assertEqual(CellModel.objects.count(), 1)
+
+    def test_outside(self):
+        cache = ImportCache(self.dependencies, self.person)
+        for url in ["../secret.cellml", "units/../../secret.cellml", os.path.join(self.directory, "secret.cellml")]:
+            with self.assertRaises(ValueError):
+                cache.resolve(url)
+        with cache.reading("units/common.cellml"):
+            with self.assertRaises(ValueError):
+                cache.resolve("../../secret.cellml")
+        self.assertFalse(CellModel.objects.exists())
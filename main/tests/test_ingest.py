@@ -0,0 +1,119 @@
+import importlib
+import os
+import pickle
+import shutil
+import tempfile
+import zipfile
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.test import TestCase, TransactionTestCase
+
+from main.functions import load_model
+from main.ingest import read_cellml_files, parse_cellml_file, ParsedModel, ingest_cellml_files
+from main.jobs import load_uploaded_model
+from main.models import CellModel, Person, Prefix
+from main.tests.test_load import CELLML, parse_model, get_model_rows
+
+
+class IngestTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='daffy', email='daffy@duck.com', password='top_secret')
+        self.person = Person.objects.create(user=self.user, first_name="Daffy", last_name="Duck")
+        self.other = Person.objects.create(user=User.objects.create_user(username='donald'), first_name="Donald",
+                                           last_name="Duck")
+
+        self.directory = tempfile.mkdtemp()
+        self.archive = os.path.join(self.directory, "models.zip")
+        with zipfile.ZipFile(self.archive, 'w') as archive:
+            archive.writestr("b/second.cellml", CELLML.format(name="second"))
+            archive.writestr("a/first.xml", CELLML.format(name="first"))
+            archive.writestr("a/broken.cellml", "<model")
+            archive.writestr("readme.txt", "Not a model")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_read_archive(self):
+        self.assertEqual([name for name, text in read_cellml_files(self.archive)],
+                         ["a/broken.cellml", "a/first.xml", "b/second.cellml"])
+
+    def test_parse(self):
+        files = dict(read_cellml_files(self.archive))
+        broken = parse_cellml_file(("a/broken.cellml", files["a/broken.cellml"]))
+        self.assertIsNone(broken['model'])
+        self.assertTrue(broken['errors'])
+
+        # The snapshot is what the workers send back, so it must survive pickling
+        parsed = parse_cellml_file(("a/first.xml", files["a/first.xml"]))
+        self.assertEqual(parsed['errors'], [])
+        snapshot = pickle.loads(pickle.dumps(parsed['model']))
+        self.assertIsInstance(snapshot, ParsedModel)
+        self.assertEqual(snapshot.name(), "first")
+
+        # A file which isn't UTF-8 is that file's error, not the caller's
+        latin = parse_cellml_file(("a/latin.cellml", "<model name='caf\xe9'/>".encode('latin-1')))
+        self.assertIsNone(latin['model'])
+        self.assertTrue(latin['errors'][0].startswith("Could not read file - UnicodeDecodeError"))
+        unreadable = parse_cellml_file(("a/gone.cellml", FileNotFoundError("gone")))
+        self.assertEqual(unreadable['errors'], ["Could not read file - FileNotFoundError: gone"])
+
+    def test_snapshot_loads_same_rows(self):
+        in_model = parse_model()
+        snapshot = pickle.loads(pickle.dumps(ParsedModel(in_model)))
+
+        direct = load_model(in_model, self.person, batched=True)
+        loaded = load_uploaded_model(snapshot, self.other, "loaded.cellml")
+        self.assertEqual(get_model_rows(CellModel.objects.get(id=loaded.id)),
+                         get_model_rows(CellModel.objects.get(id=direct.id)))
+
+        membrane = [snapshot.component(c) for c in range(snapshot.componentCount())
+                    if snapshot.component(c).name() == "membrane"][0]
+        self.assertEqual((membrane.name(), membrane.componentCount(), membrane.component(0).name()),
+                         ("membrane", 1, "gate"))
+        self.assertIs(membrane.component(0).parentComponent(), membrane)
+        t = membrane.variable(0)
+        self.assertEqual(sorted([(t.equivalentVariable(e).parentComponent().name(), t.equivalentVariable(e).name())
+                                 for e in range(t.equivalentVariableCount())]), [("clock", "t"), ("gate", "t")])
+        self.assertEqual(snapshot.units(0).unitAttributes(0)[:2], in_model.units(0).unitAttributes(0)[:2])
+
+
+class IngestArchiveTestCase(TransactionTestCase):
+    # The archive is parsed in worker processes and the connection is closed before they start, so the loaded models
+    # are committed and the tables are emptied afterwards, including the built-in units which are then added again
+    def setUp(self):
+        if not Prefix.objects.exists():
+            setup_data = importlib.import_module('main.migrations.0002_setup_data')
+            setup_data.add_administrator_accounts(apps, None)
+            setup_data.add_error_codes(apps, None)
+            setup_data.add_standards(apps, None)
+
+        self.user = User.objects.create_user(username='daffy', email='daffy@duck.com', password='top_secret')
+        self.person = Person.objects.create(user=self.user, first_name="Daffy", last_name="Duck")
+
+        self.directory = tempfile.mkdtemp()
+        self.archive = os.path.join(self.directory, "models.zip")
+        with zipfile.ZipFile(self.archive, 'w') as archive:
+            archive.writestr("a/first.xml", CELLML.format(name="first"))
+            archive.writestr("a/latin.cellml", CELLML.format(name="caf\xe9").encode('latin-1'))
+            archive.writestr("b/broken.cellml", "<model")
+            archive.writestr("b/copy.cellml", CELLML.format(name="first"))
+            archive.writestr("c/second.cellml", CELLML.format(name="second"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_ingest(self):
+        report = ingest_cellml_files(self.archive, self.person, processes=2)
+        self.assertEqual([(entry['file'], entry['status']) for entry in report],
+                         [("a/first.xml", "loaded"), ("a/latin.cellml", "parse_error"),
+                          ("b/broken.cellml", "parse_error"), ("b/copy.cellml", "already_loaded"),
+                          ("c/second.cellml", "loaded")])
+
+        # The file which couldn't be decoded is reported, and the files after it are still loaded
+        self.assertTrue(report[1]['errors'][0].startswith("Could not read file - UnicodeDecodeError"))
+        self.assertTrue(report[2]['errors'])
+        self.assertEqual(report[3]['model_id'], report[0]['model_id'])
+        self.assertEqual(sorted(CellModel.objects.filter(owner=self.person).values_list('name', 'uploaded_from')),
+                         [("first", "a/first.xml"), ("second", "c/second.cellml")])
+        self.assertEqual(CellModel.objects.get(id=report[4]['model_id']).name, "second")
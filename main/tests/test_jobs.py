@@ -0,0 +1,114 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import libcellml
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.http import Http404
+from django.test import TestCase, RequestFactory, override_settings
+
+from main.jobs import claim_upload_job, fail_upload_job, process_upload_job
+from main.models import Person, UploadJob, TemporaryStorage, CellModel, Component, Variable
+from main.tests.test_load import CELLML
+from main.views import ajax_upload_status, upload_status
+
+
+class UploadJobTestCase(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user(username='daffy', email='daffy@duck.com', password='top_secret')
+        self.person = Person.objects.create(user=self.user, first_name="Daffy", last_name="Duck")
+        self.other = User.objects.create_user(username='donald', email='donald@duck.com', password='top_secret')
+        Person.objects.create(user=self.other, first_name="Donald", last_name="Duck")
+
+        self.job = UploadJob.objects.create(owner=self.person, file_name="model.cellml")
+
+    def get_status(self, user, job_id=None):
+        request = self.factory.get('/ajax_upload_status/')
+        request.user = user
+        response = ajax_upload_status(request, job_id or self.job.id)
+        return response.status_code, json.loads(response.content.decode('utf-8'))
+
+    def test_claim(self):
+        job = claim_upload_job()
+        self.assertEqual((job.id, job.status), (self.job.id, "running"))
+        self.assertIsNone(claim_upload_job())
+
+        job.set_progress(40)
+        status, data = self.get_status(self.user)
+        self.assertEqual((status, data['job_status'], data['progress']), (200, "running", 40))
+
+        fail_upload_job(job, "Could not load the model")
+        status, data = self.get_status(self.user)
+        self.assertEqual((data['job_status'], data['message']), ("failed", "Could not load the model"))
+
+    def test_only_owner(self):
+        # Other people are told that the job does not exist, the same as for a job which really doesn't
+        self.assertEqual(self.get_status(self.other)[0], 404)
+        self.assertEqual(self.get_status(self.user, job_id=self.job.id + 1)[0], 404)
+
+        request = self.factory.get('/upload_status/')
+        request.user = self.other
+        with self.assertRaises(Http404):
+            upload_status(request, self.job.id)
+
+
+class ProcessUploadJobTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='daffy', email='daffy@duck.com', password='top_secret')
+        self.person = Person.objects.create(user=self.user, first_name="Daffy", last_name="Duck")
+
+        # The uploaded files are written to a directory of their own, which is removed afterwards
+        self.directory = tempfile.mkdtemp()
+        self.media = override_settings(MEDIA_ROOT=self.directory)
+        self.media.enable()
+
+    def tearDown(self):
+        self.media.disable()
+        shutil.rmtree(self.directory)
+
+    def queue(self, cellml_text):
+        storage = TemporaryStorage(owner=self.person)
+        storage.file.save("model.cellml", ContentFile(cellml_text.encode('utf-8')))
+        UploadJob.objects.create(owner=self.person, file_name="model.cellml", storage=storage)
+        return claim_upload_job()
+
+    def assertFailed(self, job, message):
+        job = UploadJob.objects.get(id=job.id)
+        self.assertEqual(job.status, "failed")
+        self.assertTrue(job.message.startswith(message), job.message)
+        self.assertIsNotNone(job.finished)
+        self.assertIsNone(job.model)
+        self.assertFalse(TemporaryStorage.objects.exists())
+        self.assertEqual(os.listdir(self.directory), [])
+        # Nothing of the model is left behind
+        for item_class in [CellModel, Component, Variable]:
+            self.assertFalse(item_class.objects.filter(owner=self.person).exists())
+
+    def test_done(self):
+        job = process_upload_job(self.queue(CELLML.format(name="uploaded")))
+        job = UploadJob.objects.get(id=job.id)
+        self.assertEqual((job.status, job.progress, job.message), ("done", 100, ""))
+        self.assertIsNotNone(job.finished)
+        self.assertEqual((job.model.name, job.model.owner, job.model.uploaded_from),
+                         ("uploaded", self.person, "model.cellml"))
+        self.assertEqual(job.model.all_components.count(), 3)
+        # The uploaded file is no longer needed
+        self.assertIsNone(job.storage)
+        self.assertFalse(TemporaryStorage.objects.exists())
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_parse_error(self):
+        # The parser's errors are the message
+        parser = libcellml.Parser()
+        parser.parseModel("<model")
+        self.assertFailed(process_upload_job(self.queue("<model")), parser.error(0).description())
+
+    def test_load_error(self):
+        # The components and variables are written before the resets, and are rolled back with them
+        with mock.patch('main.load.load_resets_in_bulk', side_effect=RuntimeError("failed")):
+            job = process_upload_job(self.queue(CELLML.format(name="uploaded")))
+        self.assertFailed(job, "Could not load the model into the database\nRuntimeError")
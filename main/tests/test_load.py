@@ -0,0 +1,150 @@
+import libcellml
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from main.functions import load_model, connect_equivalent_variables
+from main.models import CellModel, Person, CompoundUnit, Unit, Variable
+
+CELLML = '''<?xml version="1.0" encoding="UTF-8"?>
+<model xmlns="http://www.cellml.org/cellml/2.0#" name="{name}">
+  <units name="mV"><unit units="volt" prefix="milli"/></units>
+  <units name="per_ms"><unit units="second" prefix="milli" exponent="-1"/></units>
+  <units name="mV_per_ms"><unit units="mV"/><unit units="per_ms"/></units>
+  <component name="membrane">
+    <variable name="t" units="ms_base" interface="public_and_private"/>
+    <variable name="V" units="mV" initial_value="-84.5" interface="public_and_private"/>
+    <variable name="V_0" units="mV" initial_value="V"/>
+    <variable name="k" units="per_ms" initial_value="0.5"/>
+    <math xmlns="http://www.w3.org/1998/Math/MathML">
+      <apply><eq/><apply><diff/><bvar><ci>t</ci></bvar><ci>V</ci></apply>
+        <apply><times/><ci>k</ci><apply><minus/><ci>V_0</ci><ci>V</ci></apply></apply></apply>
+    </math>
+  </component>
+  <component name="gate">
+    <variable name="t" units="ms_base" interface="public"/>
+    <variable name="V" units="mV" interface="public"/>
+  </component>
+  <component name="clock">
+    <variable name="t" units="ms_base" interface="public"/>
+  </component>
+  <encapsulation><component_ref component="membrane"><component_ref component="gate"/></component_ref></encapsulation>
+  <connection component_1="membrane" component_2="gate">
+    <map_variables variable_1="V" variable_2="V"/>
+    <map_variables variable_1="t" variable_2="t"/>
+  </connection>
+  <connection component_1="membrane" component_2="clock"><map_variables variable_1="t" variable_2="t"/></connection>
+</model>'''
+
+
+def parse_model(name="loaded", text=CELLML):
+    return libcellml.Parser().parseModel(text.format(name=name))
+
+
+def get_model_rows(model):
+    # Everything that loading writes, by name rather than id so that two loads of one file can be compared
+    rows = []
+    for c in model.all_components.order_by('name'):
+        rows.append(('component', c.name, c.cellml_index, c.cellml_id, c.content_hash,
+                     c.parent_component.name if c.parent_component else None, c.parent_model_id == model.id))
+        for v in c.variables.order_by('name'):
+            rows.append(('variable', c.name, v.name, v.cellml_index, v.compoundunit.name if v.compoundunit else None,
+                         v.initial_value_constant,
+                         v.initial_value_variable.name if v.initial_value_variable else None,
+                         tuple(sorted([(e.component.name, e.name) for e in v.equivalent_variables.all()]))))
+        for m in c.maths.order_by('id'):
+            rows.append(('math', c.name, m.math_ml, tuple(m.identifiers), tuple(m.operators),
+                         tuple(sorted(m.variables.values_list('name', flat=True)))))
+    for cu in model.compoundunits.order_by('name'):
+        rows.append(('compoundunit', cu.name, cu.symbol, cu.is_standard, cu.cellml_index, cu.content_hash,
+                     tuple([(u.name, u.prefix.name, u.exponent, u.multiplier, u.child_cu.name if u.child_cu else None)
+                            for u in cu.product_of.order_by('cellml_index')])))
+    return rows
+
+
+class LoadModelTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='daffy', email='daffy@duck.com', password='top_secret')
+        self.person = Person.objects.create(user=self.user, first_name="Daffy", last_name="Duck")
+        # Each load is by a different person, so that nothing is reused between them
+        self.other = Person.objects.create(user=User.objects.create_user(username='donald'), first_name="Donald",
+                                           last_name="Duck")
+
+    def test_same_rows(self):
+        one_by_one = load_model(parse_model(), self.person)
+        batched = load_model(parse_model(), self.other, batched=True)
+
+        rows = get_model_rows(CellModel.objects.get(id=one_by_one.id))
+        self.assertEqual(get_model_rows(CellModel.objects.get(id=batched.id)), rows)
+        self.assertEqual(len([row for row in rows if row[0] == 'component']), 3)
+        self.assertIn(('variable', 'membrane', 'V_0', 2, 'mV', None, 'V', ()), rows)
+        self.assertIn(('variable', 'membrane', 't', 0, 'ms_base', None, None, (('clock', 't'), ('gate', 't'))), rows)
+
+    def test_duplicate_units(self):
+        # An invalid file with two units of one name: both are loaded and linked to the model, with their child units
+        text = CELLML.replace('<units name="mV_per_ms">', '<units name="mV"><unit units="volt"/></units>\n  '
+                                                           '<units name="mV_per_ms">')
+        one_by_one = load_model(parse_model(text=text), self.person)
+        batched = load_model(parse_model(text=text), self.other, batched=True)
+
+        rows = sorted(get_model_rows(CellModel.objects.get(id=one_by_one.id)))
+        self.assertEqual(sorted(get_model_rows(CellModel.objects.get(id=batched.id))), rows)
+        for model in [one_by_one, batched]:
+            units = CompoundUnit.objects.filter(name="mV", models=model).order_by('cellml_index')
+            self.assertEqual([list(cu.product_of.values_list('prefix__name', flat=True)) for cu in units],
+                             [["milli"], [""]])
+            # References to the name are to the first of them
+            self.assertEqual(Variable.objects.get(name="V", component__name="membrane", component__model=model)
+                             .compoundunit_id, units[0].id)
+        self.assertFalse(CompoundUnit.objects.filter(is_standard=False, models__isnull=True).exists())
+
+    def test_progress(self):
+        fractions = []
+        load_model(parse_model(), self.person, batched=True, progress=fractions.append)
+        self.assertEqual(fractions, sorted(fractions))
+        self.assertEqual(fractions[-1], 1.0)
+
+    def test_units_not_shared(self):
+        # Loading the same file twice gives each model its own copy of the units, with the same structure
+        first = load_model(parse_model(), self.person)
+        second = load_model(parse_model(), self.person, batched=True)
+        for name in ["mV", "mV_per_ms", "ms_base"]:
+            units = CompoundUnit.objects.filter(name=name, owner=self.person)
+            self.assertEqual(units.count(), 2)
+            self.assertEqual(len(set(units.values_list('content_hash', flat=True))), 1)
+            self.assertEqual(set([cu.models.get().id for cu in units]), set([first.id, second.id]))
+
+        # The built-in units are shared by both
+        volt = CompoundUnit.objects.get(name="volt", is_standard=True)
+        self.assertEqual(Unit.objects.filter(child_cu=volt, parent_cu__name="mV").count(), 2)
+
+        # Changing the units of one model leaves the other as it was
+        first_mv = CompoundUnit.objects.get(name="mV", models=first)
+        first_mv.product_of.update(exponent=2)
+        second_mv = CompoundUnit.objects.get(name="mV", models=second)
+        self.assertEqual(list(second_mv.product_of.values_list('exponent', flat=True)), [1])
+        self.assertEqual(second_mv.cellml_index, first_mv.cellml_index)
+
+
+class ConnectEquivalentVariablesTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='daffy', email='daffy@duck.com', password='top_secret')
+        self.person = Person.objects.create(user=self.user, first_name="Daffy", last_name="Duck")
+
+    def get_links(self, model):
+        through = Variable.equivalent_variables.through
+        return sorted([((x.from_variable.component.name, x.from_variable.name),
+                        (x.to_variable.component.name, x.to_variable.name))
+                       for x in through.objects.filter(from_variable__component__model=model)])
+
+    def test_links(self):
+        in_model = parse_model()
+        model = load_model(in_model, self.person, batched=True)
+        expected = [(("clock", "t"), ("membrane", "t")), (("gate", "V"), ("membrane", "V")),
+                    (("gate", "t"), ("membrane", "t")), (("membrane", "V"), ("gate", "V")),
+                    (("membrane", "t"), ("clock", "t")), (("membrane", "t"), ("gate", "t"))]
+        self.assertEqual(self.get_links(model), expected)
+
+        # Linking again adds nothing, with the same few queries
+        with self.assertNumQueries(3):
+            connect_equivalent_variables(model, in_model)
+        self.assertEqual(self.get_links(model), expected)
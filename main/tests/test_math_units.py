@@ -0,0 +1,126 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from main.math_units import UnitsChecker, describe_dimensions, get_units_of_maths
+from main.models import CellModel, Component, Person, CompoundUnit, Variable, Math
+from main.tests.test_validate_bulk import get_model_errors
+from main.validate import validate_cellmodel
+from main.validate_bulk import validate_cellmodel_in_bulk
+
+# In the order ampere, candela, kelvin, kilogram, metre, mole, second
+VOLT = ([-1.0, 0.0, 0.0, 1.0, 2.0, 0.0, -3.0], 1.0)
+MILLIVOLT = ([-1.0, 0.0, 0.0, 1.0, 2.0, 0.0, -3.0], 0.001)
+SECOND = ([0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 1.0], 1.0)
+DIMENSIONLESS = ([0.0] * 7, 1.0)
+
+MATH = '<math xmlns="http://www.w3.org/1998/Math/MathML" xmlns:cellml="http://www.cellml.org/cellml/2.0#">{}</math>'
+
+
+def apply(operator, *arguments):
+    return "<apply><{o}/>{a}</apply>".format(o=operator, a="".join(arguments))
+
+
+def ci(name):
+    return "<ci>{}</ci>".format(name)
+
+
+def cn(value, units):
+    return '<cn cellml:units="{u}">{v}</cn>'.format(u=units, v=value)
+
+
+class UnitsCheckerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.checker = UnitsChecker({'V': VOLT, 'mV': MILLIVOLT, 't': SECOND, 'x': None},
+                                    {'volt': VOLT, 'second': SECOND, 'dimensionless': DIMENSIONLESS})
+
+    def check(self, *expressions):
+        return [operation for operation, dimensions in self.checker.check("".join([MATH.format(e)
+                                                                                   for e in expressions]))]
+
+    def test_consistent(self):
+        # dV/dt = mV/t + 2 V/s, with volts and millivolts having the same dimensions
+        rate = apply('divide', ci('V'), ci('t'))
+        self.assertEqual(self.check(apply('eq', apply('diff', '<bvar><ci>t</ci></bvar>', ci('V')),
+                                          apply('plus', apply('divide', ci('mV'), ci('t')),
+                                                apply('times', cn(2, 'dimensionless'), rate)))), [])
+        self.assertEqual(self.check(apply('eq', ci('t'), apply('root', apply('times', ci('t'), ci('t'))))), [])
+        self.assertEqual(self.check(apply('eq', apply('exp', ci('V')),
+                                          apply('power', ci('t'), cn(0, 'dimensionless')))), [])
+
+    def test_mismatches(self):
+        self.assertEqual(self.check(apply('plus', ci('V'), ci('t'))), ["adds terms"])
+        self.assertEqual(self.check(apply('eq', ci('V'), apply('times', ci('V'), ci('t')))),
+                         ["sets expressions equal"])
+        self.assertEqual(self.check(apply('lt', ci('t'), cn(1, 'volt'))), ["compares expressions"])
+        # Several blocks are checked, each of them once
+        self.assertEqual(self.check(apply('eq', ci('V'), ci('t')), apply('minus', ci('t'), ci('mV'))),
+                         ["sets expressions equal", "subtracts terms"])
+
+    def test_unknown(self):
+        # Nothing is reported about terms whose units are not known, or anything containing them
+        self.assertEqual(self.check(apply('eq', ci('V'), apply('times', ci('x'), ci('t')))), [])
+        self.assertEqual(self.check(apply('eq', ci('V'), ci('nothing'))), [])
+        self.assertEqual(self.check(apply('eq', ci('V'), cn(1, 'nothing'))), [])
+        self.assertEqual(self.checker.check("<math><apply>"), [])
+
+    def test_describe(self):
+        self.assertEqual(describe_dimensions(VOLT), "A^-1.kg.m^2.s^-3")
+        self.assertEqual(describe_dimensions(DIMENSIONLESS), "dimensionless")
+
+
+class MathUnitsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='daffy', email='daffy@duck.com', password='top_secret')
+        self.person = Person.objects.create(user=self.user, first_name="Daffy", last_name="Duck")
+
+        self.model = CellModel(name="model1", owner=self.person)
+        self.model.save()
+        self.volt = CompoundUnit.objects.get(name="volt", is_standard=True)
+        self.second = CompoundUnit.objects.get(name="second", is_standard=True)
+
+    def add_components(self, count, start=0):
+        for c in range(start, start + count):
+            component = Component(name="c{}".format(c), model=self.model, owner=self.person)
+            component.save()
+            Variable(name="V", component=component, compoundunit=self.volt, owner=self.person).save()
+            Variable(name="t", component=component, compoundunit=self.second, owner=self.person).save()
+            # Fine in even components, but adding volts to seconds in odd ones
+            term = ci('V') if c % 2 == 0 else ci('t')
+            Math(math_ml=MATH.format(apply('eq', ci('V'), apply('plus', ci('V'), term))), component=component,
+                 owner=self.person).save()
+
+    def test_validation(self):
+        self.add_components(4)
+        self.assertFalse(validate_cellmodel(CellModel.objects.get(id=self.model.id)))
+        expected = get_model_errors(self.model)
+        maths = [e for e in expected if e[0] == 'Math']
+        self.assertEqual(len(maths), 2)
+        self.assertIn("adds terms with different units: <i>A^-1.kg.m^2.s^-3</i>, <i>s</i>", maths[0][3])
+        self.assertTrue(Component.objects.get(name="c0").is_valid)
+        self.assertFalse(Component.objects.get(name="c1").is_valid)
+
+        validate_cellmodel_in_bulk(CellModel.objects.get(id=self.model.id))
+        self.assertEqual(get_model_errors(self.model), expected)
+
+    def test_query_count(self):
+        # The units are worked out once for the whole model, however many maths there are
+        self.add_components(2)
+        validate_cellmodel_in_bulk(CellModel.objects.get(id=self.model.id))
+        with CaptureQueriesContext(connection) as small:
+            validate_cellmodel_in_bulk(CellModel.objects.get(id=self.model.id))
+        self.add_components(20, start=2)
+        validate_cellmodel_in_bulk(CellModel.objects.get(id=self.model.id))
+        with CaptureQueriesContext(connection) as large:
+            validate_cellmodel_in_bulk(CellModel.objects.get(id=self.model.id))
+        self.assertEqual(len(large), len(small))
+
+    def test_units_read_once(self):
+        # Validating item by item also shares the units of the model between all of its maths
+        self.add_components(4)
+        with mock.patch('main.validate.get_units_of_maths', wraps=get_units_of_maths) as read:
+            validate_cellmodel(CellModel.objects.get(id=self.model.id))
+        read.assert_called_once_with(self.model.id)
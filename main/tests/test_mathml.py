@@ -0,0 +1,41 @@
+import importlib
+
+from django.test import SimpleTestCase
+
+from main.mathml import parse_math_ml
+from main.models import Math
+
+MATH = '<math xmlns="http://www.w3.org/1998/Math/MathML">{}</math>'
+
+EXAMPLES = [
+    "",
+    MATH.format("<apply><eq/><apply><diff/><bvar><ci>t</ci></bvar><ci>V</ci></apply>"
+                "<apply><times/><ci>k</ci><apply><minus/><ci> V_0 </ci><ci>V</ci></apply></apply></apply>"),
+    # Several blocks one after the other, and a function applied by name
+    MATH.format("<apply><eq/><ci>x</ci><cn>1</cn></apply>") + MATH.format("<apply><ci>f</ci><ci>y</ci></apply>"),
+    # Not well-formed, so only the identifiers are found
+    "<math><apply><plus/><ci>a</ci><ci>b</ci><ci></ci>",
+]
+
+
+class ParseMathMLTestCase(SimpleTestCase):
+    def test_parse(self):
+        self.assertEqual(parse_math_ml(None), ([], []))
+        self.assertEqual(parse_math_ml(EXAMPLES[1]), (["t", "V", "k", "V_0"], ["eq", "diff", "times", "minus"]))
+        self.assertEqual(parse_math_ml(EXAMPLES[2]), (["x", "f", "y"], ["eq"]))
+        self.assertEqual(parse_math_ml(EXAMPLES[3]), (["a", "b"], []))
+
+    def test_str(self):
+        # Written from the index, so rendering a Math reads nothing from the database
+        math = Math(name="rate", math_ml=EXAMPLES[1])
+        math.update_index()
+        self.assertEqual(str(math), "rate f(t, V, k, V_0)")
+        math = Math(math_ml=MATH.format("".join(["<ci>x{}</ci>".format(x) for x in range(7)])))
+        math.update_index()
+        self.assertEqual(str(math), "f(x0, x1, x2, x3, x4 ... )")
+
+    def test_migration_copy(self):
+        # The data migration has its own copy of the parser, which should still agree with this one
+        migration = importlib.import_module('main.migrations.0006_math_index')
+        for math_ml in EXAMPLES:
+            self.assertEqual(migration.parse_math_ml(math_ml), parse_math_ml(math_ml))
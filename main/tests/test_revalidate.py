@@ -0,0 +1,102 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from main.models import CellModel, Component, Person, CompoundUnit, Variable, Math
+from main.revalidate import revalidate_cellmodel, revalidate_component
+from main.tests.test_validate_bulk import get_model_errors
+from main.validate import validate_cellmodel
+
+
+class RevalidateTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='daffy', email='daffy@duck.com', password='top_secret')
+        self.person = Person.objects.create(user=self.user, first_name="Daffy", last_name="Duck")
+
+        self.model = CellModel(name="model1", owner=self.person)
+        self.model.save()
+        self.mv = CompoundUnit(name="mV", owner=self.person)
+        self.mv.save()
+        self.mv.models.add(self.model)
+
+        self.components = []
+        for c in range(3):
+            component = Component(name="c{}".format(c), model=self.model, owner=self.person)
+            component.save()
+            v = Variable(name="v", component=component, compoundunit=self.mv, owner=self.person)
+            v.save()
+            Variable(name="w", component=component, compoundunit=self.mv, initial_value_variable=v,
+                     owner=self.person).save()
+            Math(math_ml="<math/>", identifiers=["v", "w"], component=component, owner=self.person).save()
+            self.components.append(component)
+        self.components[2].parent_component = self.components[1]
+        self.components[2].save()
+
+    def get_last_checked(self):
+        return {(type(item).__name__, item.id): item.last_checked
+                for item in list(Component.objects.all()) + list(Variable.objects.all()) + list(Math.objects.all())}
+
+    def test_first_validation(self):
+        self.assertTrue(revalidate_cellmodel(CellModel.objects.get(id=self.model.id)))
+        self.assertFalse(Variable.objects.filter(is_dirty=True).exists())
+        self.assertFalse(Component.objects.filter(is_dirty=True).exists())
+        self.assertFalse(CellModel.objects.get(id=self.model.id).is_dirty)
+        self.assertTrue(all(Variable.objects.values_list('is_valid', flat=True)))
+
+    def test_validation_is_not_a_change(self):
+        revision = CellModel.objects.get(id=self.model.id).revision
+        revalidate_cellmodel(CellModel.objects.get(id=self.model.id))
+        validate_cellmodel(CellModel.objects.get(id=self.model.id))
+        self.assertEqual(CellModel.objects.get(id=self.model.id).revision, revision)
+        self.assertFalse(Variable.objects.filter(is_dirty=True).exists())
+
+    def test_only_changed_items(self):
+        revalidate_cellmodel(CellModel.objects.get(id=self.model.id))
+        before = self.get_last_checked()
+
+        # Renaming v in the innermost component breaks its maths and the initialisation of w
+        v = Variable.objects.get(component=self.components[2], name="v")
+        v.name = "1v"
+        v.save()
+        self.assertFalse(revalidate_cellmodel(CellModel.objects.get(id=self.model.id)))
+
+        after = self.get_last_checked()
+        changed = set([key for key in before if before[key] != after[key]])
+        expected = set([('Component', self.components[1].id), ('Component', self.components[2].id)])
+        expected |= set([('Variable', x.id) for x in Variable.objects.filter(component=self.components[2])])
+        expected |= set([('Math', x.id) for x in Math.objects.filter(component=self.components[2])])
+        self.assertEqual(changed, expected)
+        self.assertFalse(Component.objects.get(id=self.components[1].id).is_valid)
+        self.assertTrue(Component.objects.get(id=self.components[0].id).is_valid)
+
+        # The errors are the same as when everything is validated again
+        errors = get_model_errors(self.model)
+        validate_cellmodel(CellModel.objects.get(id=self.model.id))
+        self.assertEqual([e[2:] for e in errors], [e[2:] for e in get_model_errors(self.model)])
+
+    def test_deleted_variable(self):
+        math = Math.objects.create(math_ml="<math><ci>w</ci></math>", component=self.components[0], owner=self.person)
+        self.assertTrue(revalidate_cellmodel(CellModel.objects.get(id=self.model.id)))
+
+        # The maths still refer to w once it has been deleted
+        Variable.objects.get(component=self.components[0], name="w").delete()
+        self.assertFalse(revalidate_cellmodel(CellModel.objects.get(id=self.model.id)))
+        self.assertFalse(Math.objects.get(id=math.id).is_valid)
+        self.assertFalse(Component.objects.get(id=self.components[0].id).is_valid)
+
+        errors = get_model_errors(self.model)
+        self.assertIn("references a variable 'w' which is not inside the component", " ".join([e[3] for e in errors]))
+        validate_cellmodel(CellModel.objects.get(id=self.model.id))
+        self.assertEqual([e[2:] for e in errors], [e[2:] for e in get_model_errors(self.model)])
+
+    def test_units_users(self):
+        revalidate_cellmodel(CellModel.objects.get(id=self.model.id))
+        self.mv.name = "1mV"
+        self.mv.save()
+        self.assertFalse(revalidate_cellmodel(CellModel.objects.get(id=self.model.id)))
+        self.assertFalse(CompoundUnit.objects.get(id=self.mv.id).is_valid)
+        self.assertFalse(Variable.objects.filter(is_dirty=True).exists())
+
+    def test_component(self):
+        self.assertTrue(revalidate_component(Component.objects.get(id=self.components[1].id)))
+        self.assertFalse(Component.objects.get(id=self.components[2].id).is_dirty)
+        self.assertTrue(Component.objects.get(id=self.components[0].id).is_dirty)
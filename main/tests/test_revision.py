@@ -0,0 +1,73 @@
+import datetime
+
+import pytz
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, RequestFactory
+
+from main.functions import get_cellml_text, get_cellml_cache_key
+from main.models import CellModel, Component, Person, Variable, Math, VALIDATION_FIELDS
+from main.views import set_validity
+
+
+class RevisionTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='daffy', email='daffy@duck.com', password='top_secret')
+        self.person = Person.objects.create(user=self.user, first_name="Daffy", last_name="Duck")
+
+        self.model = CellModel(name="model1", owner=self.person)
+        self.model.save()
+        self.component = Component(name="c1", model=self.model, owner=self.person)
+        self.component.save()
+        self.variable = Variable(name="v", component=self.component, owner=self.person)
+        self.variable.save()
+
+    def get_revision(self):
+        return CellModel.objects.get(id=self.model.id).revision
+
+    def test_changes_bump(self):
+        for change in [lambda: self.variable.save(),
+                       lambda: Variable(name="w", component=self.component, owner=self.person).save(),
+                       lambda: Math(math_ml="<math><ci>v</ci></math>", component=self.component,
+                                    owner=self.person).save(),
+                       lambda: Math.objects.get(component=self.component).variables.add(self.variable),
+                       lambda: self.component.save()]:
+            revision = self.get_revision()
+            change()
+            self.assertEqual(self.get_revision(), revision + 1)
+
+    def test_validation_does_not_bump(self):
+        revision = self.get_revision()
+        for item in [CellModel.objects.get(id=self.model.id), self.component, self.variable]:
+            item.is_valid = True
+            item.last_checked = datetime.datetime.now(pytz.utc)
+            item.error_tree = {'tree_html': ""}
+            item.save(update_fields=VALIDATION_FIELDS)
+        self.assertEqual(self.get_revision(), revision)
+
+    def test_set_validity(self):
+        revision = self.get_revision()
+        Variable.objects.filter(id=self.variable.id).update(is_dirty=False)
+        request = RequestFactory().get('/set_validity/', {'item_type': 'variable', 'item_id': self.variable.id,
+                                                         'todo': 1})
+        request.user = self.user
+        set_validity(request)
+
+        variable = Variable.objects.get(id=self.variable.id)
+        self.assertEqual((variable.is_valid, variable.is_dirty), (False, False))
+        self.assertEqual(self.get_revision(), revision)
+
+    def test_cellml_cached(self):
+        model = CellModel.objects.get(id=self.model.id)
+        cellml_text = get_cellml_text(model)
+        self.assertEqual(cache.get(get_cellml_cache_key(model.id, model.revision)), cellml_text)
+
+        # A validation keeps the text, a change prints it again
+        self.variable.is_valid = False
+        self.variable.save(update_fields=VALIDATION_FIELDS)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_cellml_text(CellModel.objects.get(id=self.model.id)), cellml_text)
+
+        self.variable.name = "renamed"
+        self.variable.save()
+        self.assertIn('name="renamed"', get_cellml_text(CellModel.objects.get(id=self.model.id)))
@@ -0,0 +1,61 @@
+import json
+
+from django.contrib.auth.models import User
+from django.test import TestCase, RequestFactory
+
+from main.functions import build_tree_from_cellml_model, get_tree_nodes
+from main.models import Person, TemporaryStorage, StorageTreeNode
+from main.tests.test_load import parse_model
+from main.views import ajax_storage_tree
+
+
+class StorageTreeTestCase(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user(username='daffy', email='daffy@duck.com', password='top_secret')
+        self.person = Person.objects.create(user=self.user, first_name="Daffy", last_name="Duck")
+
+        self.storage = TemporaryStorage.objects.create(file="loaded.cellml", owner=self.person)
+        build_tree_from_cellml_model(self.storage, parse_model())
+
+    def get_nodes(self, node):
+        request = self.factory.get('/ajax_storage_tree/')
+        request.user = self.user
+        response = ajax_storage_tree(request, self.storage.id, node)
+        return json.loads(response.content.decode('utf-8'))
+
+    def find(self, nodes, text):
+        return [x for x in nodes if x['text'] == text][0]
+
+    def test_tree(self):
+        self.assertEqual(StorageTreeNode.objects.get(storage=self.storage, node=0).text, "Model: loaded")
+        top = get_tree_nodes(self.storage, 0)
+        self.assertEqual(sorted([x['text'] for x in top]), [
+            "Component: clock", "Component: membrane", "Units: mV", "Units: mV_per_ms", "Units: per_ms"])
+        self.assertFalse(self.find(top, "Units: mV")['has_children'])
+
+        membrane = self.find(top, "Component: membrane")
+        self.assertTrue(membrane['has_children'])
+        inside = self.get_nodes(membrane['node'])
+        self.assertEqual(inside['status'], 200)
+        self.assertEqual([x['text'] for x in inside['nodes']], [
+            "Variable: t (ms_base)", "Variable: V (mV)", "Variable: V_0 (mV)", "Variable: k (per_ms)",
+            "Component: gate"])
+        gate = self.find(inside['nodes'], "Component: gate")
+        self.assertEqual([x['text'] for x in self.get_nodes(gate['node'])['nodes']],
+                         ["Variable: t (ms_base)", "Variable: V (mV)"])
+
+        # Building the tree again replaces it
+        build_tree_from_cellml_model(self.storage, parse_model())
+        self.assertEqual(len(get_tree_nodes(self.storage, 0)), 5)
+
+    def test_node_queries(self):
+        # Only the storage and the children of the node are read, however big the tree
+        membrane = self.find(get_tree_nodes(self.storage, 0), "Component: membrane")
+        with self.assertNumQueries(2):
+            self.get_nodes(membrane['node'])
+
+        # A node without children is found, one which does not exist is not
+        variable = self.get_nodes(membrane['node'])['nodes'][0]
+        self.assertEqual(self.get_nodes(variable['node']), {'status': 200, 'nodes': []})
+        self.assertEqual(self.get_nodes(1000)['status'], 404)
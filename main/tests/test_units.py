@@ -0,0 +1,109 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from main.models import CellModel, Component, Person, CompoundUnit, Variable, Unit, Prefix
+from main.tests.test_validate_bulk import get_model_errors
+from main.units import get_dimensions, compare_units, are_same_units
+from main.validate import validate_cellmodel
+from main.validate_bulk import validate_cellmodel_in_bulk
+
+
+class UnitsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='daffy', email='daffy@duck.com', password='top_secret')
+        self.person = Person.objects.create(user=self.user, first_name="Daffy", last_name="Duck")
+
+        self.model = CellModel(name="model1", owner=self.person)
+        self.model.save()
+
+    def add_compoundunit(self, name, factors):
+        cu = CompoundUnit(name=name, owner=self.person)
+        cu.save()
+        cu.models.add(self.model)
+        for reference, prefix, exponent, multiplier in factors:
+            child = CompoundUnit.objects.filter(name=reference).order_by('-is_standard').first()
+            Unit(name=reference, parent_cu=cu, child_cu=child, prefix=Prefix.objects.get(name=prefix),
+                 exponent=exponent, multiplier=multiplier, owner=self.person).save()
+        return CompoundUnit.objects.get(id=cu.id)
+
+    def assertDimensions(self, cu, exponents, scale):
+        vector, found_scale = get_dimensions(cu)
+        self.assertEqual(vector, [float(x) for x in exponents])
+        self.assertAlmostEqual(found_scale / scale, 1.0)
+
+    def test_dimensions(self):
+        # In the order ampere, candela, kelvin, kilogram, metre, mole, second
+        self.assertDimensions(CompoundUnit.objects.get(name="volt", is_standard=True), [-1, 0, 0, 1, 2, 0, -3], 1.0)
+        mv = self.add_compoundunit("mV", [("volt", "milli", 1, 1.0)])
+        self.assertDimensions(mv, [-1, 0, 0, 1, 2, 0, -3], 0.001)
+        per_ms2 = self.add_compoundunit("per_ms2", [("second", "milli", -2, 1.0)])
+        self.assertDimensions(per_ms2, [0, 0, 0, 0, 0, 0, -2], 1e6)
+        odd = self.add_compoundunit("odd", [("mV", "", 2, 3.0), ("per_ms2", "kilo", 1, 1.0)])
+        self.assertDimensions(odd, [-2, 0, 0, 2, 4, 0, -8], 3.0 * 1e-6 * 1e3 * 1e6)
+
+        # The result is stored, and used the next time
+        odd = CompoundUnit.objects.get(id=odd.id)
+        with self.assertNumQueries(0):
+            self.assertDimensions(odd, [-2, 0, 0, 2, 4, 0, -8], 3.0 * 1e-6 * 1e3 * 1e6)
+
+    def test_unknown(self):
+        self.assertIsNone(get_dimensions(self.add_compoundunit("base", [])))
+        self.assertIsNone(get_dimensions(self.add_compoundunit("blank", [("nothing", "", 1, 1.0)])))
+        self.assertIsNone(compare_units(CompoundUnit.objects.get(name="base"),
+                                        CompoundUnit.objects.get(name="volt", is_standard=True)))
+
+    def test_cleared_on_change(self):
+        mv = self.add_compoundunit("mV", [("volt", "milli", 1, 1.0)])
+        uv = self.add_compoundunit("uV2", [("mV", "micro", 2, 1.0)])
+        get_dimensions(uv)
+        self.assertIsNotNone(CompoundUnit.objects.get(id=uv.id).dimensions)
+
+        unit = mv.product_of.first()
+        unit.prefix = Prefix.objects.get(name="")
+        unit.save()
+        uv = CompoundUnit.objects.get(id=uv.id)
+        self.assertIsNone(uv.dimensions)
+        self.assertDimensions(uv, [-2, 0, 0, 2, 4, 0, -6], 1e-12)
+
+    def test_same_units(self):
+        mv = self.add_compoundunit("mV", [("volt", "milli", 1, 1.0)])
+        also_mv = self.add_compoundunit("millivolt", [("ampere", "", -1, 0.001), ("kilogram", "", 1, 1.0),
+                                                       ("metre", "", 2, 1.0), ("second", "", -3, 1.0)])
+        volt = CompoundUnit.objects.get(name="volt", is_standard=True)
+        self.assertTrue(are_same_units(mv, also_mv))
+        self.assertEqual(compare_units(mv, volt), (True, False))
+        self.assertEqual(compare_units(mv, CompoundUnit.objects.get(name="second", is_standard=True)), (False, False))
+
+    def test_validation(self):
+        mv = self.add_compoundunit("mV", [("volt", "milli", 1, 1.0)])
+        also_mv = self.add_compoundunit("millivolt", [("volt", "", 1, 0.001)])
+        volt = CompoundUnit.objects.get(name="volt", is_standard=True)
+        second = CompoundUnit.objects.get(name="second", is_standard=True)
+        components = []
+        for c in range(4):
+            components.append(Component(name="c{}".format(c), model=self.model, owner=self.person))
+            components[-1].save()
+        v = Variable(name="v", component=components[0], compoundunit=mv, owner=self.person)
+        v.save()
+        # Initialised by a variable with the same units under another name, which is fine
+        Variable(name="w", component=components[0], compoundunit=also_mv, initial_value_variable=v,
+                 owner=self.person).save()
+        for component, cu in zip(components[1:], [also_mv, volt, second]):
+            ev = Variable(name="v", component=component, compoundunit=cu, owner=self.person)
+            ev.save()
+            v.equivalent_variables.add(ev)
+
+        self.assertFalse(validate_cellmodel(CellModel.objects.get(id=self.model.id)))
+        expected = get_model_errors(self.model)
+        hints = [e[3] for e in expected if e[0] == 'Component' and e[1] == components[0].id]
+        # Units which only differ in scale, like mV and volt, are allowed
+        self.assertEqual(len(hints), 1)
+        self.assertIn("which are not equivalent to the units <i>second</i>", hints[0])
+        self.assertFalse(any([e[0] == 'Variable' for e in expected]))
+
+        validate_cellmodel_in_bulk(CellModel.objects.get(id=self.model.id))
+        self.assertEqual(get_model_errors(self.model), expected)
+
+        v.equivalent_variables.remove(Variable.objects.get(compoundunit=second))
+        self.assertTrue(validate_cellmodel(CellModel.objects.get(id=self.model.id)))
+        self.assertTrue(validate_cellmodel_in_bulk(CellModel.objects.get(id=self.model.id)))
@@ -0,0 +1,153 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+
+from main.functions import load_model
+from main.models import CellModel, Person, Variable, Math, CompoundUnit, Component, Unit
+from main.tests.test_load import CELLML, parse_model, get_model_rows
+from main.update import update_model_from_file
+
+# The model of test_load with the gate component removed, a new leak component, a variable renamed, another added,
+# one unit changed and another removed
+REVISED = '''<?xml version="1.0" encoding="UTF-8"?>
+<model xmlns="http://www.cellml.org/cellml/2.0#" name="{name}">
+  <units name="mV"><unit units="volt" prefix="milli"/></units>
+  <units name="per_ms"><unit units="second" prefix="milli" exponent="-2"/></units>
+  <component name="membrane">
+    <variable name="t" units="ms_base" interface="public_and_private"/>
+    <variable name="V" units="mV" initial_value="-84.5" interface="public_and_private"/>
+    <variable name="V_0" units="mV" initial_value="V"/>
+    <variable name="k_1" units="per_ms" initial_value="0.5"/>
+    <variable name="Cm" units="dimensionless" initial_value="1"/>
+    <math xmlns="http://www.w3.org/1998/Math/MathML">
+      <apply><eq/><apply><diff/><bvar><ci>t</ci></bvar><ci>V</ci></apply>
+        <apply><times/><ci>k_1</ci><apply><minus/><ci>V_0</ci><ci>V</ci></apply></apply></apply>
+    </math>
+  </component>
+  <component name="clock">
+    <variable name="t" units="ms_base" interface="public"/>
+  </component>
+  <component name="leak">
+    <variable name="g" units="per_ms" initial_value="2"/>
+  </component>
+  <connection component_1="membrane" component_2="clock"><map_variables variable_1="t" variable_2="t"/></connection>
+</model>'''
+
+# Two variables with the same name, which is not valid CellML but can still be loaded
+REPEATED = '''<?xml version="1.0" encoding="UTF-8"?>
+<model xmlns="http://www.cellml.org/cellml/2.0#" name="{name}">
+  <component name="c">{variables}</component>
+</model>'''
+
+
+def get_diff(diff):
+    return sorted([(x['action'], x['item_type'], x['path'], tuple(x['fields'])) for x in diff])
+
+
+class UpdateModelTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='daffy', email='daffy@duck.com', password='top_secret')
+        self.person = Person.objects.create(user=self.user, first_name="Daffy", last_name="Duck")
+        self.other = Person.objects.create(user=User.objects.create_user(username='donald'), first_name="Donald",
+                                           last_name="Duck")
+
+        self.model = load_model(parse_model(), self.person, batched=True)
+
+    def update(self, text, name="loaded"):
+        diff = update_model_from_file(CellModel.objects.get(id=self.model.id), parse_model(name, text), self.person)
+        # Nothing may be left pointing at a deleted row
+        connection.check_constraints()
+        return get_diff(diff)
+
+    def test_unchanged(self):
+        variable = Variable.objects.get(component__model=self.model, name="V_0")
+        variable.notes = "kept"
+        variable.save()
+        ids = sorted(Variable.objects.filter(component__model=self.model).values_list('id', flat=True))
+        rows = get_model_rows(CellModel.objects.get(id=self.model.id))
+
+        self.assertEqual(self.update(CELLML), [])
+        self.assertEqual(sorted(Variable.objects.filter(component__model=self.model).values_list('id', flat=True)), ids)
+        self.assertEqual(get_model_rows(CellModel.objects.get(id=self.model.id)), rows)
+        self.assertEqual(Variable.objects.get(id=variable.id).notes, "kept")
+
+    def test_changes(self):
+        kept = Variable.objects.get(component__model=self.model, component__name="membrane", name="V")
+        self.assertEqual(self.update(REVISED), [
+            ('added', 'component', 'leak', ()),
+            ('added', 'variable', 'leak/g', ()),
+            ('added', 'variable', 'membrane/Cm', ()),
+            ('added', 'variable', 'membrane/k_1', ()),
+            ('changed', 'component', 'membrane', ('contents',)),
+            ('changed', 'compoundunit', 'per_ms', ('units',)),
+            ('changed', 'math', 'membrane', ('math_ml',)),
+            ('removed', 'component', 'membrane/gate', ()),
+            ('removed', 'compoundunit', 'mV_per_ms', ()),
+            ('removed', 'variable', 'membrane/k', ()),
+        ])
+        self.assertTrue(Variable.objects.filter(id=kept.id).exists())
+
+        # The same rows as loading the revised file from scratch
+        fresh = load_model(parse_model("loaded", REVISED), self.other, batched=True)
+        self.assertEqual(get_model_rows(CellModel.objects.get(id=self.model.id)),
+                         get_model_rows(CellModel.objects.get(id=fresh.id)))
+
+        # And back again
+        self.update(CELLML)
+        fresh = load_model(parse_model(), self.other, batched=True)
+        self.assertEqual(get_model_rows(CellModel.objects.get(id=self.model.id)),
+                         get_model_rows(CellModel.objects.get(id=fresh.id)))
+
+    def test_remove_imported(self):
+        # Items elsewhere which were imported from the removed component's maths no longer point at them
+        gate_math = Math.objects.create(math_ml="<math><ci>V</ci></math>", owner=self.person,
+                                        component=self.model.all_components.get(name="gate"))
+        copy = Math.objects.create(math_ml=gate_math.math_ml, owner=self.person, imported_from=gate_math,
+                                   depends_on=gate_math)
+        self.update(REVISED)
+        copy = Math.objects.get(id=copy.id)
+        self.assertEqual((copy.imported_from, copy.depends_on), (None, None))
+        self.assertFalse(Math.objects.filter(id=gate_math.id).exists())
+
+    def test_marks_dirty(self):
+        # Items changed by queryset updates, which send no signals, are still revalidated
+        gate_math = Math.objects.create(math_ml="<math><ci>V</ci></math>", owner=self.person,
+                                        component=self.model.all_components.get(name="gate"))
+        copy = Math.objects.create(math_ml=gate_math.math_ml, owner=self.person, imported_from=gate_math)
+        for item_class in [CellModel, Component, Variable, Math, CompoundUnit, Unit]:
+            item_class.objects.update(is_dirty=False)
+
+        self.update(REVISED)
+        self.assertTrue(Math.objects.get(id=copy.id).is_dirty)
+        self.assertTrue(Component.objects.get(model=self.model, name="membrane").is_dirty)
+        # Connected to the removed gate component, unlike the clock's variable
+        self.assertTrue(Variable.objects.get(component__name="membrane", name="t").is_dirty)
+        self.assertFalse(Variable.objects.get(component__name="clock", name="t").is_dirty)
+
+    def test_repeated_names(self):
+        def text(*values):
+            return REPEATED.replace("{variables}", "".join(
+                ['<variable name="x" units="dimensionless" initial_value="{}"/>'.format(v) for v in values]))
+
+        self.model = load_model(parse_model("repeated", text(1, 2, 3)), self.person, batched=True)
+        first, second, third = Variable.objects.filter(component__model=self.model).order_by('id')
+
+        # Each of the repeated variables is matched to one stored, in order
+        self.assertEqual(self.update(text(1, 5, 3), "repeated"), [
+            ('changed', 'component', 'c', ('contents',)), ('changed', 'variable', 'c/x', ('initial_value_constant',))])
+        self.assertEqual(Variable.objects.get(id=second.id).initial_value_constant, 5)
+
+        # And those left over are removed
+        self.assertEqual(self.update(text(1), "repeated"), [('changed', 'component', 'c', ('contents',))] +
+                         [('removed', 'variable', 'c/x', ())] * 2)
+        self.assertEqual(list(Variable.objects.filter(component__model=self.model).values_list('id', flat=True)),
+                         [first.id])
+
+    def test_shared_units_index(self):
+        # Units linked to another model keep the index they have there
+        mv = CompoundUnit.objects.get(name="mV", models=self.model)
+        other = CellModel.objects.create(name="other", owner=self.person)
+        mv.models.add(other)
+        CompoundUnit.objects.filter(id=mv.id).update(cellml_index=7)
+        self.update(CELLML)
+        self.assertEqual(CompoundUnit.objects.get(id=mv.id).cellml_index, 7)
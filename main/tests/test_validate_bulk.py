@@ -0,0 +1,196 @@
+import json
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from main.models import CellModel, Component, Person, CompoundUnit, Variable, Reset, Math, ItemError
+from main.validate import validate_cellmodel
+from main.validate_bulk import validate_cellmodel_in_bulk, select_rules, VALIDATION_RULES, RULE_SETS
+from main.views import ajax_validate
+
+
+def get_model_errors(model):
+    items = [model] + list(model.all_components.all()) + list(Variable.objects.filter(component__model=model)) + \
+        list(Reset.objects.filter(component__model=model)) + list(Math.objects.filter(component__model=model)) + \
+        list(model.compoundunits.all())
+    return sorted([(type(item).__name__, item.id, e.spec, e.hints, tuple(e.fields or ()))
+                   for item in items for e in item.errors.all()])
+
+
+class ValidateBulkTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='daffy', email='daffy@duck.com', password='top_secret')
+        self.person = Person.objects.create(user=self.user, first_name="Daffy", last_name="Duck")
+
+        self.model = CellModel(name="model1", owner=self.person)
+        self.model.save()
+
+        self.mv = CompoundUnit(name="mV", owner=self.person)
+        self.mv.save()
+        self.mv.models.add(self.model)
+
+    def add_component(self, name, components=1, variables=2):
+        for c in range(components):
+            component = Component(name="{n}{c}".format(n=name, c=c), model=self.model, owner=self.person)
+            component.save()
+            v = Variable(name="v", component=component, compoundunit=self.mv, owner=self.person)
+            v.save()
+            for x in range(variables):
+                Variable(name="x{}".format(x), component=component, initial_value_variable=v,
+                         initial_value_constant=1.0, owner=self.person).save()
+            Variable(name="v", component=component, owner=self.person).save()
+            Reset(variable=v, order=1, component=component, owner=self.person).save()
+            Reset(variable=v, order=1, test_variable=v, component=component, owner=self.person).save()
+            Math(math_ml="<math/>", identifiers=["v", "missing"], component=component, owner=self.person).save()
+
+    def test_same_errors(self):
+        self.add_component("1_bad", components=2)
+        validate_cellmodel(CellModel.objects.get(id=self.model.id))
+        expected = get_model_errors(self.model)
+
+        revision = CellModel.objects.get(id=self.model.id).revision
+        self.assertFalse(validate_cellmodel_in_bulk(CellModel.objects.get(id=self.model.id)))
+
+        self.assertEqual(get_model_errors(self.model), expected)
+        # Errors with the same text are only stored once
+        self.assertEqual(ItemError.objects.count(), len(set([e[2:] for e in expected])))
+        model = CellModel.objects.get(id=self.model.id)
+        self.assertEqual(model.revision, revision)
+        self.assertFalse(model.is_valid)
+        self.assertEqual(model.error_tree['error_count'], len(expected))
+        self.assertFalse(any(model.all_components.values_list('is_valid', flat=True)))
+
+    def test_valid_model(self):
+        component = Component(name="c", model=self.model, owner=self.person)
+        component.save()
+        Variable(name="v", component=component, compoundunit=CompoundUnit.objects.get(name="volt", is_standard=True),
+                 owner=self.person).save()
+        self.assertTrue(validate_cellmodel_in_bulk(self.model))
+        self.assertEqual(ItemError.objects.count(), 0)
+        self.assertTrue(Component.objects.get(id=component.id).is_valid)
+
+    def test_query_count(self):
+        # The number of queries does not depend on the size of the model
+        self.add_component("small", components=1, variables=1)
+        validate_cellmodel_in_bulk(self.model)
+        with CaptureQueriesContext(connection) as small:
+            validate_cellmodel_in_bulk(self.model)
+        self.add_component("large", components=10, variables=5)
+        with CaptureQueriesContext(connection) as large:
+            validate_cellmodel_in_bulk(self.model)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+    def test_shared_errors(self):
+        # Each of the components has a variable "v" without units, which gives the same error text
+        self.add_component("c", components=3)
+        validate_cellmodel(CellModel.objects.get(id=self.model.id))
+        count = ItemError.objects.count()
+        error = ItemError.objects.get(hints="Variable <i>v</i> does not have any units.")
+        self.assertEqual(error.error_in_variable_objects.count(), 3)
+
+        # Validating again does not add to the stored errors, and those no longer used are removed
+        validate_cellmodel(CellModel.objects.get(id=self.model.id))
+        validate_cellmodel_in_bulk(CellModel.objects.get(id=self.model.id))
+        self.assertEqual(ItemError.objects.count(), count)
+        Variable.objects.filter(compoundunit__isnull=True).update(compoundunit=self.mv)
+        validate_cellmodel(CellModel.objects.get(id=self.model.id))
+        self.assertFalse(ItemError.objects.filter(hints="Variable <i>v</i> does not have any units.").exists())
+
+    def test_delete_unused_scoped(self):
+        # Only the errors this model no longer uses are deleted, not those unused by anything else
+        self.add_component("c", components=1)
+        other = ItemError.objects.create(hints="Not used", spec="1", digest="unused")
+        validate_cellmodel(CellModel.objects.get(id=self.model.id))
+        Variable.objects.filter(compoundunit__isnull=True).update(compoundunit=self.mv)
+        for validate in [validate_cellmodel, validate_cellmodel_in_bulk]:
+            validate(CellModel.objects.get(id=self.model.id))
+            self.assertFalse(ItemError.objects.filter(hints="Variable <i>v</i> does not have any units.").exists())
+            self.assertTrue(ItemError.objects.filter(id=other.id).exists())
+
+    def test_replace_atomic(self):
+        # If the new errors can't be written, the model keeps its old ones
+        self.add_component("c", components=1)
+        validate_cellmodel_in_bulk(CellModel.objects.get(id=self.model.id))
+        expected = get_model_errors(self.model)
+        with mock.patch('main.validate_bulk.store_errors', side_effect=RuntimeError("failed")):
+            with self.assertRaises(RuntimeError):
+                validate_cellmodel_in_bulk(CellModel.objects.get(id=self.model.id))
+        self.assertEqual(get_model_errors(self.model), expected)
+
+    def test_ajax_rules(self):
+        self.add_component("c", components=1)
+        variable = Variable.objects.filter(component__model=self.model).first()
+
+        def get(item_type, item_id, rules):
+            request = RequestFactory().get('/ajax_validate/', {'item_type': item_type, 'item_id': item_id,
+                                                                'rules': rules})
+            request.user = self.user
+            response = ajax_validate(request)
+            return response.status_code, json.loads(response.content.decode('utf-8'))
+
+        status, data = get('cellmodel', self.model.id, 'lint')
+        self.assertEqual(status, 200)
+        self.assertTrue(data['rules'])
+
+        # The rules only run on whole models, and anything else is refused rather than redirected to the error page
+        for item_type, item_id, rules in [('variable', variable.id, 'lint'), ('cellmodel', self.model.id, 'none')]:
+            status, data = get(item_type, item_id, rules)
+            self.assertEqual((status, data['status']), (400, 400))
+            self.assertIn("Could not run the validation rules '{}'".format(rules), data['message'])
+
+    def test_cyclic_variables(self):
+        variables = []
+        for c in range(4):
+            component = Component(name="c{}".format(c), model=self.model, owner=self.person)
+            component.save()
+            variables.append(Variable(name="v", component=component, compoundunit=self.mv, owner=self.person))
+            variables[-1].save()
+        for c in range(3):
+            variables[c].equivalent_variables.add(variables[(c + 1) % 3])
+        variables[3].equivalent_variables.add(variables[0])
+
+        self.assertFalse(validate_cellmodel(CellModel.objects.get(id=self.model.id)))
+        expected = get_model_errors(self.model)
+        self.assertEqual([e[3] for e in expected], [
+            "Cyclic variables exist, 1 loop found (Component,Variable): <br>"
+            "(<i>c0, v</i>) -> (<i>c1, v</i>) -> (<i>c2, v</i>) -> (<i>c0, v</i>)<br>"])
+
+        self.assertFalse(validate_cellmodel_in_bulk(CellModel.objects.get(id=self.model.id)))
+        self.assertEqual(get_model_errors(self.model), expected)
+
+    def test_select_rules(self):
+        self.assertEqual(select_rules(), VALIDATION_RULES)
+        self.assertEqual([rule.name for rule in select_rules('full')], RULE_SETS['full'])
+        # Rules which report the same specification references are run together
+        self.assertEqual([rule.name for rule in select_rules(['missing_units'])],
+                         ['missing_units', 'variables_without_units'])
+        with self.assertRaises(KeyError):
+            select_rules(['no_such_rule'])
+
+    def test_rule_sets(self):
+        self.add_component("c", components=2)
+        self.assertFalse(validate_cellmodel_in_bulk(CellModel.objects.get(id=self.model.id)))
+        expected = get_model_errors(self.model)
+        reset_orders = [e for e in expected if e[2] == '??']
+        self.assertTrue(reset_orders)
+
+        # The checks of reset orders are not linted, so their errors are kept
+        timings = []
+        self.assertFalse(validate_cellmodel_in_bulk(CellModel.objects.get(id=self.model.id), rule_set='lint',
+                                                    timings=timings))
+        self.assertEqual(get_model_errors(self.model), expected)
+        self.assertEqual([timing.name for timing in timings], RULE_SETS['lint'])
+        self.assertTrue(all([timing.seconds >= 0 for timing in timings]))
+        self.assertEqual(dict([(timing.name, timing.queries) for timing in timings])['model_name'], 0)
+        self.assertEqual(sum([timing.error_count for timing in timings]), len(expected) - len(reset_orders))
+
+        # Only the rules which are run can remove their errors
+        for reset in Reset.objects.filter(test_variable__isnull=False):
+            Reset.objects.filter(id=reset.id).update(order=2)
+        validate_cellmodel_in_bulk(CellModel.objects.get(id=self.model.id), rule_set='lint')
+        self.assertEqual(get_model_errors(self.model), expected)
+        validate_cellmodel_in_bulk(CellModel.objects.get(id=self.model.id), rule_set=['variable_reset_orders'])
+        self.assertEqual(get_model_errors(self.model), [e for e in expected if e[2] != '??'])
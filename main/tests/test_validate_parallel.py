@@ -0,0 +1,59 @@
+import importlib
+from io import StringIO
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TransactionTestCase
+
+from main.models import CellModel, Component, Person, CompoundUnit, Variable, Math, Prefix
+from main.tests.test_validate_bulk import get_model_errors
+from main.validate import validate_cellmodel
+from main.validate_parallel import validate_cellmodel_in_parallel
+
+
+class ValidateParallelTestCase(TransactionTestCase):
+    # The workers can only see what has been committed, so each test commits its data and the tables are emptied
+    # afterwards, including the built-in units and prefixes which are then added again
+    def setUp(self):
+        if not Prefix.objects.exists():
+            setup_data = importlib.import_module('main.migrations.0002_setup_data')
+            setup_data.add_administrator_accounts(apps, None)
+            setup_data.add_error_codes(apps, None)
+            setup_data.add_standards(apps, None)
+
+        self.user = User.objects.create_user(username='daffy', email='daffy@duck.com', password='top_secret')
+        self.person = Person.objects.create(user=self.user, first_name="Daffy", last_name="Duck")
+
+        self.model = CellModel(name="model1", owner=self.person)
+        self.model.save()
+        mv = CompoundUnit(name="mV", owner=self.person)
+        mv.save()
+        mv.models.add(self.model)
+
+        for c in range(6):
+            component = Component(name="c{}".format(c), model=self.model, owner=self.person)
+            component.save()
+            child = Component(name="c{}_child".format(c), model=self.model, parent_component=component,
+                              owner=self.person)
+            child.save()
+            for item in [component, child]:
+                Variable(name="v", component=item, compoundunit=mv, owner=self.person).save()
+                Variable(name="1w" if c % 2 else "w", component=item, owner=self.person).save()
+                Math(math_ml="<math/>", identifiers=["v", "x"], component=item, owner=self.person).save()
+
+    def test_same_errors(self):
+        self.assertFalse(validate_cellmodel(CellModel.objects.get(id=self.model.id)))
+        expected = get_model_errors(self.model)
+        self.assertFalse(validate_cellmodel_in_parallel(CellModel.objects.get(id=self.model.id), processes=3))
+        self.assertEqual(get_model_errors(self.model), expected)
+
+        validity = dict(Component.objects.values_list('name', 'is_valid'))
+        self.assertEqual(validity['c0'], False)
+        self.assertEqual(validity['c1_child'], False)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('validate_models', str(self.model.id), processes=2, stdout=out)
+        self.assertEqual(out.getvalue(), "model1 ({}): invalid\n".format(self.model.id))
+        self.assertFalse(CellModel.objects.get(id=self.model.id).is_valid)
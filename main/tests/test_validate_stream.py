@@ -0,0 +1,67 @@
+import json
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from main.models import CellModel, Component, Person, CompoundUnit, Variable, Math
+from main.validate_stream import stream_validation_events
+
+
+def parse_events(stream):
+    events = []
+    for text in stream:
+        lines = text.strip().split("\n")
+        event = lines[0][len("event: "):] if lines[0].startswith("event: ") else "message"
+        events.append((event, json.loads(lines[-1][len("data: "):])))
+    return events
+
+
+class ValidateStreamTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='daffy', email='daffy@duck.com', password='top_secret')
+        self.person = Person.objects.create(user=self.user, first_name="Daffy", last_name="Duck")
+
+        self.model = CellModel(name="model1", owner=self.person)
+        self.model.save()
+        mv = CompoundUnit(name="mV", owner=self.person)
+        mv.save()
+        mv.models.add(self.model)
+
+        for c in range(3):
+            component = Component(name="c{}".format(c), model=self.model, parent_model=self.model, owner=self.person)
+            component.save()
+            child = Component(name="c{}_child".format(c), model=self.model, parent_component=component,
+                              owner=self.person)
+            child.save()
+            for item in [component, child]:
+                Variable(name="v", component=item, compoundunit=mv, owner=self.person).save()
+                Variable(name="1w" if c == 1 else "w", component=item, compoundunit=mv, owner=self.person).save()
+                Math(math_ml="<math><ci>v</ci></math>", component=item, owner=self.person).save()
+
+    def test_events(self):
+        events = parse_events(stream_validation_events(CellModel.objects.get(id=self.model.id), chunk_size=4))
+        messages = [data for event, data in events if event == 'message']
+        # The model, its units, 6 components, 12 variables and 6 maths, each once and the model first
+        self.assertEqual(len(messages), 26)
+        self.assertEqual(len(set([(x['item_type'], x['item_id']) for x in messages])), 26)
+        self.assertEqual((messages[0]['item_type'], messages[0]['item_id']), ('cellmodel', self.model.id))
+        self.assertEqual(events[-1], ('done', {'checked': 26, 'invalid': 2}))
+
+        # The results are saved, as by ajax_validate
+        invalid = set([(x['item_type'], x['item_id']) for x in messages if not x['is_valid']])
+        self.assertEqual(invalid, set([('variable', x) for x in Variable.objects.filter(
+            name="1w").values_list('id', flat=True)]))
+        self.assertFalse(Variable.objects.filter(name="1w", is_valid=True).exists())
+        self.assertEqual(CellModel.objects.get(id=self.model.id).child_list['list_length'], 26)
+
+    def test_component(self):
+        component = Component.objects.get(name="c1")
+        events = parse_events(stream_validation_events(component))
+        self.assertEqual(events[-1], ('done', {'checked': 8, 'invalid': 2}))
+
+    def test_view(self):
+        response = self.client.get('/ajax_validate_tree/', {'item_type': 'component',
+                                                             'item_id': Component.objects.get(name="c0").id})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = parse_events([x.decode('utf-8') for x in response.streaming_content])
+        self.assertEqual(events[-1], ('done', {'checked': 8, 'invalid': 0}))
@@ -0,0 +1,235 @@
+import os
+import shutil
+import tempfile
+import xml.etree.ElementTree as ElementTree
+
+import libcellml
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from main.functions import convert_to_cellml_model, load_model
+from main.imports import ImportCache
+from main.models import CellModel, Component, Person, CompoundUnit, Variable, Reset, Unit, Math, Prefix
+from main.tests.test_load import CELLML, parse_model
+from main.writer import stream_cellml_model, CELLML_NAMESPACE
+
+MATH_1 = '<math xmlns="http://www.w3.org/1998/Math/MathML"><apply><eq/><apply><diff/><bvar><ci>t</ci></bvar>' \
+         '<ci>v</ci></apply><apply><times/><ci>k</ci><ci>v</ci></apply></apply></math>'
+MATH_2 = '<math xmlns="http://www.w3.org/1998/Math/MathML">\n  <apply><eq/><ci>w</ci><cn>2</cn></apply>\n</math>'
+
+# A model with imported units and components, resets and nested encapsulation, which imports from CELLML
+IMPORTING = '''<?xml version="1.0" encoding="UTF-8"?>
+<model xmlns="http://www.cellml.org/cellml/2.0#" xmlns:xlink="http://www.w3.org/1999/xlink" name="{name}">
+  <import xlink:href="common.cellml">
+    <units units_ref="mV" name="millivolt"/>
+    <component component_ref="gate" name="imported_gate"/>
+  </import>
+  <units name="ms"><unit units="second" prefix="milli"/></units>
+  <component name="cell">
+    <variable name="t" units="ms" interface="public_and_private"/>
+    <variable name="x" units="millivolt" initial_value="0" interface="public_and_private"/>
+    <variable name="y" units="dimensionless" initial_value="1"/>
+    <math xmlns="http://www.w3.org/1998/Math/MathML">
+      <apply><eq/><apply><diff/><bvar><ci>t</ci></bvar><ci>y</ci></apply><cn units="dimensionless">1</cn></apply>
+    </math>
+    <reset variable="y" test_variable="y" order="1">
+      <test_value><math xmlns="http://www.w3.org/1998/Math/MathML"><cn units="dimensionless">2</cn></math></test_value>
+      <reset_value><math xmlns="http://www.w3.org/1998/Math/MathML"><cn units="dimensionless">0</cn></math></reset_value>
+    </reset>
+  </component>
+  <component name="inner">
+    <variable name="t" units="ms" interface="public"/>
+    <variable name="x" units="millivolt" interface="public"/>
+  </component>
+  <component name="innermost">
+    <variable name="x" units="millivolt" interface="public"/>
+  </component>
+  <encapsulation>
+    <component_ref component="cell">
+      <component_ref component="inner"><component_ref component="innermost"/></component_ref>
+    </component_ref>
+  </encapsulation>
+  <connection component_1="cell" component_2="inner">
+    <map_variables variable_1="t" variable_2="t"/>
+    <map_variables variable_1="x" variable_2="x"/>
+  </connection>
+  <connection component_1="inner" component_2="innermost"><map_variables variable_1="x" variable_2="x"/></connection>
+</model>'''
+
+
+def canonical(cellml_text):
+    # The writer and the printer may lay out whitespace differently, and order attributes differently
+    def walk(element):
+        text = (element.text or "").strip()
+        children = [walk(child) for child in element]
+        if element.tag.endswith('}connection'):
+            return connection(element)
+        if element.tag.endswith('}model'):
+            # libCellML chooses its own order for the connections
+            children.sort(key=lambda child: (child[0].endswith('}connection'), child if
+                                             child[0].endswith('}connection') else ()))
+        return element.tag, sorted(element.attrib.items()), text, children
+
+    def connection(element):
+        # Either component can be given first, as long as the variables follow
+        names = [(m.get('variable_1'), m.get('variable_2')) for m in element]
+        components = (element.get('component_1'), element.get('component_2'))
+        if components[0] > components[1]:
+            components = components[::-1]
+            names = [name[::-1] for name in names]
+        return element.tag, components, sorted(names), []
+
+    return walk(ElementTree.fromstring(cellml_text.encode('utf-8')))
+
+
+class WriterParityTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='daffy', email='daffy@duck.com', password='top_secret')
+        self.person = Person.objects.create(user=self.user, first_name="Daffy", last_name="Duck")
+
+        self.model = CellModel(name="model1", cellml_id="model1_id", owner=self.person)
+        self.model.save()
+
+    def assertParity(self, model, chunk_size=100):
+        model = CellModel.objects.get(id=model.id)
+        printed = libcellml.Printer().printModel(convert_to_cellml_model(model))
+        written = "".join(stream_cellml_model(model, chunk_size=chunk_size))
+        self.assertEqual(canonical(written), canonical(printed))
+
+    def add_compoundunit(self, name, factors):
+        cu = CompoundUnit(name=name, owner=self.person)
+        cu.save()
+        cu.models.add(self.model)
+        for reference, prefix, exponent, multiplier in factors:
+            child = CompoundUnit.objects.filter(name=reference, models=self.model).first()
+            Unit(name=reference, parent_cu=cu, child_cu=child, prefix=Prefix.objects.get(name=prefix),
+                 exponent=exponent, multiplier=multiplier, owner=self.person).save()
+        return cu
+
+    def add_component(self, name, cellml_id=""):
+        component = Component(name=name, cellml_id=cellml_id, model=self.model, owner=self.person)
+        component.save()
+        return component
+
+    def add_variable(self, component, name, compoundunit=None, **kwargs):
+        variable = Variable(name=name, component=component, compoundunit=compoundunit, owner=self.person, **kwargs)
+        variable.save()
+        return variable
+
+    def test_empty_model(self):
+        self.assertParity(self.model)
+
+    def test_empty_items(self):
+        self.add_component("c1")
+        self.add_compoundunit("dimensionless_too", [])
+        self.assertParity(self.model)
+
+    def test_units(self):
+        self.add_compoundunit("mV", [("volt", "milli", 1, 1.0)])
+        self.add_compoundunit("per_ms2", [("second", "milli", -2, 1.0)])
+        self.add_compoundunit("odd", [("mV", "", 3, 0.001), ("metre", "kilo", 1, 2.5)])
+        self.assertParity(self.model)
+
+    def test_variables(self):
+        mv = self.add_compoundunit("mV", [("volt", "milli", 1, 1.0)])
+        c1 = self.add_component("c1", cellml_id="c1_id")
+        v = self.add_variable(c1, "v", mv, initial_value_constant=-84.5, cellml_id="v_id")
+        self.add_variable(c1, "w", mv, initial_value_variable=v)
+        self.add_variable(c1, "k", initial_value_constant=0.1)
+        self.add_variable(c1, "no_units")
+        self.assertParity(self.model)
+
+    def test_maths(self):
+        c1 = self.add_component("c1")
+        for name in ["t", "v", "k", "w"]:
+            self.add_variable(c1, name)
+        Math(math_ml=MATH_1, component=c1, owner=self.person).save()
+        Math(math_ml=MATH_2, component=c1, owner=self.person).save()
+        self.assertParity(self.model)
+
+    def test_resets(self):
+        c1 = self.add_component("c1")
+        v = self.add_variable(c1, "v", initial_value_constant=0)
+        w = self.add_variable(c1, "w", initial_value_constant=1)
+        test_value = Math(math_ml='<math xmlns="http://www.w3.org/1998/Math/MathML"><cn>1</cn></math>')
+        test_value.save()
+        reset_value = Math(math_ml='<math xmlns="http://www.w3.org/1998/Math/MathML"><cn>0</cn></math>')
+        reset_value.save()
+        Reset(variable=v, test_variable=w, order=2, test_value=test_value, reset_value=reset_value,
+              component=c1, owner=self.person).save()
+        Reset(variable=w, test_variable=v, order=1, component=c1, owner=self.person).save()
+        self.assertParity(self.model)
+
+    def test_chunks(self):
+        mv = self.add_compoundunit("mV", [("volt", "milli", 1, 1.0)])
+        for c in range(7):
+            component = self.add_component("c{}".format(c))
+            for v in range(c):
+                self.add_variable(component, "v{}".format(v), mv, initial_value_constant=v / 3)
+        self.assertParity(self.model, chunk_size=3)
+
+    def test_connections(self):
+        c1 = self.add_component("c1")
+        c2 = self.add_component("c2")
+        c3 = self.add_component("c3")
+        x1 = self.add_variable(c1, "x")
+        y1 = self.add_variable(c1, "y")
+        x2 = self.add_variable(c2, "x")
+        y2 = self.add_variable(c2, "y2")
+        x3 = self.add_variable(c3, "x3")
+        x1.equivalent_variables.add(x2)
+        y2.equivalent_variables.add(y1)
+        x3.equivalent_variables.add(x2)
+        self.assertParity(self.model, chunk_size=2)
+
+    def test_connections_redundant(self):
+        # Any one of the three links is implied by the other two, so only two are exported
+        components = [self.add_component("c{}".format(c)) for c in range(3)]
+        variables = [self.add_variable(component, "v") for component in components]
+        variables[0].equivalent_variables.add(variables[1])
+        variables[1].equivalent_variables.add(variables[2])
+        variables[2].equivalent_variables.add(variables[0])
+        self.assertParity(self.model)
+
+        written = "".join(stream_cellml_model(self.model))
+        self.assertEqual(len(ElementTree.fromstring(written.encode('utf-8')).findall(
+            '{%s}connection' % CELLML_NAMESPACE)), 2)
+
+    def test_encapsulation(self):
+        a = self.add_component("a")
+        b = self.add_component("b")
+        self.add_component("d")
+        c = self.add_component("c")
+        e = self.add_component("e")
+        b.parent_component = a
+        b.save()
+        c.parent_component = b
+        c.save()
+        e.parent_component = a
+        e.save()
+        x_a = self.add_variable(a, "x")
+        x_b = self.add_variable(b, "x")
+        x_c = self.add_variable(c, "x")
+        x_b.equivalent_variables.add(x_a, x_c)
+        self.assertParity(self.model, chunk_size=2)
+
+    def test_loaded_models(self):
+        # Models loaded from files, rather than built row by row, in both loading modes
+        directory = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(directory, "common.cellml"), 'w') as f:
+                f.write(CELLML.format(name="common"))
+            for batched in [False, True]:
+                self.assertParity(load_model(parse_model("loaded", CELLML), self.person, batched=batched))
+                self.assertParity(load_model(parse_model("importing", IMPORTING), self.person, batched=batched,
+                                             import_cache=ImportCache(directory, self.person)))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_escaping(self):
+        # libCellML will not print an id like this one, so only the writer's own output is checked
+        c1 = self.add_component("c1")
+        self.add_variable(c1, "v", cellml_id='quote"and&amp<less>')
+        written = "".join(stream_cellml_model(self.model))
+        variable = ElementTree.fromstring(written.encode('utf-8')).find('.//{%s}variable' % CELLML_NAMESPACE)
+        self.assertEqual(variable.get('id'), 'quote"and&amp<less>')
@@ -0,0 +1,159 @@
+"""
+    This file contains the dimensional analysis of units.  Any units can be written as a scale factor times a product
+    of the seven SI base units, each raised to a power, eg: millivolt is 0.001 kg.m^2.s^-3.A^-1.  The powers are kept
+    as a vector in the order of BASE_UNITS, so two units measure the same kind of quantity when their vectors are
+    equal, and are the same units when their scales are also equal.
+
+    The vector and scale of each compound unit are stored on it when first worked out, and cleared by the signals in
+    main.models when it, or any of the units it is made from, changes.
+"""
+import math
+
+from main.models import CompoundUnit, Unit
+
+BASE_UNITS = ['ampere', 'candela', 'kelvin', 'kilogram', 'metre', 'mole', 'second']
+
+# The built-in units of CellML 2.0, as {name: ({base unit: exponent}, scale)}
+BUILT_IN_UNITS = {
+    'ampere': ({'ampere': 1}, 1.0),
+    'becquerel': ({'second': -1}, 1.0),
+    'candela': ({'candela': 1}, 1.0),
+    'coulomb': ({'second': 1, 'ampere': 1}, 1.0),
+    'dimensionless': ({}, 1.0),
+    'farad': ({'metre': -2, 'kilogram': -1, 'second': 4, 'ampere': 2}, 1.0),
+    'gram': ({'kilogram': 1}, 0.001),
+    'gray': ({'metre': 2, 'second': -2}, 1.0),
+    'henry': ({'metre': 2, 'kilogram': 1, 'second': -2, 'ampere': -2}, 1.0),
+    'hertz': ({'second': -1}, 1.0),
+    'joule': ({'metre': 2, 'kilogram': 1, 'second': -2}, 1.0),
+    'katal': ({'second': -1, 'mole': 1}, 1.0),
+    'kelvin': ({'kelvin': 1}, 1.0),
+    'kilogram': ({'kilogram': 1}, 1.0),
+    'litre': ({'metre': 3}, 0.001),
+    'liter': ({'metre': 3}, 0.001),
+    'lumen': ({'candela': 1}, 1.0),
+    'lux': ({'metre': -2, 'candela': 1}, 1.0),
+    'metre': ({'metre': 1}, 1.0),
+    'meter': ({'metre': 1}, 1.0),
+    'mole': ({'mole': 1}, 1.0),
+    'newton': ({'metre': 1, 'kilogram': 1, 'second': -2}, 1.0),
+    'ohm': ({'metre': 2, 'kilogram': 1, 'second': -3, 'ampere': -2}, 1.0),
+    'pascal': ({'metre': -1, 'kilogram': 1, 'second': -2}, 1.0),
+    'radian': ({}, 1.0),
+    'second': ({'second': 1}, 1.0),
+    'siemens': ({'metre': -2, 'kilogram': -1, 'second': 3, 'ampere': 2}, 1.0),
+    'sievert': ({'metre': 2, 'second': -2}, 1.0),
+    'steradian': ({}, 1.0),
+    'tesla': ({'kilogram': 1, 'second': -2, 'ampere': -1}, 1.0),
+    'volt': ({'metre': 2, 'kilogram': 1, 'second': -3, 'ampere': -1}, 1.0),
+    'watt': ({'metre': 2, 'kilogram': 1, 'second': -3}, 1.0),
+    'weber': ({'metre': 2, 'kilogram': 1, 'second': -2, 'ampere': -1}, 1.0),
+}
+
+
+def get_dimensions(cu):
+    """
+    :param cu: CompoundUnit instance
+    :return: tuple of (list of the exponents of BASE_UNITS, scale), or None if the units cannot be worked out, eg:
+    if they are made from blank or circular units, or are new base units of their own
+    """
+    return get_dimensions_in_bulk([cu])[cu.id]
+
+
+def get_dimensions_in_bulk(compoundunits):
+    """
+    Works out the dimensions of many units at once, with one query for each level of units they are made from.
+    :param compoundunits: list of CompoundUnit instances
+    :return: dictionary of {compoundunit id: (list of exponents, scale) or None}
+    """
+    known = {}
+    pending = {}
+    for cu in compoundunits:
+        add_known_dimensions(cu, known, pending)
+
+    # Collect the units which the pending units are made from, level by level
+    products = {}
+    frontier = set(pending)
+    while frontier:
+        units = list(Unit.objects.filter(parent_cu_id__in=frontier).select_related('prefix', 'child_cu'))
+        for cu_id in frontier:
+            products[cu_id] = []
+        for u in units:
+            products[u.parent_cu_id].append(u)
+        frontier = set()
+        for u in units:
+            if u.child_cu is not None and u.child_cu_id not in known and u.child_cu_id not in pending:
+                add_known_dimensions(u.child_cu, known, pending)
+                if u.child_cu_id in pending:
+                    frontier.add(u.child_cu_id)
+
+    # Each unit contributes multiplier * (10^prefix * child)^exponent.  Units are marked as unknown while they are
+    # being worked out, so that circular units stop there
+    def combine(cu_id):
+        if cu_id in known:
+            return known[cu_id]
+        known[cu_id] = None
+        vector = [0.0] * len(BASE_UNITS)
+        scale = 1.0
+        for u in products[cu_id]:
+            child = combine(u.child_cu_id) if u.child_cu is not None else None
+            if child is None:
+                return None
+            child_vector, child_scale = child
+            exponent = 1 if u.exponent is None else u.exponent
+            multiplier = 1.0 if u.multiplier is None else u.multiplier
+            prefix = 0 if u.prefix is None else u.prefix.value
+            scale *= multiplier * (10.0 ** prefix * child_scale) ** exponent
+            vector = [v + exponent * c for v, c in zip(vector, child_vector)]
+        if products[cu_id]:
+            known[cu_id] = (vector, scale)
+        return known[cu_id]
+
+    for cu_id in sorted(pending):
+        combine(cu_id)
+
+    # Written as an update so that storing the results is not seen as a change to the units
+    for cu in pending.values():
+        cu.dimensions, cu.scale = known[cu.id] if known[cu.id] is not None else ([], None)
+    if pending:
+        CompoundUnit.objects.bulk_update(list(pending.values()), ['dimensions', 'scale'])
+    return known
+
+
+def add_known_dimensions(cu, known, pending):
+    # Built-in and already stored units are known, others are worked out from the units they are made from
+    if cu.is_standard:
+        if cu.name in BUILT_IN_UNITS:
+            exponents, scale = BUILT_IN_UNITS[cu.name]
+            known[cu.id] = ([float(exponents.get(name, 0)) for name in BASE_UNITS], scale)
+        else:
+            known[cu.id] = None
+    elif cu.dimensions is not None:
+        # Units which cannot be worked out are stored with no dimensions, so that they are not tried again
+        known[cu.id] = (list(cu.dimensions), cu.scale) if cu.dimensions else None
+    else:
+        pending[cu.id] = cu
+
+
+def compare_units(cu_1, cu_2):
+    """
+    :param cu_1: CompoundUnit instance
+    :param cu_2: CompoundUnit instance
+    :return: tuple of (True if the units have the same dimensions, True if they also have the same scale), or None if
+    either of them cannot be worked out
+    """
+    if cu_1.id == cu_2.id:
+        return True, True
+    dimensions_1 = get_dimensions(cu_1)
+    dimensions_2 = get_dimensions(cu_2)
+    if dimensions_1 is None or dimensions_2 is None:
+        return None
+
+    same_dimensions = all([math.isclose(x, y, abs_tol=1e-9) for x, y in zip(dimensions_1[0], dimensions_2[0])])
+    return same_dimensions, same_dimensions and math.isclose(dimensions_1[1], dimensions_2[1], rel_tol=1e-9)
+
+
+def are_same_units(cu_1, cu_2):
+    # Units which cannot be worked out are only the same as themselves
+    comparison = compare_units(cu_1, cu_2)
+    return comparison is not None and comparison[1]
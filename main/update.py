@@ -0,0 +1,497 @@
+"""
+    This file contains the functions which update an existing CellModel from a revised CellML file.  Items are matched
+    by their name path (component names from the top of the encapsulation hierarchy, then the variable name, and units
+    by name), and only the rows whose attributes or links have changed are written.  Everything else, including notes
+    and annotations, is left alone.
+"""
+from django.db import transaction
+
+from main.hashing import hash_model_units, hash_component, hash_base_units
+from main.models import Variable, Component, Reset, CompoundUnit, Unit, Math, Prefix, bump_revision, mark_dirty
+
+
+def update_model_from_file(model, in_model, owner):
+    """
+    :param model: the CellModel instance to update
+    :param in_model: libcellml->Model instance read from the revised file
+    :param owner: the Person who will own any new items
+    :return: list of differences, each a dictionary with the action ('added', 'changed' or 'removed'), the item type,
+    its name path and the names of any changed fields
+    """
+    diff = []
+    with transaction.atomic():
+        changed = [f for f, value in [('name', in_model.name()), ('cellml_id', in_model.id())]
+                   if getattr(model, f) != value]
+        if changed:
+            model.name = in_model.name()
+            model.cellml_id = in_model.id()
+            model.save()
+            record(diff, 'changed', 'cellmodel', model.name, changed)
+
+        model_units, standard_units, undefined_units = update_compound_units(model, in_model, owner, diff)
+        loaded_components = update_components(model, in_model, owner, diff)
+        loaded_variables = update_variables(model, loaded_components, model_units, standard_units, undefined_units,
+                                            owner, diff)
+        update_maths(loaded_components, loaded_variables, owner, diff)
+        update_resets(loaded_components, loaded_variables, owner, diff)
+        update_equivalent_variables(model, loaded_components, loaded_variables, diff)
+        remove_unused_compound_units(model, model_units, diff)
+
+        # Most of the writes above are bulk operations which send no signals, so they mark the items they change as
+        # dirty themselves
+        if diff:
+            bump_revision([model.id])
+
+    return diff
+
+
+def record(diff, action, item_type, path, fields=()):
+    diff.append({'action': action, 'item_type': item_type, 'path': path, 'fields': list(fields)})
+
+
+def join_path(*names):
+    return "/".join(names)
+
+
+# -------------------------------- UNITS ----------------------------
+
+def unit_factors(in_units):
+    factors = []
+    for u in range(in_units.unitCount()):
+        reference, prefix_string, exponent, multiplier, local_id = in_units.unitAttributes(u)
+        factors.append((reference, prefix_string, float(exponent), float(multiplier)))
+    return factors
+
+
+def stored_unit_factors(compoundunit):
+    return [(u.name, u.prefix.name, float(u.exponent if u.exponent is not None else 1),
+             float(u.multiplier if u.multiplier is not None else 1))
+            for u in sorted(compoundunit.product_of.all(), key=lambda x: (x.cellml_index, x.id))]
+
+
+def update_compound_units(model, in_model, owner, diff):
+    standard_units = {cu.name: cu for cu in CompoundUnit.objects.filter(is_standard=True)}
+    existing = {}
+    for cu in model.compoundunits.filter(is_standard=False).order_by('id').prefetch_related('product_of__prefix'):
+        existing.setdefault(cu.name, cu)
+
+    hashes = hash_model_units(in_model)
+    model_units = {}
+    rebuild = []  # compound units whose child units must be written, with their libcellml units
+    for index in range(in_model.unitsCount()):
+        in_units = in_model.units(index)
+        name = in_units.name()
+        if name in model_units:
+            continue
+
+        if in_units.isBaseUnit():
+            base_unit = standard_units.get(name)
+            if base_unit is not None:
+                model_units[name] = base_unit
+                base_unit.models.add(model)
+            continue
+
+        cu = existing.get(name)
+        if cu is None:
+            cu = CompoundUnit(name=name, symbol=name, cellml_index=index, owner=owner, content_hash=hashes[name])
+            cu.save()
+            cu.models.add(model)
+            rebuild.append((cu, in_units))
+            record(diff, 'added', 'compoundunit', name)
+
+        elif stored_unit_factors(cu) != unit_factors(in_units):
+            if cu.models.count() > 1:
+                # Shared with other models, so this model gets its own changed copy instead
+                cu.models.remove(model)
+                cu = CompoundUnit(name=name, symbol=name, cellml_index=index, owner=owner, content_hash=hashes[name])
+                cu.save()
+                cu.models.add(model)
+            else:
+                cu.product_of.all().delete()
+                cu.cellml_index = index
+                cu.content_hash = hashes[name]
+                cu.save()
+            rebuild.append((cu, in_units))
+            record(diff, 'changed', 'compoundunit', name, ['units'])
+
+        elif cu.cellml_index != index and cu.models.count() == 1:
+            # The index of units shared with other models is theirs too, so is left alone
+            CompoundUnit.objects.filter(id=cu.id).update(cellml_index=index)
+            mark_dirty([(CompoundUnit, [cu.id])])
+
+        model_units[name] = cu
+
+    prefixes = {p.name: p for p in Prefix.objects.all()}
+    new_units = []
+    for cu, in_units in rebuild:
+        for u in range(in_units.unitCount()):
+            reference, prefix_string, exponent, multiplier, local_id = in_units.unitAttributes(u)
+            try:
+                prefix = prefixes[prefix_string]
+            except KeyError:
+                raise Prefix.DoesNotExist("Could not find prefix '{p}' for unit '{r}' in units '{u}'".format(
+                    p=prefix_string, r=reference, u=cu.name))
+            new_units.append(Unit(cellml_index=u, prefix=prefix, multiplier=multiplier, exponent=exponent,
+                                  cellml_id=local_id, name=reference, parent_cu=cu, owner=owner))
+    Unit.objects.bulk_create(new_units)
+
+    # Child units follow their references, which may now be different compound units
+    to_update = []
+    for unit in Unit.objects.filter(parent_cu__in=[cu for cu in model_units.values() if not cu.is_standard]):
+        child = model_units.get(unit.name, standard_units.get(unit.name))
+        if unit.child_cu_id != (child.id if child is not None else None):
+            unit.child_cu = child
+            to_update.append(unit)
+    Unit.objects.bulk_update(to_update, ['child_cu'])
+    mark_dirty([(Unit, [unit.id for unit in to_update])])
+
+    # Units which were created for variables rather than defined in the file
+    undefined_units = {name: cu for name, cu in existing.items()
+                       if name not in model_units and len(cu.product_of.all()) == 0}
+
+    return model_units, standard_units, undefined_units
+
+
+def remove_unused_compound_units(model, model_units, diff):
+    kept = [cu.id for cu in model_units.values()]
+    for cu in model.compoundunits.filter(is_standard=False).exclude(id__in=kept):
+        cu.models.remove(model)
+        record(diff, 'removed', 'compoundunit', cu.name)
+        # Only delete the row when nothing else refers to it
+        if not cu.models.exists() and not cu.variables.exists() and not cu.part_of.exists():
+            cu.product_of.all().delete()
+            cu.delete()
+
+
+# -------------------------------- COMPONENTS ----------------------------
+
+def update_components(model, in_model, owner, diff):
+    """
+    :return: list of (libcellml->Component, Component, path) for every component in the file
+    """
+    components = list(Component.objects.filter(model=model).order_by('id'))
+    by_id = {c.id: c for c in components}
+
+    def stored_path(component):
+        names = []
+        while component is not None:
+            names.insert(0, component.name)
+            component = by_id.get(component.parent_component_id)
+        return join_path(*names)
+
+    existing = {}
+    for component in components:
+        existing.setdefault(stored_path(component), component)
+
+    loaded = []
+    level = [(in_model, index, None, "") for index in range(in_model.componentCount())]
+    while level:
+        next_level = []
+        for in_parent, index, out_parent, parent_path in level:
+            in_component = in_parent.component(index)
+            path = join_path(parent_path, in_component.name()) if parent_path else in_component.name()
+            content_hash = hash_component(in_component)
+
+            component = existing.pop(path, None)
+            if component is None:
+                component = Component(name=in_component.name(), cellml_index=index, cellml_id=in_component.id(),
+                                      owner=owner, model=model, content_hash=content_hash)
+                if out_parent is not None:
+                    component.parent_component = out_parent
+                else:
+                    component.parent_model = model
+                component.save()
+                record(diff, 'added', 'component', path)
+            else:
+                changed = [f for f, value in [('cellml_index', index), ('cellml_id', in_component.id()),
+                                              ('content_hash', content_hash)] if getattr(component, f) != value]
+                if changed:
+                    component.cellml_index = index
+                    component.cellml_id = in_component.id()
+                    component.content_hash = content_hash
+                    Component.objects.filter(id=component.id).update(
+                        cellml_index=index, cellml_id=in_component.id(), content_hash=content_hash)
+                    mark_dirty([(Component, [component.id])])
+                    # Only a changed index is not worth reporting, and a changed hash means changed contents
+                    if changed != ['cellml_index']:
+                        record(diff, 'changed', 'component', path, [
+                            'contents' if f == 'content_hash' else f for f in changed if f != 'cellml_index'])
+
+            loaded.append((in_component, component, path))
+            for child_index in range(in_component.componentCount()):
+                next_level.append((in_component, child_index, component, path))
+        level = next_level
+
+    # Whatever is left was not in the file, and is removed deepest first
+    for path in sorted(existing, key=lambda p: -p.count("/")):
+        delete_component(existing[path])
+        record(diff, 'removed', 'component', path)
+
+    return loaded
+
+
+def delete_component(component):
+    resets = list(component.resets.all())
+    maths = list(component.maths.all()) + list(Math.objects.filter(
+        id__in=[x for reset in resets for x in [reset.test_value_id, reset.reset_value_id]]))
+
+    # Nothing else can be left pointing at the deleted items, as these relations are not cascaded
+    for field in ['imported_from', 'depends_on']:
+        clear_links(Component, field, [component])
+        clear_links(Math, field, maths)
+        clear_links(Reset, field, resets)
+
+    for reset in resets:
+        reset.delete()
+    Math.objects.filter(id__in=[math.id for math in maths]).delete()
+    delete_variables(list(component.variables.all()))
+    component.delete()
+
+
+def delete_variables(variables):
+    for field in ['initial_value_variable', 'imported_from', 'depends_on']:
+        clear_links(Variable, field, variables)
+    # The connections to the deleted variables are deleted with them
+    mark_dirty([(Variable, list(Variable.equivalent_variables.through.objects.filter(
+        from_variable__in=variables).values_list('to_variable_id', flat=True)))])
+    Variable.objects.filter(id__in=[variable.id for variable in variables]).delete()
+
+
+def clear_links(item_class, field, targets):
+    # The items changed by a queryset update are marked as dirty here, as the update sends no signals
+    items = item_class.objects.filter(**{field + '__in': targets})
+    ids = list(items.values_list('id', flat=True))
+    if ids:
+        item_class.objects.filter(id__in=ids).update(**{field: None})
+        mark_dirty([(item_class, ids)])
+
+
+# -------------------------------- VARIABLES, MATHS AND RESETS ----------------------------
+
+def update_variables(model, loaded_components, model_units, standard_units, undefined_units, owner, diff):
+    """
+    :return: dictionary of {component id: {variable name: Variable}}
+    """
+    # Units referenced by variables but defined nowhere are base units for this model, as when first loaded
+    for in_component, component, path in loaded_components:
+        for v in range(in_component.variableCount()):
+            name = in_component.variable(v).units()
+            if name != '' and name not in model_units and name not in standard_units:
+                if name in undefined_units:
+                    model_units[name] = undefined_units[name]
+                    continue
+                cu = CompoundUnit(name=name, symbol=name, is_standard=False, owner=owner,
+                                  content_hash=hash_base_units(name))
+                cu.save()
+                cu.models.add(model)
+                model_units[name] = cu
+                record(diff, 'added', 'compoundunit', name)
+
+    # Repeated names are matched in order, the first in the file to the first stored
+    existing = {}
+    for variable in Variable.objects.filter(component__in=[c for i, c, p in loaded_components]).order_by('id'):
+        existing.setdefault(variable.component_id, {}).setdefault(variable.name, []).append(variable)
+
+    loaded_variables = {}
+    new_variables = []
+    changes = []
+    initial_values = []
+    for in_component, component, path in loaded_components:
+        stored = existing.get(component.id, {})
+        component_variables = {}
+        for v in range(in_component.variableCount()):
+            in_variable = in_component.variable(v)
+            name = in_variable.name()
+
+            in_units = in_variable.units()
+            compoundunit = None if in_units == '' else standard_units.get(in_units, model_units.get(in_units))
+
+            constant = None
+            initialiser = None
+            initial_value = in_variable.initialValue()
+            if initial_value != "":
+                try:
+                    constant = float(initial_value)
+                except ValueError:
+                    initialiser = initial_value
+
+            variable = stored[name].pop(0) if stored.get(name) else None
+            if variable is None:
+                variable = Variable(cellml_index=v, name=name, owner=owner, component=component,
+                                    compoundunit=compoundunit, initial_value_constant=constant)
+                new_variables.append(variable)
+                record(diff, 'added', 'variable', join_path(path, name))
+            else:
+                values = [('cellml_index', v), ('compoundunit_id', compoundunit.id if compoundunit else None),
+                          ('initial_value_constant', constant)]
+                changed = [f.replace('_id', '') for f, value in values if getattr(variable, f) != value]
+                for f, value in values:
+                    setattr(variable, f, value)
+                changes.append((variable, changed, join_path(path, name)))
+
+            # Names are resolved to the first variable with that name, as when first loaded
+            component_variables.setdefault(name, variable)
+            if initialiser is not None:
+                initial_values.append((variable, component_variables, initialiser))
+
+        loaded_variables[component.id] = component_variables
+
+        # Variables no longer in the file
+        removed = [(name, variable) for name, variables in stored.items() for variable in variables]
+        delete_variables([variable for name, variable in removed])
+        for name, variable in removed:
+            record(diff, 'removed', 'variable', join_path(path, name))
+
+    Variable.objects.bulk_create(new_variables)
+
+    # Initialising variables can only be resolved once all the variables have ids.  New variables have no id to be
+    # used as a key before then, so the python object ids are used instead
+    initialisers = {}
+    for variable, component_variables, initial_value in initial_values:
+        initialisers[id(variable)] = component_variables.get(initial_value)
+
+    for variable, changed, path in changes:
+        initialiser = initialisers.get(id(variable))
+        if variable.initial_value_variable_id != (initialiser.id if initialiser is not None else None):
+            variable.initial_value_variable = initialiser
+            changed.append('initial_value_variable')
+        if changed:
+            variable.save(update_fields=changed)
+            if changed != ['cellml_index']:
+                record(diff, 'changed', 'variable', path, [f for f in changed if f != 'cellml_index'])
+
+    to_update = []
+    for variable in new_variables:
+        if initialisers.get(id(variable)) is not None:
+            variable.initial_value_variable = initialisers[id(variable)]
+            to_update.append(variable)
+    Variable.objects.bulk_update(to_update, ['initial_value_variable'])
+
+    return loaded_variables
+
+
+def update_maths(loaded_components, loaded_variables, owner, diff):
+    for in_component, component, path in loaded_components:
+        mathml = in_component.math()
+        maths = list(component.maths.order_by('id'))
+
+        if not mathml:
+            if maths:
+                component.maths.all().delete()
+                record(diff, 'removed', 'math', path)
+            continue
+
+        if not maths:
+            math = Math(math_ml=mathml, owner=owner, component=component)
+            math.save()
+            record(diff, 'added', 'math', path)
+        else:
+            math = maths[0]
+            for extra in maths[1:]:
+                extra.delete()
+            if math.math_ml != mathml:
+                math.math_ml = mathml
+                math.save()
+                record(diff, 'changed', 'math', path, ['math_ml'])
+
+        # The variables may have changed even when the maths has not
+        variables = loaded_variables[component.id]
+        wanted = {variables[x].id for x in math.identifiers if x in variables}
+        if wanted != set(math.variables.values_list('id', flat=True)):
+            math.variables.set(wanted)
+
+
+def update_resets(loaded_components, loaded_variables, owner, diff):
+    for in_component, component, path in loaded_components:
+        variables = loaded_variables[component.id]
+        resets = list(component.resets.order_by('cellml_index', 'id').select_related('test_value', 'reset_value'))
+
+        for r in range(in_component.resetCount()):
+            in_reset = in_component.reset(r)
+            reset_path = "{p}/reset {r}".format(p=path, r=r)
+            variable = None if in_reset.variable() is None else variables.get(in_reset.variable().name())
+            test_variable = None if in_reset.test_variable() is None else \
+                variables.get(in_reset.test_variable().name())
+
+            if r >= len(resets):
+                test_value = Math(math_ml=in_reset.test_value(), owner=owner)
+                test_value.save()
+                reset_value = Math(math_ml=in_reset.reset_value(), owner=owner)
+                reset_value.save()
+                Reset(cellml_index=r, order=int(in_reset.order()), component=component, owner=owner,
+                      variable=variable, test_variable=test_variable, test_value=test_value,
+                      reset_value=reset_value).save()
+                record(diff, 'added', 'reset', reset_path)
+                continue
+
+            reset = resets[r]
+            changed = [f for f, value in [('order', int(in_reset.order())),
+                                          ('variable_id', variable.id if variable else None),
+                                          ('test_variable_id', test_variable.id if test_variable else None)]
+                       if getattr(reset, f) != value]
+            changed = [f.replace('_id', '') for f in changed]
+            reset.order = int(in_reset.order())
+            reset.variable = variable
+            reset.test_variable = test_variable
+            for f, mathml in [('test_value', in_reset.test_value()), ('reset_value', in_reset.reset_value())]:
+                math = getattr(reset, f)
+                if math is None:
+                    setattr(reset, f, Math.objects.create(math_ml=mathml, owner=owner))
+                    changed.append(f)
+                elif math.math_ml != mathml:
+                    math.math_ml = mathml
+                    math.save()
+                    changed.append(f)
+            if changed or reset.cellml_index != r:
+                reset.cellml_index = r
+                reset.save()
+            if changed:
+                record(diff, 'changed', 'reset', reset_path, changed)
+
+        for r, reset in enumerate(resets[in_component.resetCount():], in_component.resetCount()):
+            Math.objects.filter(id__in=[reset.test_value_id, reset.reset_value_id]).delete()
+            reset.delete()
+            record(diff, 'removed', 'reset', "{p}/reset {r}".format(p=path, r=r))
+
+
+# -------------------------------- CONNECTIONS ----------------------------
+
+def update_equivalent_variables(model, loaded_components, loaded_variables, diff):
+    # Names are resolved as on first loading, the earliest component wins where names are repeated
+    component_ids = {}
+    for in_component, component, path in sorted(loaded_components, key=lambda x: x[1].id):
+        component_ids.setdefault(component.name, component.id)
+    paths = {}
+    for in_component, component, path in loaded_components:
+        for name, variable in loaded_variables[component.id].items():
+            paths[variable.id] = join_path(path, name)
+
+    wanted = set()
+    for in_component, component, path in loaded_components:
+        for v in range(in_component.variableCount()):
+            in_variable = in_component.variable(v)
+            variable = loaded_variables[component.id].get(in_variable.name())
+            for ev in range(in_variable.equivalentVariableCount()):
+                in_equiv = in_variable.equivalentVariable(ev)
+                equiv_component_id = component_ids.get(in_equiv.parentComponent().name())
+                equiv = loaded_variables.get(equiv_component_id, {}).get(in_equiv.name())
+                if variable is not None and equiv is not None:
+                    wanted.add((variable.id, equiv.id))
+                    wanted.add((equiv.id, variable.id))
+
+    through = Variable.equivalent_variables.through
+    stored = set(through.objects.filter(from_variable_id__in=paths.keys()).values_list(
+        'from_variable_id', 'to_variable_id'))
+
+    added = wanted - stored
+    removed = {p for p in stored - wanted if p[1] in paths}
+    through.objects.bulk_create([through(from_variable_id=f, to_variable_id=t) for f, t in added],
+                                ignore_conflicts=True)
+    for f, t in removed:
+        through.objects.filter(from_variable_id=f, to_variable_id=t).delete()
+    mark_dirty([(Variable, [x for pair in added | removed for x in pair])])
+
+    for action, pairs in [('added', added), ('removed', removed)]:
+        for f, t in sorted(pairs):
+            if f < t:
+                record(diff, action, 'connection', "{a} = {b}".format(a=paths[f], b=paths[t]))
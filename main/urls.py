@@ -8,9 +8,12 @@ urlpatterns = [
 
     # Alphabetical order of views
     path('ajax_validate/', views.ajax_validate, name='ajax_validate'),
+    path('ajax_validate_tree/', views.ajax_validate_tree, name='ajax_validate_tree'),
 
+    path('ajax_upload_status/<int:job_id>/', views.ajax_upload_status, name='ajax_upload_status'),
     path('ajax_get_validation_list/<item_type>/<int:item_id>/', views.ajax_get_validation_list,
          name='ajax_get_validation_list'),
+    path('ajax_storage_tree/<int:item_id>/<int:node>/', views.ajax_storage_tree, name='ajax_storage_tree'),
     path('browse/<item_type>/', views.browse, name='browse'),
 
     path('copy/<item_type>/<int:item_id>/', views.copy, name='copy'),
@@ -30,11 +33,15 @@ urlpatterns = [
     path('display/temporarystorage/<int:item_id>/', views.display_storage, name='display_storage'),
     path('display/<item_type>/<int:item_id>/', views.display, name='display'),
 
+    path('download_model/<int:item_id>/', views.download_model, name='download_model'),
+
     path('edit_field/<item_type>/<int:item_id>/<item_field>/', views.edit_field, name='edit_field'),
     path('edit_locals/<item_type>/<int:item_id>/', views.edit_locals, name='edit_locals'),
     path('edit_unit/<int:item_id>/', views.edit_unit, name='edit_unit'),
 
     path('convert_model/<int:item_id>/', views.convert_model, name='convert_model'),
+    path('convert_model_python/<int:item_id>/', views.convert_model_python, name='convert_model_python'),
+    path('export_models/<scope>/', views.export_models, name='export_models'),
 
     path('home/', views.home, name='home'),
     path('intro/', views.intro, name='intro'),
@@ -53,6 +60,8 @@ urlpatterns = [
     path('show_errors/<item_type>/<int:item_id>/', views.show_errors, name='show_errors'),
 
     path('upload/', views.upload, name='upload'),
+    path('upload/<int:item_id>/', views.upload, name='update_from_file'),
+    path('upload_status/<int:job_id>/', views.upload_status, name='upload_status'),
     # path('upload_check/<int:item_id>/', views.upload_check, name='upload_check'),
     # path('upload_model/', views.upload_model, name='upload_model'),
 
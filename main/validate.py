@@ -3,16 +3,117 @@
 """
 import xml.etree.ElementTree as ElementTree
 
-from django.db.models import Count
+from django.db import transaction
+from django.db.models import Count, Q
 
+from main.equivalence import find_cycles
 from main.functions import draw_error_tree
-from main.models import ItemError, CompoundUnit
+from main.math_units import check_units_of_math, get_units_of_maths
+from main.models import ItemError, CellModel, Component, Reset, Math, CompoundUnit, Unit, Variable, \
+    VALIDATION_FIELDS
+from main.units import compare_units, are_same_units
+
+
+# The classes of the items which can hold errors, and the filter which selects those inside a model
+MODEL_ITEM_TYPES = [
+    ('cellmodel', CellModel, lambda model: Q(id=model.id)),
+    ('component', Component, lambda model: Q(model=model)),
+    ('variable', Variable, lambda model: Q(component__model=model)),
+    ('reset', Reset, lambda model: Q(component__model=model)),
+    ('math', Math, lambda model: Q(component__model=model)),
+    ('compoundunit', CompoundUnit, lambda model: Q(models=model, is_standard=False)),
+    ('unit', Unit, lambda model: Q(parent_cu__models=model, parent_cu__is_standard=False)),
+]
+
+
+def store_errors(errors):
+    """
+    Saves errors which are not already stored.  Errors with the same text are stored once and shared by the items.
+    Must be called inside a transaction which also links the errors to their items: the errors are locked until it
+    ends, so that delete_unused_errors can't delete them before they are linked.
+    :param errors: list of unsaved ItemError instances
+    :return: dictionary of {digest: saved ItemError}
+    """
+    for err in errors:
+        err.digest = err.get_digest()
+    unique = {err.digest: err for err in errors}
+    stored = {}
+    # Errors deleted as unused by another process between the insert and the lock are inserted again
+    while len(stored) < len(unique):
+        ItemError.objects.bulk_create([err for digest, err in unique.items() if digest not in stored],
+                                      ignore_conflicts=True)
+        stored = {err.digest: err for err in ItemError.objects.select_for_update().filter(
+            digest__in=list(unique)).order_by('id')}
+    return stored
+
+
+def add_item_errors(item_errors):
+    """
+    Adds errors to items, keeping the errors they already have.
+    :param item_errors: list of (item, [unsaved ItemError instances]) tuples
+    """
+    with transaction.atomic():
+        stored = store_errors([err for item, errors in item_errors for err in errors])
+        links = {}
+        for item, errors in item_errors:
+            through = type(item).errors.through
+            field = type(item).__name__.lower() + '_id'
+            links.setdefault(through, []).extend([through(**{field: item.id, 'itemerror_id': stored[err.digest].id})
+                                                  for err in errors])
+        for through, rows in links.items():
+            if rows:
+                through.objects.bulk_create(rows, ignore_conflicts=True)
+
+
+def remove_item_errors(items):
+    # Only the links are removed, as an error can be shared with other items; see delete_unused_errors
+    ids = {}
+    for item in items:
+        ids.setdefault(type(item), []).append(item.id)
+    for item_class, item_ids in ids.items():
+        item_class.errors.through.objects.filter(**{item_class.__name__.lower() + '_id__in': item_ids}).delete()
+
+
+def replace_item_errors(item_errors):
+    """
+    Replaces all of the errors of the items, with one delete and one insert of links for each type of item.
+    :param item_errors: list of (item, [unsaved ItemError instances]) tuples
+    """
+    remove_item_errors([item for item, errors in item_errors])
+    add_item_errors(item_errors)
+
+
+def get_model_error_ids(model):
+    """
+    :param model: CellModel instance
+    :return: set of the ids of the errors linked to the model or any of its items
+    """
+    error_ids = set()
+    for item_type, item_class, scope in MODEL_ITEM_TYPES:
+        error_ids |= set(item_class.errors.through.objects.filter(**{
+            item_type + '_id__in': item_class.objects.filter(scope(model)).values('id')}).values_list(
+            'itemerror_id', flat=True))
+    return error_ids
+
+
+def delete_unused_errors(error_ids):
+    """
+    Deletes those of the given errors which no item refers to any more.  Only the errors which may have been unlinked
+    by a validation are checked, rather than every stored error.
+    :param error_ids: ids of the errors to check, eg: from get_model_error_ids before validating a model
+    """
+    with transaction.atomic():
+        # Errors locked by store_errors are about to be linked again, so are skipped rather than waited for
+        unused = ItemError.objects.select_for_update(skip_locked=True, of=('self',)).filter(id__in=list(error_ids))
+        for related in ItemError._meta.related_objects:
+            unused = unused.filter(**{related.name + '__isnull': True})
+        unused_ids = list(unused.values_list('id', flat=True))
+        ItemError.objects.filter(id__in=unused_ids).delete()
 
 
 def validate_variable(variable):
     # Variables are all local validation - no need for a duplicate
-    for e in variable.errors.all():
-        e.delete()
+    errors = []
 
     try:
         initial_component_id = variable.initial_value_variable.component.id
@@ -33,8 +134,7 @@ def validate_variable(variable):
             spec='11.1.1.1',
             fields=["name"]
         )
-        err.save()
-        variable.errors.add(err)
+        errors.append(err)
 
     # Check that variable has units
     if variable.compoundunit is None:
@@ -43,12 +143,11 @@ def validate_variable(variable):
             spec="11.1.1.2",
             fields=["compoundunit"]
         )
-        err.save()
-        variable.errors.add(err)
+        errors.append(err)
         is_valid = False
     # Check that the units of the initialising variable are the same as for this variable
     elif initial_unit_id is not None:
-        if initial_unit_id != variable.compoundunit.id:
+        if not are_same_units(variable.compoundunit, variable.initial_value_variable.compoundunit):
             err = ItemError(
                 hints=
                 "Variable has units of <i>{u}</i> but is initialised by variable <i>{vi}</i> "
@@ -59,8 +158,7 @@ def validate_variable(variable):
                 spec="11?",
                 fields=["initial_value_variable"]
             )
-            err.save()
-            variable.errors.add(err)
+            errors.append(err)
             is_valid = False
 
     # Check that the variable has access to the initialising variable
@@ -77,8 +175,7 @@ def validate_variable(variable):
                 spec="11.1.2.1",
                 fields=['initial_value_variable', 'component']
             )
-            err.save()
-            variable.errors.add(err)
+            errors.append(err)
             is_valid = False
 
     # Check that there is only one method of initialisation
@@ -94,8 +191,7 @@ def validate_variable(variable):
             spec="11.1.2.1",
             fields=['initial_value_variable', 'initial_value_constant']
         )
-        err.save()
-        variable.errors.add(err)
+        errors.append(err)
         is_valid = False
 
     # Check that directly related resets have unique orders
@@ -115,22 +211,22 @@ def validate_variable(variable):
             spec="??",  # TODO find spec reference for resets
             fields=['reset_variables']  # TODO not sure what this should be
         )
-        err.save()
-        variable.errors.add(err)
+        errors.append(err)
         is_valid = False
 
+    replace_item_errors([(variable, errors)])
+
     error_tree, error_count = draw_error_tree(variable)
     error_count += variable.errors.count()
     variable.error_tree = {'tree_html': error_tree, 'error_count': error_count}
     variable.is_valid = is_valid
-    variable.save()
+    variable.save(update_fields=VALIDATION_FIELDS)
 
     return is_valid
 
 
 def validate_compoundunit(cu):
-    for e in cu.errors.all():
-        e.delete()
+    errors = []
 
     # Built-in units are valid
     if cu.is_standard:
@@ -148,8 +244,7 @@ def validate_compoundunit(cu):
             spec='8.1.1',
             fields=['name']
         )
-        err.save()
-        cu.errors.add(err)
+        errors.append(err)
 
     if CompoundUnit.objects.filter(name=cu.name, is_standard=True).count() > 0:
         err = ItemError(
@@ -157,10 +252,11 @@ def validate_compoundunit(cu):
             spec="8.1.3",
             fields=['name']
         )
-        err.save()
-        cu.errors.add(err)
+        errors.append(err)
         is_valid = False
 
+    replace_item_errors([(cu, errors)])
+
     # Also need to check the unit elements of this compound unit here as they can't be accessed individually
     for u in cu.product_of.all():
         is_valid = validate_unit(u) and is_valid
@@ -169,15 +265,14 @@ def validate_compoundunit(cu):
     error_count += cu.errors.count()
     cu.error_tree = {'tree_html': error_tree, 'error_count': error_count}
     cu.is_valid = is_valid
-    cu.save()
+    cu.save(update_fields=VALIDATION_FIELDS)
 
     return is_valid
 
 
 def validate_unit(unit):
     is_valid = True
-    for e in unit.errors.all():
-        e.delete()
+    errors = []
     unit.error_tree = None
 
     # 9.1.1 Check that the pointers are valid
@@ -189,32 +284,36 @@ def validate_unit(unit):
             spec='9.1.1',
             fields=['child_cu']
         )
-        err.save()
-        unit.parent_cu.errors.add(err)
+        errors.append(err)
+
+    replace_item_errors([(unit, [])])
+    add_item_errors([(unit.parent_cu, errors)])
 
     error_tree, error_count = draw_error_tree(unit)
     error_count += unit.errors.count()
     unit.error_tree = {'tree_html': error_tree, 'error_count': error_count}
     unit.is_valid = is_valid
-    unit.save()
+    unit.save(update_fields=VALIDATION_FIELDS)
 
     return is_valid
 
 
-def validate_math(math):
+def validate_math(math, units=None):
+    """
+    :param math: Math instance
+    :param units: (optional) units and variables dimensions of the math's model, see check_units_of_math
+    :return: True if the math is valid
+    """
     # Check that all connected variables are inside this component
     is_valid = True
-    for e in math.errors.all():
-        e.delete()
+    errors = []
 
     # Compare list of local variables in this component with the ones used in the mathml
     available_variables = [x[0] for x in math.component.variables.values_list('name')]
-    referenced_variables = [x.split("</ci>")[0] for x in math.math_ml.split("<ci>")[1:]]
+    missing = set(math.identifiers) - set(available_variables)
 
-    missing = set(referenced_variables) - set(available_variables)
-
-    for m in missing:
-        n = "'{n}' ".format(math.name) if math.name != "" else ""
+    for m in sorted(missing):
+        n = "'{n}' ".format(n=math.name) if math.name != "" else ""
         err = ItemError(
             hints="Maths {n}in component '{c}' references a variable '{v}' which is not inside the component.".format(
                 n=n,
@@ -223,12 +322,17 @@ def validate_math(math):
             spec="14.1.3",
             fields=["variables"]
         )
-        err.save()
-        math.errors.add(err)
+        errors.append(err)
         is_valid = False
 
+    # Check that terms which are added, compared or set equal have the same units
+    units_errors = check_units_of_math(math, units)
+    errors.extend(units_errors)
+    is_valid = is_valid and not units_errors
+
+    replace_item_errors([(math, errors)])
+
     # TODO Validate elements in the cellml string
-    # TODO Validate that units are consistent
     # TODO Warn if multipliers are inconsistent in the units
 
     return is_valid
@@ -236,8 +340,7 @@ def validate_math(math):
 
 def validate_reset(reset):
     is_valid = True
-    for e in reset.errors.all():
-        e.delete()
+    errors = []
 
     if reset.order == '' or reset.order is None:
         err = ItemError(
@@ -245,8 +348,7 @@ def validate_reset(reset):
             spec="12.1.2",
             fields=["order"]
         )
-        err.save()
-        reset.errors.add(err)
+        errors.append(err)
         is_valid = False
 
     if reset.test_value is None:
@@ -255,8 +357,7 @@ def validate_reset(reset):
             spec="12",  # TODO find correct code for resets
             fields=['test_value']
         )
-        err.save()
-        reset.errors.add(err)
+        errors.append(err)
         is_valid = False
 
     if reset.reset_value is None:
@@ -265,8 +366,7 @@ def validate_reset(reset):
             spec="12",  # TODO find correct code for resets
             fields=['reset_value']
         )
-        err.save()
-        reset.errors.add(err)
+        errors.append(err)
         is_valid = False
 
     if reset.component is None:
@@ -275,8 +375,7 @@ def validate_reset(reset):
             spec="10.1.2.2",
             fields=['component']
         )
-        err.save()
-        reset.errors.add(err)
+        errors.append(err)
         is_valid = False
 
     if reset.variable is None:
@@ -285,8 +384,7 @@ def validate_reset(reset):
             spec="12.1.1",
             fields=['variable']
         )
-        err.save()
-        reset.errors.add(err)
+        errors.append(err)
         is_valid = False
 
     if reset.test_variable is None:
@@ -295,8 +393,7 @@ def validate_reset(reset):
             spec="12",  # TODO find correct code for resets
             fields=['test_variable']
         )
-        err.save()
-        reset.errors.add(err)
+        errors.append(err)
         is_valid = False
 
     if reset.component is not None:
@@ -311,8 +408,7 @@ def validate_reset(reset):
                 spec="12",  # TODO find correct code for resets
                 fields=['variable']
             )
-            err.save()
-            reset.errors.add(err)
+            errors.append(err)
             is_valid = False
 
         if reset.test_variable is not None and reset.component != reset.test_variable.component:
@@ -326,23 +422,23 @@ def validate_reset(reset):
                 spec="12",  # TODO find correct code for resets
                 fields=['test_variable']
             )
-            err.save()
-            reset.errors.add(err)
+            errors.append(err)
             is_valid = False
 
+    replace_item_errors([(reset, errors)])
+
     error_tree, error_count = draw_error_tree(reset)
     error_count += reset.errors.count()
     reset.error_tree = {'tree_html': error_tree, 'error_count': error_count}
     reset.is_valid = is_valid
-    reset.save()
+    reset.save(update_fields=VALIDATION_FIELDS)
 
     return is_valid
 
 
 def validate_component_locally(component):
     is_valid = True
-    for e in component.errors.all():
-        e.delete()
+    errors = []
 
     is_valid, hints = is_cellml_identifier(component.name)
     if not is_valid:
@@ -353,8 +449,7 @@ def validate_component_locally(component):
             spec='10.1.1',
             fields=['name']
         )
-        err.save()
-        component.errors.add(err)
+        errors.append(err)
 
     # Check component's variables for duplicate names
     duplicates = component.variables.values('name').annotate(name_count=Count('name')).filter(name_count__gt=1)
@@ -367,18 +462,27 @@ def validate_component_locally(component):
             spec='11.1.1.1',
             fields=['variables']
         )
-        err.save()
-        component.errors.add(err)  # It's an error of the *component* not of the variable itself ...
+        errors.append(err)  # It's an error of the *component* not of the variable itself ...
         is_valid = False
 
+    replace_item_errors([(component, errors)])
+
     return is_valid
 
 
-def validate_component(component):
+def validate_component(component, units=None):
+    """
+    :param component: Component instance
+    :param units: (optional) units and variables dimensions of the component's model, see check_units_of_math.  They
+    are read once here otherwise, and shared by the maths of the component and of those it encapsulates
+    :return: True if the component is valid
+    """
+    if units is None and component.model_id is not None:
+        units = get_units_of_maths(component.model_id)
     is_valid = validate_component_locally(component)
 
     for child_component in component.child_components.all():
-        is_valid = validate_component(child_component) and is_valid
+        is_valid = validate_component(child_component, units) and is_valid
 
     for variable in component.variables.all():
         is_valid = validate_variable(variable) and is_valid
@@ -387,21 +491,20 @@ def validate_component(component):
         is_valid = validate_reset(reset) and is_valid
 
     for math in component.maths.all():
-        is_valid = validate_math(math) and is_valid
+        is_valid = validate_math(math, units) and is_valid
 
     error_tree, error_count = draw_error_tree(component)
     error_count += component.errors.count()
     component.error_tree = {'tree_html': error_tree, 'error_count': error_count}
     component.is_valid = is_valid
-    component.save()
+    component.save(update_fields=VALIDATION_FIELDS)
 
     return is_valid
 
 
 def validate_cellmodel_locally(model):
     is_valid = True
-    for e in model.errors.all():
-        e.delete()
+    errors = []
     model.error_tree = None
 
     # Check model name
@@ -414,8 +517,7 @@ def validate_cellmodel_locally(model):
             spec='4.2.1',
             fields=['name']
         )
-        err.save()
-        model.errors.add(err)
+        errors.append(err)
         is_valid = False
 
     # Check model's components for duplicate names
@@ -428,8 +530,7 @@ def validate_cellmodel_locally(model):
                 m=model.name),
             spec='10.1.1',
         )
-        err.save()
-        model.errors.add(err)  # It's an error of the *model* not of the component itself ...
+        errors.append(err)  # It's an error of the *model* not of the component itself ...
         is_valid = False
 
     # Check model units
@@ -442,8 +543,7 @@ def validate_cellmodel_locally(model):
                 m=model.name),
             spec='8.1.2',
         )
-        err.save()
-        model.errors.add(err)  # It's an error of the *model* not of the compoundunit itself ...
+        errors.append(err)  # It's an error of the *model* not of the compoundunit itself ...
         is_valid = False
 
     # Check that the set of compound units used by the variables exists in the model
@@ -460,30 +560,36 @@ def validate_cellmodel_locally(model):
                   "model, and are not built-in.".format(c=c, u=u, v=v),
             spec="11.1.1.2"
         )
-        err.save()
-        model.errors.add(err)
+        errors.append(err)
         is_valid = False
 
+    replace_item_errors([(model, errors)])
+
     return is_valid
 
 
 def validate_cellmodel(model):
+    # The errors the model has now, which are deleted at the end if nothing uses them any more
+    error_ids = get_model_error_ids(model)
     is_valid = validate_cellmodel_locally(model)
 
+    # The dimensions of the model's units and variables are worked out once for all of its maths
+    units = get_units_of_maths(model.id)
     for component in model.all_components.all():
-        is_valid = validate_component(component) and is_valid
+        is_valid = validate_component(component, units) and is_valid
 
     for compoundunit in model.compoundunits.all():
         is_valid = validate_compoundunit(compoundunit) and is_valid
 
     # Validate connections and equivalent variable networks in the model
     is_valid = validate_connections(model) and is_valid
+    delete_unused_errors(error_ids)
 
     error_tree, error_count = draw_error_tree(model)
     error_count += model.errors.count()
     model.error_tree = {'tree_html': error_tree, 'error_count': error_count}
     model.is_valid = is_valid
-    model.save()
+    model.save(update_fields=VALIDATION_FIELDS)
 
     return is_valid
 
@@ -501,8 +607,7 @@ def validate_equivalent_variable(component, variable):
             spec="17.1.2",
             fields=['component']  # TODO not sure what this should be
         )
-        err.save()
-        component.errors.add(err)
+        add_item_errors([(component, [err])])
         is_valid = False
 
     # Check that the variables have a valid parent component
@@ -516,31 +621,46 @@ def validate_equivalent_variable(component, variable):
             spec="17.?",
             fields=['component']  # TODO not sure what this should be
         )
-        err.save()
-        ev.errors.add(err)
-        component.errors.add(err)
+        add_item_errors([(ev, [err]), (component, [err])])
         is_valid = False
 
+    # Check that the units of equivalent variables are equivalent.  Units which only differ in scale, eg: mV and V,
+    # are allowed, as the values are converted when the model is run
+    if variable.compoundunit is not None:
+        for ev in variable.equivalent_variables.filter(component__isnull=False, compoundunit__isnull=False).exclude(
+                compoundunit=variable.compoundunit).select_related('component', 'compoundunit'):
+            comparison = compare_units(variable.compoundunit, ev.compoundunit)
+            if comparison is None or comparison[0]:
+                continue
+            hints = "Variable <i>{v1}</i> in component <i>{c1}</i> has units <i>{u1}</i> which are not " \
+                    "equivalent to the units <i>{u2}</i> of its equivalent variable <i>{v2}</i> in component " \
+                    "<i>{c2}</i>"
+            err = ItemError(
+                hints=hints.format(v1=variable.name, c1=component.name, u1=variable.compoundunit.name, v2=ev.name,
+                                   c2=ev.component.name, u2=ev.compoundunit.name),
+                spec="19.10.6",
+                fields=['component']  # TODO not sure what this should be
+            )
+            add_item_errors([(component, [err])])
+            is_valid = False
+
     return is_valid
 
 
 def validate_connections(model):
     is_valid = True
+    errors = []
     for component in model.all_components.all():
         for variable in component.variables.filter(equivalent_variables__isnull=False):
             is_valid = validate_equivalent_variable(component, variable)
 
     cycle_list = model_cyclic_variables_found(model)
-    loop_count = len(cycle_list)
-    if loop_count > 0:
-        loops = " loops" if loop_count > 1 else " loop"
-        des = ''.join(cycle_list)
+    if len(cycle_list) > 0:
         err = ItemError(
-            hints="Cyclic variables exist, " + str(loop_count) + loops + " found (Component,Variable): <br>" + des,
+            hints=describe_cyclic_variables(cycle_list),
             spec="19.10.5"
         )
-        err.save()
-        model.errors.add(err)
+        errors.append(err)
         is_valid = False
     else:
         # Check order uniqueness in resets
@@ -564,10 +684,11 @@ def validate_connections(model):
                             hints=des,
                             spec='12.1.1.2'
                         )
-                        err.save()
-                        model.errors.add(err)
+                        errors.append(err)
                         is_valid = False
 
+    add_item_errors([(model, errors)])
+
     return is_valid
 
 
@@ -596,9 +717,10 @@ def fetch_connected_resets(variable, local_done_list, reset_map):
     for equiv in variable.equivalent_variables.exclude(id__in=local_done_list):
         component = equiv.component
 
-        for reset in component.resets.filter(variable=equiv):
-            reset_map[str(reset.order)].append(reset)
-        local_done_list.append(equiv)
+        if component is not None:
+            for reset in component.resets.filter(variable=equiv):
+                reset_map.setdefault(str(reset.order), []).append(reset)
+        local_done_list.append(equiv.id)
 
         local_done_list, reset_map = fetch_connected_resets(equiv, local_done_list, reset_map)
 
@@ -606,62 +728,38 @@ def fetch_connected_resets(variable, local_done_list, reset_map):
 
 
 def model_cyclic_variables_found(model):
-    all_variable_list = []
-    total_list = []
-    hint_list = []
-
-    for component in model.all_components.all():
-        for variable in component.variables.annotate(num_ev=Count('equivalent_variables')
-                                                     ).filter(num_ev__gte=2).exclude(id__in=all_variable_list):
-            for eq in variable.equivalent_variables.all():
-                check_list = [variable]
-                found, check_list, all_variable_list = cyclic_variable_found(variable, eq, check_list,
-                                                                             all_variable_list)
-                if found:
-                    total_list.append(check_list)
-
-    for temp_list in total_list:
-        start = min(temp_list.values_list('name'))  # Getting the first name alphabetically and only reporting this loop
-        if temp_list[0] == start:
-
-            description = ''
-            reverse_description = ''
-            separator = ''
-
-            for v in temp_list:
-                parent = v.component
-                description += separator + "(<i>" + parent.name + ", " + v.name + "</i>)"
-                reverse_description = "(<i>" + parent.name + ", " + v.name + "</i>)" + separator + reverse_description
-                separator = " -> "
-            description += "<br>"
-            reverse_description += "<br>"
-
-            # if this info has not yet been added to the error list, add it
-            if description not in hint_list and reverse_description not in hint_list:
-                hint_list.append(description)
+    """
+    :param model: CellModel instance
+    :return: list of descriptions, one for each independent cycle of equivalent variables in the model
+    """
+    names = {}
+    pairs = []
+    for variable_1, variable_2, v1, c1, v2, c2 in Variable.equivalent_variables.through.objects.filter(
+            from_variable__component__model=model).values_list(
+            'from_variable_id', 'to_variable_id', 'from_variable__name', 'from_variable__component__name',
+            'to_variable__name', 'to_variable__component__name'):
+        names[variable_1] = (c1, v1)
+        names[variable_2] = (c2 or "", v2)
+        pairs.append((variable_1, variable_2))
 
+    hint_list = []
+    for cycle in find_cycles(pairs):
+        # Each cycle is described from its first variable by name, towards the lower of its neighbours, so that the
+        # result is always the same
+        cycle = cycle[:-1]
+        first = cycle.index(min(cycle, key=lambda variable_id: names[variable_id]))
+        cycle = cycle[first:] + cycle[:first + 1]
+        if names[cycle[-2]] < names[cycle[1]]:
+            cycle.reverse()
+        hint_list.append(" -> ".join(["(<i>{c}, {v}</i>)".format(c=names[variable_id][0], v=names[variable_id][1])
+                                      for variable_id in cycle]) + "<br>")
     return hint_list
 
 
-def cyclic_variable_found(parent, child, check_list, all_variable_list):
-    all_variable_list.append(child)
-
-    if child in check_list:
-        check_list.append(child)
-        while check_list[0] != check_list[-1]:
-            check_list.remove(check_list[0])
-        return True, check_list, all_variable_list
-
-    check_list.append(child)
-
-    for eq in child.equivalent_variables.all():
-        if eq == parent:
-            continue
-        found, check_list, all_variable_list = cyclic_variable_found(child, eq, check_list, all_variable_list)
-        if found:
-            return True, check_list, all_variable_list
-
-    return False, check_list, all_variable_list
+def describe_cyclic_variables(cycle_list):
+    loops = " loops" if len(cycle_list) > 1 else " loop"
+    return "Cyclic variables exist, " + str(len(cycle_list)) + loops + " found (Component,Variable): <br>" + \
+        ''.join(cycle_list)
 
 
 def is_cellml_identifier(name):
@@ -0,0 +1,618 @@
+"""
+    This file contains the set-based validation of a whole model.  Instead of walking through every item and running
+    several queries for each, as validate_cellmodel does, each rule below is a single query over all of the items of
+    one type in the model, and the errors found by all of the rules are written together at the end.  The number of
+    queries is therefore the same for a model of ten variables as for one of ten thousand.
+
+    Each rule returns a list of FoundError tuples.  The rules check the same things as the functions in
+    main.validate, and give the same hints and specification references.  They are registered by name in
+    VALIDATION_RULES, so that a chosen set of them can be run, eg: the quick 'lint' checks while a model is being
+    edited, and the time and number of queries each one takes can be recorded.
+"""
+import datetime
+import json
+import time
+from collections import namedtuple
+
+import pytz
+from django.db import connection, transaction
+from django.db.models import Count, F, Q, Case, When, Value, BooleanField
+from django.contrib.postgres.fields import JSONField
+from django.db.models.functions import Cast
+
+from main.equivalence import EquivalenceClasses
+from main.models import ItemError, CellModel, Component, Variable, Reset, Math, CompoundUnit, Unit
+from main.math_units import UnitsChecker, get_math_units_errors, get_units_of_maths
+from main.units import compare_units, are_same_units
+from main.validate import is_cellml_identifier, store_errors, delete_unused_errors, model_cyclic_variables_found, \
+    describe_cyclic_variables, MODEL_ITEM_TYPES
+
+# component_id is the component the item is in, or is, so that the errors can be gathered into each component's tree
+FoundError = namedtuple('FoundError', ['item_type', 'item_id', 'item_name', 'component_id', 'hints', 'spec', 'fields'])
+
+
+# --------------------------------- MODEL RULES ---------------------------------
+
+def check_model_name(model):
+    is_valid, hints = is_cellml_identifier(model.name)
+    if is_valid:
+        return []
+    return [FoundError('cellmodel', model.id, model.name, None,
+                       "Invalid model name <i>{n}</i>: {h}".format(n=model.name, h=hints), '4.2.1', ['name'])]
+
+
+def check_duplicate_component_names(model):
+    duplicates = Component.objects.filter(model=model).values('name').annotate(
+        name_count=Count('id')).filter(name_count__gt=1).order_by('name')
+    return [FoundError('cellmodel', model.id, model.name, None,
+                       "Component name <i>{n}</i> is duplicated {x} times in model <i>{m}</i>".format(
+                           n=d['name'], x=d['name_count'], m=model.name), '10.1.1', None)
+            for d in duplicates]
+
+
+def check_duplicate_units_names(model):
+    duplicates = CompoundUnit.objects.filter(models=model).values('name').annotate(
+        name_count=Count('id')).filter(name_count__gt=1).order_by('name')
+    return [FoundError('cellmodel', model.id, model.name, None,
+                       "Units name <i>{n}</i> is duplicated {x} times in model <i>{m}</i>".format(
+                           n=d['name'], x=d['name_count'], m=model.name), '8.1.2', None)
+            for d in duplicates]
+
+
+def check_missing_units(model):
+    # Units are matched by name, against those in the model and the built-in ones
+    available = CompoundUnit.objects.filter(Q(models=model) | Q(is_standard=True)).values('name')
+    missing = Variable.objects.filter(component__model=model, compoundunit__isnull=False).exclude(
+        compoundunit__name__in=available).order_by('id').values_list('component__name', 'name', 'compoundunit__name')
+    return [FoundError('cellmodel', model.id, model.name, None,
+                       "Variable <i>{v}</i> in component <i>{c}</i> has units <i>{u}</i> which do not exist in this "
+                       "model, and are not built-in.".format(c=c, u=u, v=v), '11.1.1.2', None)
+            for c, v, u in missing]
+
+
+# --------------------------------- COMPONENT RULES ---------------------------------
+
+def check_component_names(model):
+    found = []
+    for component_id, name in Component.objects.filter(model=model).order_by('id').values_list('id', 'name'):
+        is_valid, hints = is_cellml_identifier(name)
+        if not is_valid:
+            found.append(FoundError('component', component_id, name, component_id,
+                                    "Invalid component name <i>{n}</i>: {h}".format(n=name, h=hints), '10.1.1',
+                                    ['name']))
+    return found
+
+
+def check_duplicate_variable_names(model):
+    duplicates = Variable.objects.filter(component__model=model).values(
+        'component_id', 'component__name', 'name').annotate(name_count=Count('id')).filter(
+        name_count__gt=1).order_by('component_id', 'name')
+    return [FoundError('component', d['component_id'], d['component__name'], d['component_id'],
+                       "Variable name <i>{n}</i> is duplicated {x} times in component <i>{m}</i>".format(
+                           n=d['name'], x=d['name_count'], m=d['component__name']), '11.1.1.1', ['variables'])
+            for d in duplicates]
+
+
+# --------------------------------- VARIABLE RULES ---------------------------------
+
+def check_variable_names(model):
+    found = []
+    for variable_id, name, component_id in Variable.objects.filter(component__model=model).order_by('id').values_list(
+            'id', 'name', 'component_id'):
+        is_valid, hints = is_cellml_identifier(name)
+        if not is_valid:
+            found.append(FoundError('variable', variable_id, name, component_id,
+                                    "Invalid variable name <i>{n}</i>: {h}".format(n=name, h=hints), '11.1.1.1',
+                                    ["name"]))
+    return found
+
+
+def check_variables_without_units(model):
+    missing = Variable.objects.filter(component__model=model, compoundunit__isnull=True).order_by('id').values_list(
+        'id', 'name', 'component_id')
+    return [FoundError('variable', variable_id, name, component_id,
+                       "Variable <i>{}</i> does not have any units.".format(name), '11.1.1.2', ["compoundunit"])
+            for variable_id, name, component_id in missing]
+
+
+def check_initial_value_units(model):
+    # Units with different ids can still be the same, so those found are compared by their dimensions and scale
+    different = Variable.objects.filter(
+        component__model=model, compoundunit__isnull=False, initial_value_variable__compoundunit__isnull=False).exclude(
+        initial_value_variable__compoundunit=F('compoundunit')).order_by('id').values_list(
+        'id', 'name', 'component_id', 'compoundunit_id', 'initial_value_variable__name',
+        'initial_value_variable__compoundunit_id')
+    units = CompoundUnit.objects.in_bulk(set([row[3] for row in different] + [row[5] for row in different]))
+    return [FoundError('variable', variable_id, name, component_id,
+                       "Variable has units of <i>{u}</i> but is initialised by variable <i>{vi}</i> "
+                       "which has units of <i>{ui}</i>.".format(u=units[u].name, vi=vi, ui=units[ui].name), '11?',
+                       ["initial_value_variable"])
+            for variable_id, name, component_id, u, vi, ui in different if not are_same_units(units[u], units[ui])]
+
+
+def check_initial_value_components(model):
+    different = Variable.objects.filter(
+        component__model=model, initial_value_variable__component__isnull=False).exclude(
+        initial_value_variable__component=F('component')).order_by('id').values_list(
+        'id', 'name', 'component_id', 'component__name', 'initial_value_variable__name',
+        'initial_value_variable__component__name')
+    return [FoundError('variable', variable_id, name, component_id,
+                       "Variable <i>{v}</i> in component <i>{c}</i> is initialised by variable <i>{vi}</i> "
+                       "which is in another component <i>{ci}</i>.".format(v=name, c=c, vi=vi, ci=ci), '11.1.2.1',
+                       ['initial_value_variable', 'component'])
+            for variable_id, name, component_id, c, vi, ci in different]
+
+
+def check_initial_value_methods(model):
+    both = Variable.objects.filter(
+        component__model=model, initial_value_variable__isnull=False, initial_value_constant__isnull=False).order_by(
+        'id').values_list('id', 'name', 'component_id', 'component__name', 'initial_value_variable__name',
+                          'initial_value_constant')
+    return [FoundError('variable', variable_id, name, component_id,
+                       "Variable <i>{v}</i> in component <i>{c}</i> is initialised by variable <i>{vi}</i> "
+                       "as well as by the constant value <i>{ci}</i>. There can be only one.".format(
+                           v=name, c=c, vi=vi, ci=ci), '11.1.2.1', ['initial_value_variable', 'initial_value_constant'])
+            for variable_id, name, component_id, c, vi, ci in both]
+
+
+def check_variable_reset_orders(model):
+    duplicates = Reset.objects.filter(component__model=model, variable__isnull=False).values(
+        'variable_id', 'variable__name', 'variable__component_id', 'variable__component__name', 'order').annotate(
+        reset_count=Count('id')).filter(reset_count__gt=1).order_by('variable_id', 'order')
+    return [FoundError('variable', d['variable_id'], d['variable__name'], d['variable__component_id'],
+                       "Variable <i>{v}</i> in component <i>{c}</i> contains more than one reset with order of "
+                       "<i>{o}</i>.".format(v=d['variable__name'], c=d['variable__component__name'], o=d['order']),
+                       '??', ['reset_variables'])
+            for d in duplicates]
+
+
+# --------------------------------- RESET RULES ---------------------------------
+
+RESET_REQUIRED_FIELDS = [
+    ('order', "Reset <i>{r}</i> does not have an order set", '12.1.2'),
+    ('test_value', "Reset <i>{r}</i> does not reference a test_value", '12'),
+    ('reset_value', "Reset <i>{r}</i> does not reference a reset_value", '12'),
+    ('variable', "Reset <i>{r}</i> does not reference a variable", '12.1.1'),
+    ('test_variable', "Reset <i>{r}</i> does not reference a test_variable", '12'),
+]
+
+
+def check_reset_fields(model):
+    incomplete = Q()
+    for field, hints, spec in RESET_REQUIRED_FIELDS:
+        incomplete |= Q(**{field + '__isnull': True})
+
+    found = []
+    for reset in Reset.objects.filter(incomplete, component__model=model).order_by('id').values(
+            'id', 'name', 'component_id', *[field + '_id' if field != 'order' else field
+                                            for field, hints, spec in RESET_REQUIRED_FIELDS]):
+        for field, hints, spec in RESET_REQUIRED_FIELDS:
+            if reset[field + '_id' if field != 'order' else field] is None:
+                found.append(FoundError('reset', reset['id'], reset['name'], reset['component_id'],
+                                        hints.format(r=reset['name']), spec, [field]))
+    return found
+
+
+def check_reset_components(model):
+    found = []
+    for field, hints in [('variable', "Reset <i>{r}</i> in component <i>{c}</i> refers to a variable <i>{v}</i> "
+                                      "which is in a different component, <i>{vc}</i>"),
+                         ('test_variable', "Reset <i>{r}</i> in component <i>{c}</i> refers to a test_variable "
+                                           "<i>{v}</i> in a different component, <i>{vc}</i>")]:
+        different = Reset.objects.filter(component__model=model, **{field + '__isnull': False}).exclude(
+            **{field + '__component': F('component')}).order_by('id').values_list(
+            'id', 'name', 'component_id', 'component__name', field + '__name', field + '__component__name')
+        found.extend([FoundError('reset', reset_id, name, component_id,
+                                 hints.format(r=name, c=c, v=v, vc=vc), '12', [field])
+                      for reset_id, name, component_id, c, v, vc in different])
+    return found
+
+
+# --------------------------------- MATH RULES ---------------------------------
+
+def check_math_variables(model):
+    # The identifiers are indexed when the maths are saved, so only the names of the variables are needed here
+    maths = Math.objects.filter(component__model=model).order_by('id').values_list(
+        'id', 'name', 'component_id', 'component__name', 'identifiers')
+    names = {}
+    for component_id, name in Variable.objects.filter(component__model=model).values_list('component_id', 'name'):
+        names.setdefault(component_id, set()).add(name)
+
+    found = []
+    for math_id, name, component_id, component_name, identifiers in maths:
+        for m in sorted(set(identifiers) - names.get(component_id, set())):
+            n = "'{n}' ".format(n=name) if name != "" else ""
+            found.append(FoundError('math', math_id, name, component_id,
+                                    "Maths {n}in component '{c}' references a variable '{v}' which is not inside the "
+                                    "component.".format(n=n, c=component_name, v=m), '14.1.3', ["variables"]))
+    return found
+
+
+def check_math_units(model):
+    # The dimensions of all of the model's units are worked out once, and shared by all of its maths
+    names, variables = get_units_of_maths(model.id)
+
+    found = []
+    for math_id, name, component_id, component_name, math_ml in Math.objects.filter(
+            component__model=model).order_by('id').values_list('id', 'name', 'component_id', 'component__name',
+                                                               'math_ml'):
+        checker = UnitsChecker(variables.get(component_id, {}), names)
+        for err in get_math_units_errors(name, component_name, checker.check(math_ml)):
+            found.append(FoundError('math', math_id, name, component_id, err.hints, err.spec, err.fields))
+    return found
+
+
+# --------------------------------- UNITS RULES ---------------------------------
+
+def check_compoundunit_names(model):
+    found = []
+    for cu_id, name in CompoundUnit.objects.filter(models=model, is_standard=False).order_by('id').values_list(
+            'id', 'name'):
+        is_valid, hints = is_cellml_identifier(name)
+        if not is_valid:
+            found.append(FoundError('compoundunit', cu_id, name, None,
+                                    "Invalid compound_units name <i>{n}</i>: {h}".format(n=name, h=hints), '8.1.1',
+                                    ['name']))
+    return found
+
+
+def check_built_in_units_names(model):
+    clashes = CompoundUnit.objects.filter(models=model, is_standard=False, name__in=CompoundUnit.objects.filter(
+        is_standard=True).values('name')).order_by('id').values_list('id', 'name')
+    return [FoundError('compoundunit', cu_id, name, None,
+                       "The name cannot be the same as a built-in units name, <i>{}</i>".format(name), '8.1.3',
+                       ['name'])
+            for cu_id, name in clashes]
+
+
+def check_blank_units(model):
+    # The error belongs to the compound unit, as the unit elements cannot be displayed on their own
+    blank = Unit.objects.filter(parent_cu__models=model, parent_cu__is_standard=False, child_cu__isnull=True).order_by(
+        'id').values_list('parent_cu_id', 'parent_cu__name')
+    return [FoundError('compoundunit', cu_id, name, None,
+                       "Unit in units <i>{p}</i> points to a blank unit".format(p=name), '9.1.1', ['child_cu'])
+            for cu_id, name in blank]
+
+
+# --------------------------------- CONNECTION RULES ---------------------------------
+
+def check_equivalent_variables(model):
+    through = Variable.equivalent_variables.through
+    found = []
+
+    # Each link is stored in both directions, so only one of them is reported
+    same = through.objects.filter(from_variable__component__model=model,
+                                  from_variable__component=F('to_variable__component'),
+                                  from_variable_id__lt=F('to_variable_id')).order_by('id').values_list(
+        'from_variable__component_id', 'from_variable__component__name', 'from_variable__name', 'to_variable__name')
+    for component_id, c, v1, v2 in same:
+        found.append(FoundError('component', component_id, c, component_id,
+                                "Variable <i>{v1}</i> and equivalent variable <i>{v2}</i> are both in the same "
+                                "component <i>{c}</i>".format(v1=v1, v2=v2, c=c), '17.1.2', ['component']))
+
+    orphans = through.objects.filter(from_variable__component__model=model,
+                                     to_variable__component__isnull=True).order_by('id').values_list(
+        'from_variable__component_id', 'from_variable__component__name', 'from_variable__name', 'to_variable_id',
+        'to_variable__name')
+    for component_id, c, v, ev_id, ev in orphans:
+        hints = "Variable <i>{ev}</i> is equivalent to variable <i>{v}</i> in component <i>{c}</i> but does not " \
+                "have a parent component".format(ev=ev, v=v, c=c)
+        found.append(FoundError('variable', ev_id, ev, None, hints, '17.?', ['component']))
+        found.append(FoundError('component', component_id, c, component_id, hints, '17.?', ['component']))
+
+    return found
+
+
+def check_equivalent_variable_units(model):
+    different = Variable.equivalent_variables.through.objects.filter(
+        from_variable__component__model=model, from_variable__compoundunit__isnull=False,
+        to_variable__component__isnull=False, to_variable__compoundunit__isnull=False).exclude(
+        from_variable__compoundunit=F('to_variable__compoundunit')).order_by('id').values_list(
+        'from_variable__component_id', 'from_variable__component__name', 'from_variable__name',
+        'from_variable__compoundunit_id', 'to_variable__component__name', 'to_variable__name',
+        'to_variable__compoundunit_id')
+    units = CompoundUnit.objects.in_bulk(set([row[3] for row in different] + [row[6] for row in different]))
+
+    found = []
+    for component_id, c1, v1, u1, c2, v2, u2 in different:
+        # Units which only differ in scale are allowed, see validate_equivalent_variable
+        comparison = compare_units(units[u1], units[u2])
+        if comparison is None or comparison[0]:
+            continue
+        hints = "Variable <i>{v1}</i> in component <i>{c1}</i> has units <i>{u1}</i> which are not equivalent " \
+                "to the units <i>{u2}</i> of its equivalent variable <i>{v2}</i> in component <i>{c2}</i>"
+        found.append(FoundError('component', component_id, c1, component_id,
+                                hints.format(v1=v1, c1=c1, u1=units[u1].name, v2=v2, c2=c2, u2=units[u2].name),
+                                '19.10.6', ['component']))
+    return found
+
+
+def check_cyclic_variables(model):
+    cycle_list = model_cyclic_variables_found(model)
+    if not cycle_list:
+        return []
+    return [FoundError('cellmodel', model.id, model.name, None, describe_cyclic_variables(cycle_list), '19.10.5',
+                       None)]
+
+
+def check_equivalent_reset_orders(model):
+    # Resets on variables which are equivalent to one another must have different orders
+    classes = EquivalenceClasses()
+    linked = set()
+    for variable_1, variable_2 in Variable.equivalent_variables.through.objects.filter(
+            from_variable__component__model=model).values_list('from_variable_id', 'to_variable_id'):
+        classes.union(variable_1, variable_2)
+        linked.update([variable_1, variable_2])
+
+    resets = {}
+    for variable_id, v, c, order in Reset.objects.filter(
+            component__model=model, variable_id__in=linked).order_by('id').values_list(
+            'variable_id', 'variable__name', 'variable__component__name', 'order'):
+        resets.setdefault((classes.find(variable_id), order), []).append((v, c))
+
+    found = []
+    for (root, order), variables in resets.items():
+        if len(variables) > 1:
+            hints = "Non-unique reset order of {o} found within equivalent variable set: ".format(o=order)
+            for v, c in variables:
+                hints += "<br>  - variable <i>{v}</i> in component <i>{c}</i> has reset with order {o}".format(
+                    v=v, c=c, o=order)
+            found.append(FoundError('cellmodel', model.id, model.name, None, hints, '12.1.1.2', None))
+    return found
+
+
+# --------------------------------- RULE REGISTRY ---------------------------------
+
+# Each rule has a name, the function which runs it, and the specification references of the errors it reports
+ValidationRule = namedtuple('ValidationRule', ['name', 'check', 'specs'])
+
+# The time taken by one rule, and the number of queries it made, see find_model_errors
+RuleTiming = namedtuple('RuleTiming', ['name', 'seconds', 'queries', 'error_count'])
+
+VALIDATION_RULES = [
+    ValidationRule('model_name', check_model_name, ['4.2.1']),
+    ValidationRule('duplicate_component_names', check_duplicate_component_names, ['10.1.1']),
+    ValidationRule('duplicate_units_names', check_duplicate_units_names, ['8.1.2']),
+    ValidationRule('missing_units', check_missing_units, ['11.1.1.2']),
+    ValidationRule('component_names', check_component_names, ['10.1.1']),
+    ValidationRule('duplicate_variable_names', check_duplicate_variable_names, ['11.1.1.1']),
+    ValidationRule('variable_names', check_variable_names, ['11.1.1.1']),
+    ValidationRule('variables_without_units', check_variables_without_units, ['11.1.1.2']),
+    ValidationRule('initial_value_units', check_initial_value_units, ['11?']),
+    ValidationRule('initial_value_components', check_initial_value_components, ['11.1.2.1']),
+    ValidationRule('initial_value_methods', check_initial_value_methods, ['11.1.2.1']),
+    ValidationRule('variable_reset_orders', check_variable_reset_orders, ['??']),
+    ValidationRule('reset_fields', check_reset_fields, sorted(set([spec for _, _, spec in RESET_REQUIRED_FIELDS]))),
+    ValidationRule('reset_components', check_reset_components, ['12']),
+    ValidationRule('math_variables', check_math_variables, ['14.1.3']),
+    ValidationRule('math_units', check_math_units, ['14']),
+    ValidationRule('compoundunit_names', check_compoundunit_names, ['8.1.1']),
+    ValidationRule('built_in_units_names', check_built_in_units_names, ['8.1.3']),
+    ValidationRule('blank_units', check_blank_units, ['9.1.1']),
+    ValidationRule('equivalent_variables', check_equivalent_variables, ['17.1.2']),
+    ValidationRule('equivalent_variable_units', check_equivalent_variable_units, ['19.10.6']),
+    ValidationRule('cyclic_variables', check_cyclic_variables, ['19.10.5']),
+    ValidationRule('equivalent_reset_orders', check_equivalent_reset_orders, ['12.1.1.2']),
+]
+
+# The sets of rules which can be chosen by name.  The 'lint' rules only look at the items one at a time or count
+# names, and leave out the comparisons of units, the maths and the equivalent variable networks
+RULE_SETS = {
+    'full': [rule.name for rule in VALIDATION_RULES],
+    'lint': ['model_name', 'duplicate_component_names', 'duplicate_units_names', 'missing_units', 'component_names',
+             'duplicate_variable_names', 'variable_names', 'variables_without_units', 'initial_value_components',
+             'initial_value_methods', 'reset_fields', 'reset_components', 'math_variables', 'compoundunit_names',
+             'built_in_units_names', 'blank_units'],
+}
+
+
+def select_rules(rule_set=None):
+    """
+    :param rule_set: (optional) name of one of the RULE_SETS, or a list of rule names, defaults to all of the rules
+    :return: list of ValidationRule tuples, in the order they are registered
+    """
+    if rule_set is None:
+        return list(VALIDATION_RULES)
+    names = set(RULE_SETS[rule_set] if isinstance(rule_set, str) else rule_set)
+    unknown = names - set([rule.name for rule in VALIDATION_RULES])
+    if unknown:
+        raise KeyError("Unknown validation rules: {}".format(", ".join(sorted(unknown))))
+
+    # Errors are replaced by their specification references, so rules which share one are always run together
+    selected = []
+    while len(selected) != len(names):
+        selected = [rule for rule in VALIDATION_RULES if rule.name in names]
+        specs = set([spec for rule in selected for spec in rule.specs])
+        names |= set([rule.name for rule in VALIDATION_RULES if specs.intersection(rule.specs)])
+    return selected
+
+
+# --------------------------------- WRITING THE RESULTS ---------------------------------
+
+def draw_found_error_tree(found):
+    # The same table as draw_error_tree, built from the errors found instead of by reading every item again
+    tree_html = '<table class ="display table" id="table-info" ><thead><tr><th>Specification reference</th>' \
+                '<th>Message</th><th>Go to item</th></tr></thead><tbody>'
+    for err in found:
+        tree_html += "<tr>"
+        tree_html += "<td>" + err.spec + "</td>"
+        tree_html += "<td>" + err.hints + "</td>"
+        tree_html += "<td><a href = '/display/" + err.item_type + "/" + str(err.item_id) + "'>"
+        tree_html += "Open <i>" + err.item_name + "</i></a></td></tr>"
+    tree_html += '</tbody></table>'
+    return tree_html
+
+
+def leaf_error_tree(error_count):
+    # The tree of an item without children, as an expression for a queryset update
+    return Cast(Value(json.dumps({'tree_html': draw_found_error_tree([]), 'error_count': error_count})), JSONField())
+
+
+def replace_model_errors(model, found, specs=None):
+    """
+    Removes the errors of every item in the model, and writes the new ones, with a fixed number of queries.
+    :param model: CellModel instance
+    :param found: list of FoundError tuples
+    :param specs: (optional) list of specification references, to remove only the errors with these references
+    """
+    unlinked = set()
+    new_errors = [ItemError(hints=err.hints, spec=err.spec, fields=err.fields) for err in found]
+    # The old links are only removed along with the new ones being written, so the model is never left without errors
+    with transaction.atomic():
+        for item_type, item_class, scope in MODEL_ITEM_TYPES:
+            links = item_class.errors.through.objects.filter(**{
+                item_type + '_id__in': item_class.objects.filter(scope(model)).values('id')})
+            if specs is not None:
+                links = links.filter(itemerror__spec__in=specs)
+            unlinked |= set(links.values_list('itemerror_id', flat=True))
+            links.delete()
+
+        stored = store_errors(new_errors)
+
+        for item_type, item_class, scope in MODEL_ITEM_TYPES:
+            through = item_class.errors.through
+            through.objects.bulk_create([through(**{item_type + '_id': err.item_id,
+                                                    'itemerror_id': stored[error.digest].id})
+                                         for err, error in zip(found, new_errors) if err.item_type == item_type],
+                                        ignore_conflicts=True)
+    delete_unused_errors(unlinked)
+
+
+def find_stored_errors(model, specs):
+    """
+    Reads the errors which the model's items already have, except for those with the given references.
+    :param model: CellModel instance
+    :param specs: list of specification references to leave out
+    :return: list of FoundError tuples
+    """
+    # The component whose tree each type of item's errors belong in, see FoundError
+    component_fields = {'cellmodel': None, 'component': 'id', 'compoundunit': None, 'unit': None}
+    found = []
+    for item_type, item_class, scope in MODEL_ITEM_TYPES:
+        component_field = component_fields.get(item_type, 'component_id')
+        fields = [item_type + '_id', item_type + '__name', 'itemerror__hints', 'itemerror__spec', 'itemerror__fields']
+        if component_field is not None:
+            fields.append(item_type + '__' + component_field)
+        for row in item_class.errors.through.objects.filter(**{
+                item_type + '_id__in': item_class.objects.filter(scope(model)).values('id')}).exclude(
+                itemerror__spec__in=specs).order_by(item_type + '_id', 'itemerror_id').values_list(*fields):
+            found.append(FoundError(item_type, row[0], row[1] or "", row[5] if component_field is not None else None,
+                                    row[2], row[3] or "", row[4]))
+    return found
+
+
+def update_model_validity(model, found):
+    """
+    Sets is_valid, last_checked and error_tree on every item in the model, with one query for each type of item.
+    Items are updated through their querysets so that the validation does not count as a change to the model.
+    :param model: CellModel instance
+    :param found: list of FoundError tuples
+    :return: True if the model is valid
+    """
+    now = datetime.datetime.now(pytz.utc)
+    own_errors = {}
+    for err in found:
+        own_errors.setdefault((err.item_type, err.item_id), []).append(err)
+
+    # A component is valid when nothing inside it, or inside any of the components it encapsulates, has errors
+    parents = dict(Component.objects.filter(model=model).values_list('id', 'parent_component_id'))
+    component_errors = {component_id: [] for component_id in parents}
+    for err in found:
+        component_id = err.component_id
+        if err.item_type == 'component':
+            component_id = parents.get(component_id)
+        visited = set()
+        while component_id is not None and component_id not in visited:
+            visited.add(component_id)
+            component_errors.setdefault(component_id, []).append(err)
+            component_id = parents.get(component_id)
+
+    for item_type, item_class, scope in MODEL_ITEM_TYPES:
+        if item_type in ['cellmodel', 'component']:
+            continue
+        # Items without children have an empty tree, and a count of their own errors
+        counts = {}
+        for (error_type, item_id), errors in own_errors.items():
+            if error_type == item_type:
+                counts.setdefault(len(errors), []).append(item_id)
+        invalid = [item_id for ids in counts.values() for item_id in ids]
+        if item_type == 'unit':
+            invalid = list(Unit.objects.filter(scope(model), child_cu__isnull=True).values_list('id', flat=True))
+
+        item_class.objects.filter(scope(model)).update(
+            is_valid=Case(When(id__in=invalid, then=Value(False)), default=Value(True), output_field=BooleanField()),
+            last_checked=now,
+            is_dirty=False,
+            error_tree=Case(*[When(id__in=ids, then=leaf_error_tree(count)) for count, ids in counts.items()],
+                            default=leaf_error_tree(0), output_field=JSONField()),
+        )
+
+    components = []
+    for component_id, errors in component_errors.items():
+        own = len(own_errors.get(('component', component_id), []))
+        components.append(Component(id=component_id, is_valid=not errors and not own, last_checked=now,
+                                    is_dirty=False, error_tree={'tree_html': draw_found_error_tree(errors),
+                                                'error_count': len(errors) + own}))
+    Component.objects.bulk_update(components, ['is_valid', 'last_checked', 'is_dirty', 'error_tree'])
+
+    model.is_valid = not found
+    model.last_checked = now
+    model.error_tree = {'tree_html': draw_found_error_tree([err for err in found if err.item_type != 'cellmodel']),
+                        'error_count': len(found)}
+    model.is_dirty = False
+    CellModel.objects.filter(id=model.id).update(is_valid=model.is_valid, last_checked=model.last_checked,
+                                                 error_tree=model.error_tree, is_dirty=False)
+    return model.is_valid
+
+
+def record_queries(queries):
+    # An execute wrapper which adds the SQL of every query made through the connection to the list
+    def wrapper(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+    return wrapper
+
+
+def find_model_errors(model, rules=None, timings=None):
+    """
+    :param model: CellModel instance
+    :param rules: (optional) list of ValidationRule tuples to run, defaults to all of them
+    :param timings: (optional) list to which a RuleTiming is added for each rule
+    :return: list of FoundError tuples
+    """
+    found = []
+    for rule in rules if rules is not None else VALIDATION_RULES:
+        queries = []
+        started = time.perf_counter()
+        with connection.execute_wrapper(record_queries(queries)):
+            rule_found = rule.check(model)
+        if timings is not None:
+            timings.append(RuleTiming(rule.name, time.perf_counter() - started, len(queries), len(rule_found)))
+        found.extend(rule_found)
+    return found
+
+
+def validate_cellmodel_in_bulk(model, rule_set=None, timings=None):
+    """
+    Validates a model and everything in it, replacing all of their errors.  When only some of the rules are run, the
+    errors found by the others before are kept, and count towards the validity of the items.
+    :param model: CellModel instance
+    :param rule_set: (optional) name of one of the RULE_SETS, or a list of rule names, see select_rules
+    :param timings: (optional) list to which a RuleTiming is added for each rule
+    :return: True if the model is valid
+    """
+    rules = select_rules(rule_set)
+    found = find_model_errors(model, rules, timings)
+    if len(rules) == len(VALIDATION_RULES):
+        replace_model_errors(model, found)
+        return update_model_validity(model, found)
+
+    specs = sorted(set([spec for rule in rules for spec in rule.specs]))
+    kept = find_stored_errors(model, specs)
+    replace_model_errors(model, found, specs)
+    return update_model_validity(model, kept + found)
+
+
+VALIDATE_BULK_DICT = {
+    'cellmodel': validate_cellmodel_in_bulk,
+}
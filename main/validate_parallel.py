@@ -0,0 +1,70 @@
+"""
+    This file contains the parallel validation of a model, run by the validate_models command rather than by web
+    requests.  Each top-level component, with the components it encapsulates, is validated by validate_component in a
+    pool of worker processes, each with its own database connection.  Once all of them have finished, the model's own
+    checks and those of its connections are run by the calling process as usual, so the results are the same as for
+    validate_cellmodel.
+"""
+import datetime
+from multiprocessing import Pool
+
+import pytz
+from django.db import connections
+
+from main.containment import update_containment
+from main.functions import draw_error_tree
+from main.models import Component, VALIDATION_FIELDS
+from main.validate import validate_component, validate_compoundunit, validate_cellmodel_locally, \
+    validate_connections, delete_unused_errors, get_model_error_ids
+
+
+def validate_component_in_worker(component_id):
+    """
+    Validates one component, and everything in it, in a worker process.
+    :param component_id: id of a Component
+    :return: tuple of (component id, True if the component is valid)
+    """
+    try:
+        return component_id, validate_component(Component.objects.get(id=component_id))
+    finally:
+        # The connection was opened by this worker, and is not needed once it has finished
+        connections.close_all()
+
+
+def validate_cellmodel_in_parallel(model, processes=None):
+    """
+    :param model: CellModel instance
+    :param processes: (optional) number of worker processes, defaults to the number of cores
+    :return: True if the model is valid
+    """
+    error_ids = get_model_error_ids(model)
+    is_valid = validate_cellmodel_locally(model)
+
+    # Components encapsulated by another in the model are validated along with it, by the same worker
+    top_level = list(model.all_components.exclude(parent_component__model=model).order_by('id').values_list(
+        'id', flat=True))
+
+    # The workers read the errors of their components through the closure table, which is brought up to date first
+    update_containment(model)
+
+    # Each worker opens a connection of its own, and must not inherit the one open in this process
+    connections.close_all()
+    with Pool(processes=processes) as pool:
+        for component_id, component_is_valid in pool.imap_unordered(validate_component_in_worker, top_level):
+            is_valid = component_is_valid and is_valid
+
+    for compoundunit in model.compoundunits.all():
+        is_valid = validate_compoundunit(compoundunit) and is_valid
+
+    # Validate connections and equivalent variable networks in the model
+    is_valid = validate_connections(model) and is_valid
+    delete_unused_errors(error_ids)
+
+    error_tree, error_count = draw_error_tree(model)
+    error_count += model.errors.count()
+    model.error_tree = {'tree_html': error_tree, 'error_count': error_count}
+    model.is_valid = is_valid
+    model.last_checked = datetime.datetime.now(pytz.utc)
+    model.save(update_fields=VALIDATION_FIELDS)
+
+    return is_valid
@@ -0,0 +1,89 @@
+"""
+    This file contains the validation of an item and everything inside it as a stream of server-sent events, so that
+    the checklist on the validity tab is filled from one connection instead of an ajax_validate request for each item.
+
+    Each item gets the same shallow validation and is saved in the same way as by ajax_validate, and one 'message'
+    event is sent for it as soon as it has been checked.  A 'done' event with the totals ends the stream.
+"""
+import datetime
+import json
+
+import pytz
+
+from main.containment import get_subtree_items, CONTAINED_TYPES
+from main.functions import get_local_error_messages, draw_object_child_tree, build_object_child_list
+from main.models import CellModel, Unit, VALIDATION_FIELDS
+from main.validate import VALIDATE_SHALLOW_DICT
+
+# The number of items of one type read from the database at once
+STREAM_CHUNK_SIZE = 200
+
+ITEM_CLASSES = dict([('cellmodel', CellModel), ('unit', Unit)] + CONTAINED_TYPES)
+
+
+def format_event(data, event=None):
+    # One server-sent event, see https://html.spec.whatwg.org/multipage/server-sent-events.html
+    text = "event: {}\n".format(event) if event is not None else ""
+    return text + "data: {}\n\n".format(json.dumps(data))
+
+
+def list_subtree_items(item):
+    """
+    :param item: any item which can be validated
+    :return: list of (item type, item id) tuples for the item and everything inside it
+    """
+    listed = get_subtree_items(item) if type(item).__name__.lower() in ['cellmodel', 'component'] else None
+    if listed is not None:
+        return listed
+    # Items outside any model are not in a closure table, so the same list as their checklist is used
+    return [(type(item).__name__.lower(), item.id)] + sorted(
+        [(child_type, child.id) for child, child_type in build_object_child_list(item)])
+
+
+def validate_item(item_type, item, is_root):
+    """
+    Validates one item as ajax_validate does, and saves the result.
+    :return: dictionary sent as the data of the item's event
+    """
+    is_valid = VALIDATE_SHALLOW_DICT[item_type](item)
+    item.is_valid = is_valid
+    item.last_checked = datetime.datetime.now(pytz.utc)
+
+    error_tree = get_local_error_messages(item)
+    item.error_tree = {'tree_html': error_tree}
+    # The checklist of the item being displayed is drawn again, those of the items inside it when they are displayed
+    if is_root:
+        item.child_list = draw_object_child_tree(item)
+    item.save(update_fields=VALIDATION_FIELDS)
+
+    return {'item_type': item_type, 'item_id': item.id, 'is_valid': is_valid, 'html': error_tree}
+
+
+def stream_validation_events(item, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    :param item: any item which can be validated
+    :param chunk_size: (optional) number of items of one type read from the database at once
+    :return: generator of server-sent events, one for each item validated and a final 'done' event
+    """
+    listed = list_subtree_items(item)
+    root = listed[0]
+    checked = 0
+    invalid = 0
+    for first in range(0, len(listed), chunk_size):
+        chunk = listed[first:first + chunk_size]
+        loaded = {}
+        for item_type in set([x[0] for x in chunk]):
+            ids = [item_id for chunk_type, item_id in chunk if chunk_type == item_type]
+            for item_id, instance in ITEM_CLASSES[item_type].objects.in_bulk(ids).items():
+                loaded[(item_type, item_id)] = instance
+
+        for key in chunk:
+            if key not in loaded:
+                # Deleted since the list was made
+                continue
+            data = validate_item(key[0], loaded[key], key == root)
+            checked += 1
+            invalid += 0 if data['is_valid'] else 1
+            yield format_event(data)
+
+    yield format_event({'checked': checked, 'invalid': invalid}, event='done')
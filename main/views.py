@@ -1,4 +1,5 @@
 import datetime
+import re
 
 import libcellml
 import pytz
@@ -11,20 +12,28 @@ from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.db.models import ForeignKey, ManyToManyField, ManyToOneRel, ManyToManyRel, Q
 from django.forms import modelform_factory, CheckboxSelectMultiple, RadioSelect
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse, Http404
 from django.shortcuts import render, redirect
 from django.urls import reverse
+from django.views.decorators.http import condition
 
+from main.codegen import get_python_code
 from main.copy import copy_and_link_compoundunit, copy_reset, copy_and_link_model, \
     copy_and_link_component, copy_and_link_variable
 from main.defines import MENU_OPTIONS, DISPLAY_DICT, LOCAL_DICT, FOREIGN_DICT
+from main.export import stream_cellml_models
 from main.forms import DownstreamLinkForm, UnlinkForm, LoginForm, RegistrationForm, CopyForm, DeleteForm, DeleteUnitForm
-from main.functions import load_model, get_edit_locals_form, get_item_upstream_attributes, copy_item, \
-    delete_item, convert_to_cellml_model, get_item_downstream_attributes, draw_error_tree, draw_object_tree, \
+from main.functions import get_edit_locals_form, get_item_upstream_attributes, copy_item, \
+    delete_item, get_cellml_text, get_item_downstream_attributes, draw_error_tree, draw_object_tree, \
     add_child_errors, draw_error_branch, draw_object_child_tree, get_local_error_messages, get_edit_form, \
-    get_breadcrumbs
-from main.models import Math, TemporaryStorage, CellModel, CompoundUnit, Person, Unit, Prefix, Reset, Component
+    get_breadcrumbs, build_tree_from_cellml_model, get_tree_nodes
+from main.models import Math, TemporaryStorage, CellModel, CompoundUnit, Person, Unit, Prefix, Reset, Component, \
+    UploadJob, VALIDATION_FIELDS
 from main.validate import VALIDATE_SHALLOW_DICT, VALIDATE_DEEP_DICT
+from main.revalidate import VALIDATE_INCREMENTAL_DICT
+from main.validate_bulk import VALIDATE_BULK_DICT, RULE_SETS
+from main.validate_stream import stream_validation_events
+from main.writer import stream_cellml_model
 
 
 def test(request):
@@ -985,15 +994,62 @@ def display_storage(request, item_id):
         messages.error(request, "{}: {}".format(type(e).__name__, e.args))
         return redirect('main:error')
 
+    # The preview is built the first time the file is viewed, and only its top level is sent with the page
+    root = item.tree_nodes.filter(node=0).first()
+    if root is None:
+        try:
+            f = open(item.file.path, "r")
+            cellml_text = f.read()
+        except Exception as e:
+            messages.error(request, "Could not read the file at '{}'".format(item.file.path))
+            messages.error(request, "{t}: {a}".format(t=type(e).__name__, a=e.args))
+            return redirect('main:error')
+
+        parser = libcellml.Parser()
+        in_model = parser.parseModel(cellml_text)
+        for e in range(0, parser.errorCount()):
+            messages.error(request, parser.error(e).description())
+        build_tree_from_cellml_model(item, in_model)
+        root = item.tree_nodes.get(node=0)
+
     context = {
         'item': item,
         'item_type': 'temporarystorage',
+        'tree_root': root.text,
+        'tree_nodes': get_tree_nodes(item, 0),
         'menu': MENU_OPTIONS['display'],
         'can_edit': request.user.person == item.owner
     }
     return render(request, 'main/display_storage.html', context)
 
 
+@login_required
+def ajax_storage_tree(request, item_id, node):
+    try:
+        item = TemporaryStorage.objects.get(id=item_id)
+    except Exception as e:
+        data = {
+            'status': 404,
+            'message': "Couldn't find TemporaryStorage object with id of '{}'".format(item_id),
+        }
+        return JsonResponse(data)
+
+    # Only the children of the node are read, not the whole tree
+    nodes = get_tree_nodes(item, node)
+    if not nodes and not item.tree_nodes.filter(node=node).exists():
+        data = {
+            'status': 404,
+            'message': "Couldn't find node '{n}' in the preview of '{f}'".format(n=node, f=item.file.name),
+        }
+        return JsonResponse(data)
+
+    data = {
+        'status': 200,
+        'nodes': nodes,
+    }
+    return JsonResponse(data)
+
+
 @login_required
 def display_compoundunit(request, item_id):
     item = None
@@ -1137,7 +1193,7 @@ def browse(request, item_type):
 
 # -------------------- UPLOAD VIEWS --------------------
 @login_required
-def upload(request):
+def upload(request, item_id=None):
     try:
         person = request.user.person
     except Exception as e:
@@ -1145,6 +1201,19 @@ def upload(request):
         messages.error(request, "{}: {}".format(type(e).__name__, e.args))
         return redirect('main:error')
 
+    # With a model id the file updates that model in place instead of creating a new one
+    target = None
+    if item_id is not None:
+        try:
+            target = CellModel.objects.get(id=item_id)
+        except Exception as e:
+            messages.error(request, "Couldn't find CellModel object with id of '{}'".format(item_id))
+            messages.error(request, "{}: {}".format(type(e).__name__, e.args))
+            return redirect('main:error')
+
+        if not check_ownership(request, target):
+            return redirect('main:error')
+
     # Set up import form for cellml text input:
     form_type = modelform_factory(TemporaryStorage, exclude=('tree', 'owner'))
 
@@ -1155,40 +1224,16 @@ def upload(request):
             storage.owner = request.user.person
             storage.save()
 
-            try:
-                f = open(storage.file.path, "r")
-                cellml_text = f.read()
-            except Exception as e:
-                storage.delete()
-                messages.error(request, "Could not read the file at '{}'".format(storage.file.path))
-                messages.error(request, "{}: {}".format(type(e).__name__, e.args))
-                return redirect('main:error')
-
-            # Parse the model using libcellml:
-            parser = libcellml.Parser()
-            in_model = parser.parseModel(cellml_text)
-            if parser.errorCount() > 0:
-                storage.delete()
-                for e in range(0, parser.errorCount()):
-                    err = parser.error(e)
-                    messages.error(request,
-                                   "{}".format(err.description()))
-                return redirect('main:error')
+            # The file is parsed and loaded by the process_uploads worker, so the request can return straight away
+            job = UploadJob(
+                storage=storage,
+                file_name=storage.file.name,
+                owner=person,
+                target=target,
+            )
+            job.save()
 
-            # Load into database
-            model = load_model(in_model, person)
-
-            model.uploaded_from = storage.file.name
-            model.owner = request.user.person
-            model.imported_from = None
-            model.privacy = 'private'
-            model.child_list = draw_object_child_tree(model)
-            model.save()
-
-            # Delete the TemporaryStorage object, also deletes the uploaded file
-            storage.delete()
-
-            return redirect(reverse('main:display', kwargs={'item_type': 'cellmodel', 'item_id': model.id}))
+            return redirect(reverse('main:upload_status', kwargs={'job_id': job.id}))
 
         return redirect(reverse('main:error', kwargs={'message': "Did not receive POST request"}))
 
@@ -1198,15 +1243,32 @@ def upload(request):
     form.helper = FormHelper()
     form.helper.form_method = 'post'
     form.helper.add_input(Submit('submit', "Save"))
-    form.helper.form_action = reverse('main:upload')
+    form.helper.form_action = reverse('main:upload') if target is None \
+        else reverse('main:update_from_file', kwargs={'item_id': target.id})
 
     context = {
         'form': form,
+        'target': target,
         'menu': MENU_OPTIONS['upload']
     }
     return render(request, 'main/upload.html', context)
 
 
+@login_required
+def upload_status(request, job_id):
+    # Only the person who uploaded the file can follow its job, anyone else is told that it does not exist
+    try:
+        job = UploadJob.objects.get(id=job_id, owner__user=request.user)
+    except UploadJob.DoesNotExist:
+        raise Http404("Couldn't find UploadJob object with id of '{}'".format(job_id))
+
+    context = {
+        'job': job,
+        'menu': MENU_OPTIONS['upload']
+    }
+    return render(request, 'main/upload_status.html', context)
+
+
 # @login_required
 # def upload_check(request, item_id):
 #     # This view makes a scratchpad from the uploaded file, and allows users to select which parts to save
@@ -1316,8 +1378,15 @@ def error(request):
 
 # ------------------------- EXPORT VIEWS ----------------------------
 
+def get_model_etag(request, item_id):
+    # The revision changes whenever anything in the model does, so an unchanged revision means an unchanged export
+    revision = CellModel.objects.filter(id=item_id).values_list('revision', flat=True).first()
+    return None if revision is None else "{i}-{r}".format(i=item_id, r=revision)
+
+
 def convert_model(request, item_id):
-    # want to make sure that we can write valid cellml from a linked model
+    # want to make sure that we can write valid cellml from a linked model.  The page also shows the user and any
+    # messages, so only the CellML text is kept between requests, not the page
     model = None
 
     try:
@@ -1334,9 +1403,8 @@ def convert_model(request, item_id):
         messages.error(request, "{}: {}".format(type(e).__name__, e.args))
         return redirect('main:error')
 
-    cellml_model = convert_to_cellml_model(model)
-    printer = libcellml.Printer()
-    cellml_text = printer.printModel(cellml_model)
+    # Printed once per revision of the model
+    cellml_text = get_cellml_text(model)
 
     #
     # temp_path = '{}/{}'.format(settings.MEDIA_ROOT, 'temp')
@@ -1360,6 +1428,81 @@ def convert_model(request, item_id):
     return render(request, 'main/export.html', context)
 
 
+@condition(etag_func=get_model_etag)
+def download_model(request, item_id):
+    try:
+        person = request.user.person
+    except Exception as e:
+        messages.error(request, "Couldn't find a registered user.  Please login.")
+        messages.error(request, "{}: {}".format(type(e).__name__, e.args))
+        return redirect('main:error')
+
+    try:
+        model = CellModel.objects.get(id=item_id)
+    except Exception as e:
+        messages.error(request, "Could not find model with id={id}.".format(id=item_id))
+        messages.error(request, "{}: {}".format(type(e).__name__, e.args))
+        return redirect('main:error')
+
+    # Written straight from the database as the response is sent, without building a libCellML model first
+    response = StreamingHttpResponse(stream_cellml_model(model), content_type='application/xml')
+    response['Content-Disposition'] = 'attachment; filename={n}.cellml'.format(n=re.sub(r'[^\w]+', '_', model.name))
+    return response
+
+
+@condition(etag_func=get_model_etag)
+def convert_model_python(request, item_id):
+    try:
+        person = request.user.person
+    except Exception as e:
+        messages.error(request, "Couldn't find a registered user.  Please login.")
+        messages.error(request, "{}: {}".format(type(e).__name__, e.args))
+        return redirect('main:error')
+
+    try:
+        model = CellModel.objects.get(id=item_id)
+    except Exception as e:
+        messages.error(request, "Could not find model with id={id}.".format(id=item_id))
+        messages.error(request, "{}: {}".format(type(e).__name__, e.args))
+        return redirect('main:error')
+
+    # Generated once per revision of the model
+    try:
+        python_code = get_python_code(model)
+    except Exception as e:
+        messages.error(request, "Could not generate Python code for the model '{}'.".format(model.name))
+        messages.error(request, "{}: {}".format(type(e).__name__, e.args))
+        return redirect('main:error')
+
+    response = HttpResponse(python_code, content_type='text/x-python')
+    response['Content-Disposition'] = 'attachment; filename={n}.py'.format(n=re.sub(r'[^\w]+', '_', model.name))
+    return response
+
+
+@login_required
+def export_models(request, scope):
+    try:
+        person = request.user.person
+    except Exception as e:
+        messages.error(request, "Couldn't find a registered user.  Please login.")
+        messages.error(request, "{}: {}".format(type(e).__name__, e.args))
+        return redirect('main:error')
+
+    if scope == 'mine':
+        models = CellModel.objects.filter(owner=person)
+    elif scope == 'public':
+        models = CellModel.objects.filter(privacy='public')
+    else:
+        messages.error(request, "Can only export 'mine' or 'public' models, not '{}'".format(scope))
+        return redirect('main:error')
+
+    # The archive is written as the models are printed, so it is never held in memory as a whole.  They are printed
+    # in this process: the pool of printing processes is only for the export_models command
+    response = StreamingHttpResponse(stream_cellml_models(models), content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename=cellml_models_{s}.zip'.format(s=scope)
+    return response
+
+
 # TODO write to file view
 
 # ------------------------------------ PERMISSIONS & PRIVACY ---------------------------------
@@ -1464,6 +1607,13 @@ def show_errors(request, item_type, item_id):
 # ------------------------------- AJAX FUNCTIONS ----------------------------------------
 
 
+# Other ways of validating some types of item, chosen by the 'mode' parameter of the validate view.  Validating in
+# parallel forks a pool of processes, so is only offered by the validate_models command, not to web requests
+VALIDATE_MODE_DICT = {
+    'bulk': VALIDATE_BULK_DICT,
+}
+
+
 def validate(request, item_type, item_id):
     """
     :param request:
@@ -1488,11 +1638,28 @@ def validate(request, item_type, item_id):
         messages.error(request, "{}: {}".format(type(e).__name__, e.args))
         return redirect('main:error')
 
-    # Select the function to call from the dictionary
-    is_valid = VALIDATE_DEEP_DICT[item_type](item)
+    # A chosen set of rules can be run over a whole model, eg: ?rules=lint, and the time each one takes is returned
+    rule_set = request.GET.get('rules')
+    timings = []
+    if rule_set is not None and (rule_set not in RULE_SETS or item_type not in VALIDATE_BULK_DICT):
+        messages.error(request, "Could not run the validation rules '{}' on a {}".format(rule_set, item_type))
+        return redirect('main:error')
+
+    # Select the function to call from the dictionary, whole models can be checked with set-based queries instead,
+    # and models and components only check what has changed since they were last validated unless
+    # asked not to
+    mode = request.GET.get('mode')
+    if rule_set is not None:
+        is_valid = VALIDATE_BULK_DICT[item_type](item, rule_set=rule_set, timings=timings)
+    elif mode in VALIDATE_MODE_DICT and item_type in VALIDATE_MODE_DICT[mode]:
+        is_valid = VALIDATE_MODE_DICT[mode][item_type](item)
+    elif mode != 'full' and item_type in VALIDATE_INCREMENTAL_DICT:
+        is_valid = VALIDATE_INCREMENTAL_DICT[item_type](item)
+    else:
+        is_valid = VALIDATE_DEEP_DICT[item_type](item)
     item.is_valid = is_valid
     item.last_checked = datetime.datetime.now(pytz.utc)
-    item.save()
+    item.save(update_fields=VALIDATION_FIELDS)
 
     fields = []
     for field in LOCAL_DICT[item_type]:
@@ -1522,7 +1689,8 @@ def validate(request, item_type, item_id):
         'status': 200,
         'style': style,
         'last_checked': "{}".format(item.last_checked.strftime("%b. %d, %Y, %-I:%M %p")),
-        'fields': fields
+        'fields': fields,
+        'rules': [timing._asdict() for timing in timings],
     }
 
     return JsonResponse(data)
@@ -1554,8 +1722,22 @@ def ajax_validate(request):
         messages.error(request, "{}: {}".format(type(e).__name__, e.args))
         return redirect('main:error')
 
+    # The rules are set-based checks over a whole model, so can't be run on the other types of item
+    rule_set = request.GET.get('rules')
+    timings = []
+    if rule_set is not None and (rule_set not in RULE_SETS or item_type not in VALIDATE_BULK_DICT):
+        data = {
+            'status': 400,
+            'message': "Could not run the validation rules '{r}' on a {t}, they can only be run on a {b}".format(
+                r=rule_set, t=item_type, b=" or ".join(VALIDATE_BULK_DICT)),
+        }
+        return JsonResponse(data, status=400)
+
     # Select the function to call from the dictionary
-    is_valid = VALIDATE_SHALLOW_DICT[item_type](item)
+    if rule_set is not None:
+        is_valid = VALIDATE_BULK_DICT[item_type](item, rule_set=rule_set, timings=timings)
+    else:
+        is_valid = VALIDATE_SHALLOW_DICT[item_type](item)
     item.is_valid = is_valid
     item.last_checked = datetime.datetime.now(pytz.utc)
 
@@ -1566,18 +1748,49 @@ def ajax_validate(request):
 
     item.child_list = draw_object_child_tree(item)
 
-    item.save()
+    item.save(update_fields=VALIDATION_FIELDS)
 
     data = {
         'status': 200,
         # 'style': style,
         'html': error_tree,
         'is_valid': is_valid,
+        'rules': [timing._asdict() for timing in timings],
     }
 
     return JsonResponse(data)
 
 
+def ajax_validate_tree(request):
+    """
+    Validates an item and everything inside it, sending the result for each item as a server-sent event.
+    :param request:
+    :return:
+    """
+    item_type = request.GET.get('item_type')
+    item_id = request.GET.get('item_id')
+
+    try:
+        item_model = ContentType.objects.get(app_label="main", model=item_type)
+    except Exception as e:
+        messages.error(request, "Could not get object type called '{}'".format(item_type))
+        messages.error(request, "{}: {}".format(type(e).__name__, e.args))
+        return redirect('main:error')
+
+    try:
+        item = item_model.get_object_for_this_type(id=item_id)
+    except Exception as e:
+        messages.error(request, "Couldn't find {} object with id of '{}'".format(item_type, item_id))
+        messages.error(request, "{}: {}".format(type(e).__name__, e.args))
+        return redirect('main:error')
+
+    response = StreamingHttpResponse(stream_validation_events(item), content_type='text/event-stream')
+    # Each event is sent as soon as it is ready, rather than held back by a cache or proxy
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 def ajax_get_validation_list(request, item_type, item_id):
     item = None
 
@@ -1604,6 +1817,29 @@ def ajax_get_validation_list(request, item_type, item_id):
     return JsonResponse(data)
 
 
+@login_required
+def ajax_upload_status(request, job_id):
+    try:
+        job = UploadJob.objects.get(id=job_id, owner__user=request.user)
+    except UploadJob.DoesNotExist:
+        data = {
+            'status': 404,
+            'message': "Couldn't find UploadJob object with id of '{}'".format(job_id),
+        }
+        return JsonResponse(data, status=404)
+
+    data = {
+        'status': 200,
+        'job_status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'has_report': job.report is not None,
+        'url': None if job.model is None
+        else reverse('main:display', kwargs={'item_type': 'cellmodel', 'item_id': job.model.id}),
+    }
+    return JsonResponse(data)
+
+
 def refresh_error_tree(request, item_type, item_id):
     item = None
 
@@ -1623,7 +1859,7 @@ def refresh_error_tree(request, item_type, item_id):
 
     error_tree, error_count = draw_error_tree(item)
     item.error_tree = {'tree_html': error_tree, 'error_count': error_count}
-    item.save()
+    item.save(update_fields=VALIDATION_FIELDS)
 
     data = {
         'status': 200,
@@ -1656,7 +1892,7 @@ def set_validity(request):
     item.is_valid = int(todo) == 0
     error_tree, length_of_tree = draw_error_branch(item)
     item.error_tree = {'tree_html': error_tree, 'error_count': length_of_tree}
-    item.save()
+    item.save(update_fields=VALIDATION_FIELDS)
 
     data = {
         'status': 200
@@ -0,0 +1,197 @@
+"""
+    This file contains a CellML 2.0 writer which streams the document for a model straight from the database, as an
+    alternative to building a libCellML model with convert_to_cellml_model and printing it.  The components are read
+    a chunk at a time and written as soon as they are read, so neither a libCellML model nor the whole document is
+    ever held in memory.
+
+    The output has the same elements, attributes and values as libcellml.Printer gives for convert_to_cellml_model,
+    see main/tests/test_writer.py, although the two may lay out the whitespace differently.
+"""
+from xml.sax.saxutils import quoteattr
+
+from main.equivalence import find_connections
+from main.functions import get_components_for_export, get_compoundunits_for_export, add_equivalences_for_export
+
+CELLML_NAMESPACE = "http://www.cellml.org/cellml/2.0#"
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
+# Number of components read from the database, and held in memory, at once
+WRITER_CHUNK_SIZE = 100
+
+INDENT = "  "
+
+
+def format_number(value):
+    # The same as libCellML, which prints doubles with 15 significant digits, eg: 1.0 -> 1, 0.001 -> 0.001
+    return "{:.15g}".format(value)
+
+
+def write_tag(tag, attributes, depth, empty=False):
+    """
+    :param tag: element name
+    :param attributes: list of (name, value) tuples, those with an empty value are left out
+    :param depth: number of elements this one is inside
+    :param empty: True to close the element straight away
+    :return: the start tag as a string
+    """
+    attributes = "".join([" {n}={v}".format(n=name, v=quoteattr(str(value)))
+                          for name, value in attributes if value is not None and value != ""])
+    return "{i}<{t}{a}{e}>\n".format(i=INDENT * depth, t=tag, a=attributes, e="/" if empty else "")
+
+
+def write_end_tag(tag, depth):
+    return "{i}</{t}>\n".format(i=INDENT * depth, t=tag)
+
+
+def write_math(math_ml, depth):
+    # MathML is stored as written by libCellML, and so already contains its own namespace
+    return "{i}{m}\n".format(i=INDENT * depth, m=math_ml.strip())
+
+
+def write_compoundunit(in_compoundunit, depth):
+    attributes = [('name', in_compoundunit.name), ('id', in_compoundunit.cellml_id)]
+    units = list(in_compoundunit.product_of.all())
+    if not units:
+        return write_tag('units', attributes, depth, empty=True)
+
+    text = write_tag('units', attributes, depth)
+    for u in units:
+        exponent = 1.0 if u.exponent is None else u.exponent
+        multiplier = 1.0 if u.multiplier is None else u.multiplier
+        text += write_tag('unit', [
+            ('exponent', format_number(exponent) if exponent != 1.0 else None),
+            ('multiplier', format_number(multiplier) if multiplier != 1.0 else None),
+            ('prefix', u.prefix.name if u.prefix is not None else None),
+            ('units', u.child_cu.name if u.child_cu is not None else u.name),
+        ], depth + 1, empty=True)
+    return text + write_end_tag('units', depth)
+
+
+def write_variable(in_variable, depth):
+    if in_variable.initial_value_variable is not None:
+        initial_value = in_variable.initial_value_variable.name
+    elif in_variable.initial_value_constant is not None:
+        initial_value = format_number(in_variable.initial_value_constant)
+    else:
+        initial_value = None
+
+    return write_tag('variable', [
+        ('name', in_variable.name),
+        ('units', in_variable.compoundunit.name if in_variable.compoundunit is not None else None),
+        ('initial_value', initial_value),
+        ('id', in_variable.cellml_id),
+    ], depth, empty=True)
+
+
+def write_reset(in_reset, depth):
+    attributes = [
+        ('variable', in_reset.variable.name if in_reset.variable is not None else None),
+        ('test_variable', in_reset.test_variable.name if in_reset.test_variable is not None else None),
+        ('order', in_reset.order),
+        ('id', in_reset.cellml_id),
+    ]
+    values = [(tag, math.math_ml) for tag, math in [('test_value', in_reset.test_value),
+                                                    ('reset_value', in_reset.reset_value)]
+              if math is not None and math.math_ml]
+    if not values:
+        return write_tag('reset', attributes, depth, empty=True)
+
+    text = write_tag('reset', attributes, depth)
+    for tag, math_ml in values:
+        text += write_tag(tag, [], depth + 1) + write_math(math_ml, depth + 2) + write_end_tag(tag, depth + 1)
+    return text + write_end_tag('reset', depth)
+
+
+def write_component(in_component, depth):
+    attributes = [('name', in_component.name), ('id', in_component.cellml_id)]
+    variables = list(in_component.variables.all())
+    resets = list(in_component.resets.all())
+    maths = [m.math_ml for m in in_component.maths.all() if m.math_ml]
+    if not variables and not resets and not maths:
+        return write_tag('component', attributes, depth, empty=True)
+
+    text = write_tag('component', attributes, depth)
+    text += "".join([write_variable(v, depth + 1) for v in variables])
+    text += "".join([write_reset(r, depth + 1) for r in resets])
+    text += "".join([write_math(m, depth + 1) for m in maths])
+    return text + write_end_tag('component', depth)
+
+
+def write_connection(component_1, component_2, names, depth):
+    text = write_tag('connection', [('component_1', component_1), ('component_2', component_2)], depth)
+    for name_1, name_2 in names:
+        text += write_tag('map_variables', [('variable_1', name_1), ('variable_2', name_2)], depth + 1, empty=True)
+    return text + write_end_tag('connection', depth)
+
+
+def write_component_ref(component_id, names, children, depth):
+    if not children.get(component_id):
+        return write_tag('component_ref', [('component', names[component_id])], depth, empty=True)
+
+    text = write_tag('component_ref', [('component', names[component_id])], depth)
+    for child_id in children[component_id]:
+        text += write_component_ref(child_id, names, children, depth + 1)
+    return text + write_end_tag('component_ref', depth)
+
+
+def get_component_order(listed):
+    """
+    Puts the components in the order libCellML prints them: each one is followed by those it encapsulates.
+    :param listed: list of (id, parent component id) tuples in id order
+    :return: tuple of (list of component ids in order, dictionary of {parent id: [child ids]})
+    """
+    ids = set([component_id for component_id, parent_id in listed])
+    children = {}
+    for component_id, parent_id in listed:
+        # A parent outside the model is treated as no parent, as convert_to_cellml_model does
+        children.setdefault(parent_id if parent_id in ids else None, []).append(component_id)
+
+    order = []
+    stack = list(reversed(children.get(None, [])))
+    while stack:
+        component_id = stack.pop()
+        order.append(component_id)
+        stack.extend(reversed(children.get(component_id, [])))
+    return order, children
+
+
+def stream_cellml_model(in_model, chunk_size=WRITER_CHUNK_SIZE):
+    """
+    Writes a model as a CellML 2.0 document, piece by piece.
+    :param in_model: CellModel instance
+    :param chunk_size: (optional) number of components read from the database at once
+    :return: generator of strings, which joined together give the whole document
+    """
+    compoundunits = list(get_compoundunits_for_export().filter(models=in_model))
+    listed = list(in_model.all_components.order_by('id').values_list('id', 'name', 'parent_component_id'))
+    names = {component_id: name for component_id, name, parent_id in listed}
+    order, children = get_component_order([(component_id, parent_id) for component_id, name, parent_id in listed])
+
+    attributes = [('xmlns', CELLML_NAMESPACE), ('name', in_model.name), ('id', in_model.cellml_id)]
+    if not compoundunits and not order:
+        yield XML_DECLARATION + write_tag('model', attributes, 0, empty=True)
+        return
+
+    yield XML_DECLARATION + write_tag('model', attributes, 0)
+    yield "".join([write_compoundunit(cu, 1) for cu in compoundunits])
+
+    # Only the ids and names of the variables are kept from each chunk, to write the connections at the end
+    variables = {}
+    pairs = []
+    for first in range(0, len(order), chunk_size):
+        chunk = order[first:first + chunk_size]
+        components = {c.id: c for c in get_components_for_export().filter(id__in=chunk)}
+        for component_id in chunk:
+            add_equivalences_for_export(components[component_id], variables, pairs)
+        yield "".join([write_component(components[component_id], 1) for component_id in chunk])
+
+    yield "".join([write_connection(names[component_1], names[component_2], connection_names, 1)
+                   for component_1, component_2, connection_names in find_connections(pairs, variables)])
+
+    if any([parent_id is not None for parent_id in children]):
+        yield write_tag('encapsulation', [], 1) + "".join(
+            [write_component_ref(component_id, names, children, 2) for component_id in children[None]
+             if children.get(component_id)]) + write_end_tag('encapsulation', 1)
+
+    yield write_end_tag('model', 0)